@@ -1,35 +1,2514 @@
+import asyncio
+import atexit
+import contextvars
+import hashlib
+import hmac
+import json
+import math
 import os
-from modal import App, Image, Volume, Secret, asgi_app
+import random
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+# Container init time (imports + client setup), reported on cold starts
+_module_started = time.perf_counter()
+
+import modal
+from modal import App, Image, Volume, Secret, Dict, asgi_app
+
+# ==========================================
+# Flexible API Key Loading
+# ==========================================
+def get_api_key(key_name):
+    """Flexible API key loading for multiple environments."""
+    key = os.environ.get(key_name)
+    if key:
+        print(f"✅ Using {key_name} from environment variable")
+        return key
+    print(f"⚠️ {key_name} not found in environment")
+    return None
+
+
+def load_api_keys(key_name):
+    """
+    All keys for a provider: `<KEY_NAME>S` (comma or whitespace separated)
+    plus `<KEY_NAME>` itself, in order and without duplicates.
+    """
+    keys = os.environ.get(f"{key_name}S", "").replace(",", " ").split()
+    single = os.environ.get(key_name)
+    if single:
+        keys.append(single)
+    return list(dict.fromkeys(keys))
+
+# ==========================================
+# Modal Image with New Google GenAI SDK
+# ==========================================
+image = (
+    Image.debian_slim()
+    .apt_install("ffmpeg")
+    .pip_install(
+        "google-genai>=1.0.0",  # New unified SDK with context caching
+        "elevenlabs>=1.0.0",
+        "mcp>=1.29,<2",  # FastMCP API; 1.29 is the first that delivers progress over stateless HTTP
+        "fastapi",
+        "uvicorn",
+    )
+)
+
+# SDKs are imported at module level so memory snapshots include them (and the
+# clients built at import time); locally they are optional
+with image.imports():
+    from google import genai
+    from google.genai import types
+with image.imports():
+    from elevenlabs.client import ElevenLabs
+
+app = App("mcp-video-agent")
+vol = Volume.from_name("video-storage", create_if_missing=True)
+
+# Cross-container ingest leases (one Gemini upload per video at a time)
+ingest_leases = Dict.from_name("video-agent-ingest-leases", create_if_missing=True)
+# Lightweight per-video usage and counters (kept off the volume to avoid commits)
+video_stats = Dict.from_name("video-agent-stats", create_if_missing=True)
+# Summaries of older conversation turns, keyed by a hash of the summarized turns
+conversation_summaries = Dict.from_name("video-agent-summaries", create_if_missing=True)
+# ffprobe metadata per video, keyed by content hash (or volume filename)
+media_info = Dict.from_name("video-agent-media", create_if_missing=True)
+# Latest stage of requests that asked for progress, keyed by request ID (MCP tools poll it)
+request_progress = Dict.from_name("video-agent-progress", create_if_missing=True)
+
+DATA_DIR = "/data"
+CACHE_INFO_DIR = f"{DATA_DIR}/cache_info"
+
+# Volume writes on the request path (ingest records, clips) are committed in
+# the background, batched over VOLUME_COMMIT_DELAY_SECONDS; VOLUME_WRITE_BEHIND=0
+# commits each write synchronously as before
+VOLUME_WRITE_BEHIND = os.environ.get("VOLUME_WRITE_BEHIND", "1") == "1"
+VOLUME_COMMIT_DELAY_SECONDS = float(os.environ.get("VOLUME_COMMIT_DELAY_SECONDS", "0.5"))
+
+INGEST_LEASE_SECONDS = int(os.environ.get("INGEST_LEASE_SECONDS", "600"))
+INGEST_WAIT_SECONDS = int(os.environ.get("INGEST_WAIT_SECONDS", "540"))
+
+# Gemini Files expire 48h after upload; within the verify window a recorded
+# file is trusted without a files.get round trip before each question
+GEMINI_FILE_TTL_SECONDS = 48 * 3600
+FILE_VERIFY_WINDOW_SECONDS = int(os.environ.get("FILE_VERIFY_WINDOW_SECONDS", "900"))
+FILE_EXPIRY_MARGIN_SECONDS = 300
+
+# Background refresh: re-ingest videos used recently whose file expires soon
+REFRESH_HOT_WINDOW_SECONDS = int(os.environ.get("REFRESH_HOT_WINDOW_SECONDS", str(24 * 3600)))
+REFRESH_AHEAD_SECONDS = int(os.environ.get("REFRESH_AHEAD_SECONDS", str(3 * 3600)))
+REFRESH_PARALLELISM = int(os.environ.get("REFRESH_PARALLELISM", "4"))
+
+# Prompt layout: [system instruction][video][earlier-turn summaries][recent turns][question]
+# Everything before the question stays byte-identical across turns so Gemini's
+# implicit prefix cache can reuse it.
+SYSTEM_INSTRUCTION = (
+    "You are a video analysis assistant answering questions about the attached video. "
+    "Answers are read aloud, so write plain prose without markdown or lists. "
+    "Be direct and informative. Do NOT mention specific timestamps unless asked."
+)
+ANSWER_LENGTH_INSTRUCTION = "Please provide a concise response within {low}-{high} words."
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_SUMMARY_BLOCK = 4  # turns per summary block (2 question/answer pairs)
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gemini-2.5-flash-lite")
+
+# Answer budget: the length instruction and max_output_tokens are set per
+# question so the answer and its speech are both done within
+# ANSWER_AUDIO_TARGET_SECONDS of the question reaching the backend. Time per
+# output token (Gemini) and per character (ElevenLabs) is fitted from recent
+# calls; the question type caps the length even when time allows more.
+# ANSWER_BUDGET=0 asks every question for 150-200 words without a token cap.
+ANSWER_BUDGET = os.environ.get("ANSWER_BUDGET", "1") == "1"
+ANSWER_AUDIO_TARGET_SECONDS = float(os.environ.get("ANSWER_AUDIO_TARGET_SECONDS", "15"))
+ANSWER_BUDGET_RESERVE_SECONDS = 1.0  # Space round trips between the answer and its speech
+ANSWER_WORDS = {"short": 60, "standard": 140, "detailed": 200}  # most words per question type
+ANSWER_MIN_WORDS = 30
+ANSWER_THINKING_TOKENS = {"short": 0, "standard": 512, "detailed": 2048}
+THINKING_MODELS = {"gemini-2.5-flash"}  # others do not think unless asked
+TOKENS_PER_WORD = 1.35
+CHARS_PER_WORD = 6.0  # including the space
+ANSWER_TOKEN_SLACK = 1.2  # max_output_tokens headroom over the word budget
+# (fixed seconds, seconds per unit) until BUDGET_MIN_SAMPLES calls are measured;
+# units are output tokens for Gemini and characters for TTS
+THROUGHPUT_DEFAULTS = {
+    "gemini-2.5-flash": (3.0, 1 / 150),
+    "gemini-2.5-flash-lite": (1.5, 1 / 250),
+    "tts": (0.6, 1 / 250),
+}
+BUDGET_MIN_SAMPLES = 10
+THROUGHPUT_REFRESH_SECONDS = 60  # how often question containers reload TTS samples
+
+# Time-range questions: "offsets" sends video_metadata start/end offsets with the
+# full file; "ffmpeg" always cuts (and caches) a clip that is ingested on its own
+CLIP_MODE = os.environ.get("CLIP_MODE", "offsets")
+CLIPS_DIR = f"{DATA_DIR}/clips"
+
+# Small videos skip the Files API upload and PROCESSING poll: they are sent as
+# inline bytes in generate_content until they become hot, then ingested once.
+# Gemini caps a request at 20MB and inline bytes are base64-encoded (+33%).
+INLINE_MAX_BYTES = int(float(os.environ.get("INLINE_MAX_MB", "8")) * 1024 * 1024)
+INLINE_MAX_SECONDS = int(os.environ.get("INLINE_MAX_SECONDS", "120"))
+# Counted by claiming inline_question/<video>/<n> slots with skip_if_exists,
+# so concurrent questions are never lost and exactly one starts the ingest
+INLINE_HOT_QUESTIONS = int(os.environ.get("INLINE_HOT_QUESTIONS", "3"))
+
+# Media preflight: ffprobe runs before any Gemini upload. Unreadable files,
+# files without a video stream and videos longer than MAX_VIDEO_SECONDS are
+# rejected; codecs Gemini does not decode are transcoded to H.264 once; videos
+# longer than LOW_RESOLUTION_SECONDS use low media resolution (~100 instead of
+# ~300 tokens per second) so they fit the context window.
+MAX_VIDEO_SECONDS = int(os.environ.get("MAX_VIDEO_SECONDS", "7200"))
+LOW_RESOLUTION_SECONDS = int(os.environ.get("LOW_RESOLUTION_SECONDS", "2700"))
+GEMINI_VIDEO_CODECS = {"h264", "hevc", "vp8", "vp9", "av1", "mpeg4", "mpeg2video", "mpeg1video", "wmv3", "flv1"}
+TRANSCODED_DIR = f"{DATA_DIR}/transcoded"
+# Transcodes run in their own function; questions wait at most TRANSCODE_WAIT_SECONDS
+# for the copy (well inside their 600 s timeout) and otherwise ask the user to come back
+TRANSCODE_TIMEOUT_SECONDS = int(os.environ.get("TRANSCODE_TIMEOUT_SECONDS", "3600"))
+TRANSCODE_WAIT_SECONDS = int(os.environ.get("TRANSCODE_WAIT_SECONDS", "420"))
+TRANSCODE_POLL_SECONDS = 5
+
+# Chunked uploads: the Space uploads large videos as parts under
+# uploads/<upload id>/ and _internal_assemble_upload joins them after
+# checking each part's SHA-256
+UPLOADS_DIR = f"{DATA_DIR}/uploads"
+
+# Digest: one timestamped timeline per video, used to answer text-answerable
+# follow-ups without sending the video again
+DIGESTS_DIR = f"{DATA_DIR}/digests"
+DIGEST_MODEL = os.environ.get("DIGEST_MODEL", "gemini-2.5-flash")
+DIGEST_ANSWER_MODEL = os.environ.get("DIGEST_ANSWER_MODEL", "gemini-2.5-flash-lite")
+DIGEST_ESCALATION_TOKEN = "NEED_VIDEO"
+
+# Model routing for full video questions: "auto" sends simple questions to the
+# fast tier and reasoning-heavy ones to the standard model ("standard" / "fast" pin one)
+MODEL_ROUTING = os.environ.get("MODEL_ROUTING", "auto")
+STANDARD_MODEL = "gemini-2.5-flash"
+FAST_MODEL = os.environ.get("FAST_MODEL", "gemini-2.5-flash-lite")
+ROUTER_LONG_VIDEO_SECONDS = 20 * 60
+ROUTER_SLOW_P95_SECONDS = float(os.environ.get("ROUTER_SLOW_P95_SECONDS", "20"))
+
+# Cold starts: user-facing functions restore from a memory snapshot taken after
+# imports and client setup (MEMORY_SNAPSHOT=0 at deploy time turns it off)
+MEMORY_SNAPSHOT = os.environ.get("MEMORY_SNAPSHOT", "1") == "1"
+
+# Warm pools: a scheduled job sizes min/buffer containers of the user-facing
+# functions from the busiest minute of recent traffic, within a cost cap
+# (WARM_POOL_BUDGET_USD_PER_HOUR=0 keeps everything scale-to-zero)
+WARM_POOL_WINDOW_MINUTES = 15
+WARM_POOL_BUDGET_USD_PER_HOUR = float(os.environ.get("WARM_POOL_BUDGET_USD_PER_HOUR", "0.10"))
+CONTAINER_COST_USD_PER_HOUR = float(os.environ.get("CONTAINER_COST_USD_PER_HOUR", "0.05"))
+# Per function: inputs served at once, typical seconds per request, container cap
+WARM_POOL_FUNCTIONS = {
+    "_internal_analyze_video": {"max_inputs": 8, "busy_seconds": 8, "max_containers": 5},
+    "_internal_speak_text": {"max_inputs": 1, "busy_seconds": 3, "max_containers": 5},
+}
+
+# Cross-video search: BM25 inverted index over digests, stored on the volume
+SEARCH_INDEX_PATH = f"{DATA_DIR}/search_index/index.json"
+SEARCH_INDEX_LEASE = "__search_index__"
+# Held for the update function's whole timeout, so it cannot expire mid-run
+SEARCH_INDEX_TIMEOUT = 900
+
+# Bulk ingest: library videos live under library/ on the volume
+BULK_PREFIX = "library"
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv", ".avi", ".mpeg", ".mpg", ".3gp", ".wmv", ".flv")
+
+# Speech: ElevenLabs output_format -> (file extension, MIME type, kbps). Spoken
+# word stays clear far below music bitrates, so clients on slow links ask for a
+# smaller format; synthesized audio is cached on the volume per text and format.
+TTS_FORMATS = {
+    "mp3_44100_128": ("mp3", "audio/mpeg", 128),
+    "mp3_44100_64": ("mp3", "audio/mpeg", 64),
+    "mp3_22050_32": ("mp3", "audio/mpeg", 32),
+    "opus_48000_64": ("ogg", "audio/ogg", 64),
+    "opus_48000_32": ("ogg", "audio/ogg", 32),
+}
+DEFAULT_TTS_FORMAT = os.environ.get("TTS_OUTPUT_FORMAT", "mp3_44100_128")
+TTS_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_CACHE_DIR = f"{DATA_DIR}/tts_cache"
+# Pruned hourly: entries unused for the max age go first, then the least recently used
+# until under the size cap
+TTS_CACHE_MAX_AGE_HOURS = float(os.environ.get("TTS_CACHE_MAX_AGE_HOURS", "72"))
+TTS_CACHE_MAX_MB = float(os.environ.get("TTS_CACHE_MAX_MB", "1024"))
+
+# Upstream calls: per-call deadlines, jittered retries on transient errors,
+# hedging after the recent p95 and a per-provider circuit breaker
+GENERATE_DEADLINE_SECONDS = float(os.environ.get("GENERATE_DEADLINE_SECONDS", "90"))
+DIGEST_DEADLINE_SECONDS = float(os.environ.get("DIGEST_DEADLINE_SECONDS", "600"))
+TTS_DEADLINE_SECONDS = float(os.environ.get("TTS_DEADLINE_SECONDS", "45"))
+UPSTREAM_MAX_ATTEMPTS = int(os.environ.get("UPSTREAM_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8.0
+HEDGE_MIN_SAMPLES = 20  # no hedging until the p95 is based on this many calls
+TTS_HEDGE = os.environ.get("TTS_HEDGE", "0") == "1"  # TTS is billed per character
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Key pools: calls go to the key with the most headroom in the last minute.
+# Limits are per container, so set them to the provider limit / max containers
+# (429s back off the throttled key if containers overshoot together).
+GEMINI_KEY_RPM = int(os.environ.get("GEMINI_KEY_RPM", "1000"))
+GEMINI_KEY_TPM = int(os.environ.get("GEMINI_KEY_TPM", "1000000"))
+ELEVENLABS_KEY_RPM = int(os.environ.get("ELEVENLABS_KEY_RPM", "100"))
+ELEVENLABS_KEY_CHARS_PER_MINUTE = int(os.environ.get("ELEVENLABS_KEY_CHARS_PER_MINUTE", "50000"))
+KEY_THROTTLE_MAX_SECONDS = 60.0
+KEY_WINDOW_MARGIN = 0.02  # providers count a request on arrival, slightly after its slot
+
+# MCP server: bearer tokens map to client names via the my-mcp-secret secret
+# (MCP_CLIENT_TOKENS='{"<token>": "<client>"}'); each client may ask
+# MCP_QUESTIONS_PER_HOUR questions (a batch counts every question, speech and
+# ingest count one each). Limits are kept in memory, so the server runs in
+# one container that serves many clients at once.
+MCP_QUESTIONS_PER_HOUR = int(os.environ.get("MCP_QUESTIONS_PER_HOUR", "30"))
+MCP_MAX_BATCH = int(os.environ.get("MCP_MAX_BATCH", "10"))
+MCP_BATCH_PARALLELISM = 4
+MCP_PROGRESS_POLL_SECONDS = 0.5
+# Stages reported to MCP clients while a request runs
+PROGRESS_STAGES = {
+    "volume_wait": "Waiting for the video on the volume",
+    "media_probe": "Checking the video",
+    "transcode": "Transcoding the video to H.264",
+    "clip_cut": "Cutting the requested time range",
+    "upload": "Uploading the video to Gemini",
+    "processing_poll": "Gemini is processing the video",
+    "generate": "Generating the answer",
+    "tts": "Synthesizing speech",
+}
+
+# USD per 1M tokens (paid tier); thinking tokens are billed as output
+MODEL_PRICING = {
+    "gemini-2.5-flash": {"input": 0.30, "cached_input": 0.03, "output": 2.50},
+    "gemini-2.5-flash-lite": {"input": 0.10, "cached_input": 0.01, "output": 0.40},
+}
+# Each request's usage is its own key; a scheduled rollup folds them into totals
+USAGE_ROLLUP_LEASE = "__usage_rollup__"
+USAGE_REPORT_DAYS = 7
+
+
+# ==========================================
+# Tracing: Structured Per-Stage Latency Spans
+# ==========================================
+# Spans are printed as one JSON object per line and share the request ID the
+# Space sends along, so `python tools/latency_report.py` can aggregate Space
+# and backend logs into per-stage p50/p95/p99.
+_request_id = contextvars.ContextVar("request_id", default=None)
+# Set for requests whose caller polls request_progress
+_report_progress = contextvars.ContextVar("report_progress", default=False)
+# Wall clock when the current request was sent (its answer budget starts then)
+_request_started = contextvars.ContextVar("request_started", default=None)
+
+
+def _emit_span(record):
+    """Write one span record to the function logs."""
+    print(json.dumps(record), flush=True)
+
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Time a stage of the current request and emit it as a JSON span.
+    
+    Yields the attrs dict so callers can attach details (sizes, states...).
+    """
+    if _report_progress.get() and stage in PROGRESS_STAGES:
+        _in_background(request_progress.put, _request_id.get(),
+                       {"stage": stage, "message": PROGRESS_STAGES[stage], "ts": time.time()})
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _emit_span({
+            "event": "span",
+            "component": "backend",
+            "request_id": _request_id.get(),
+            "stage": stage,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "ts": time.time(),
+            **attrs
+        })
+
+
+_container = {"requests": 0, "loaded_at": time.time()}
+_container_lock = threading.Lock()
+
+
+def _begin_request(request_id=None, sent_at=None, function_name=None, progress=False):
+    """
+    Bind a request ID to this call and record how long it sat in the queue.
+    
+    sent_at is the caller's wall clock when it issued .remote(), so queue wait
+    includes cross-host clock skew (normally well under the stage latencies).
+    The first request of a container is marked cold: its queue wait includes
+    the container start, and a container_start span reports the init time.
+    Requests to the functions named in WARM_POOL_FUNCTIONS are counted for
+    the warm-pool autoscaler. With progress=True the stages in PROGRESS_STAGES
+    are published to request_progress under the request ID as they start.
+    """
+    _request_id.set(request_id or uuid.uuid4().hex[:12])
+    _report_progress.set(progress and request_id is not None)
+    _request_started.set(min(sent_at, time.time()) if sent_at else time.time())
+    with _container_lock:
+        _container["requests"] += 1
+        cold = _container["requests"] == 1
+    if cold:
+        _emit_span({
+            "event": "span",
+            "component": "backend",
+            "request_id": _request_id.get(),
+            "stage": "container_start",
+            "duration_ms": round(_init_seconds * 1000, 1),
+            "ts": time.time(),
+            "cold": True,
+            "snapshot": MEMORY_SNAPSHOT,
+            "function": function_name
+        })
+    if sent_at:
+        _emit_span({
+            "event": "span",
+            "component": "backend",
+            "request_id": _request_id.get(),
+            "stage": "queue_wait",
+            "duration_ms": round(max(0.0, time.time() - sent_at) * 1000, 1),
+            "ts": time.time(),
+            "cold": cold
+        })
+    if function_name in WARM_POOL_FUNCTIONS:
+        _in_background(_record_traffic, function_name)
+
+
+# ==========================================
+# Singleflight: Coalesce Duplicate In-Flight Work
+# ==========================================
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+    
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is still running wait on the same future and receive the
+    leader's result (or exception) instead of repeating the upstream call.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, fn):
+        """
+        Run fn() once per in-flight key.
+        
+        Returns:
+            tuple: (result, shared) where shared is True for coalesced callers
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+# Per-container coalescing: ingest by video, queries by (video, question), speech by (text, format),
+# transcode waits by video
+_ingest_flight = SingleFlight()
+_transcode_flight = SingleFlight()
+_query_flight = SingleFlight()
+_speech_flight = SingleFlight()
+
+
+# ==========================================
+# Resilience: Deadlines, Retries, Hedging, Circuit Breakers
+# ==========================================
+class DeadlineExceeded(TimeoutError):
+    """An upstream call did not finish within its deadline."""
+
+
+class CircuitOpenError(Exception):
+    """The provider's circuit is open; the call was rejected without trying."""
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} is unavailable (failing fast, retrying in {retry_in:.0f}s)")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one provider (per container).
+    
+    After `failure_threshold` transient failures in a row the circuit opens
+    and calls fail fast for `reset_seconds`; then a single probe call is let
+    through, which closes the circuit on success or re-opens it on failure.
+    """
+    def __init__(self, provider, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+    
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            retry_in = self._opened_at + self.reset_seconds - time.monotonic()
+            if retry_in > 0 or self._probing:
+                raise CircuitOpenError(self.provider, max(retry_in, 0))
+            self._probing = True
+    
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"🟢 {self.provider} circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+    
+    def record_throttled(self):
+        """A 429: says nothing about the provider's health, but frees the probe slot."""
+        with self._lock:
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    print(f"🔴 {self.provider} circuit open after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyTracker:
+    """Rolling window of successful call durations, used to pick the hedge delay."""
+    def __init__(self, size=200):
+        self._samples = []
+        self._size = size
+        self._lock = threading.Lock()
+    
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            if len(self._samples) > self._size:
+                self._samples.pop(0)
+    
+    def p95(self):
+        """The recent p95 in seconds, or None until there are enough samples."""
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+_breakers = {provider: CircuitBreaker(provider) for provider in ("gemini", "elevenlabs")}
+_latencies = {}
+_latencies_lock = threading.Lock()
+# Upstream calls run on these threads so the caller can stop waiting at the
+# deadline (the SDK call itself cannot be cancelled and finishes in the background)
+_upstream_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream")
+
+
+def _status_code(error):
+    """HTTP status of an SDK error (google-genai uses .code, ElevenLabs .status_code)."""
+    return getattr(error, "code", None) or getattr(error, "status_code", None)
+
+
+def _is_transient(error):
+    """Whether an upstream error is worth retrying (and counts against the breaker)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx  # transport used by both SDKs
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    return _status_code(error) in TRANSIENT_STATUS_CODES
+
+
+def _latency_tracker(provider, op):
+    with _latencies_lock:
+        return _latencies.setdefault((provider, op), LatencyTracker())
+
+
+def _run_hedged(fn, timeout, hedge_delay):
+    """
+    Run fn on the upstream pool and wait up to timeout seconds.
+    
+    When hedge_delay is set and the first call is still running after it, an
+    identical second call is started and the first success wins.
+    
+    Returns:
+        tuple: (result, hedged, hedge_won)
+    """
+    if timeout <= 0:
+        raise DeadlineExceeded("deadline already passed")
+    deadline = time.monotonic() + timeout
+    futures = [_upstream_pool.submit(contextvars.copy_context().run, fn)]
+    if hedge_delay is not None and hedge_delay < timeout:
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done:
+            futures.append(_upstream_pool.submit(contextvars.copy_context().run, fn))
+    
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(f"no response within {timeout:.1f}s")
+        for future in done:
+            if future.exception() is None:
+                return future.result(), len(futures) > 1, future is not futures[0]
+            error = error or future.exception()
+    raise error
+
+
+def _call_upstream(provider, op, fn, deadline_seconds, hedge=False, max_attempts=None,
+                   pool=None, key_id=None, tokens=0):
+    """
+    Call an upstream API with a deadline, retries, optional hedging and a breaker.
+    
+    Transient failures (429/5xx, timeouts, connection errors) are retried
+    with full-jitter exponential backoff while the deadline allows; other
+    errors are raised immediately so callers can handle them (e.g. a missing
+    Gemini file). Only pass hedge=True for idempotent calls.
+    
+    With a KeyPool, fn(key) is called with a key picked per attempt (pinned
+    to key_id when given), so retries and hedges can land on another key.
+    A 429 is per-key throttling, not an outage: it cools down that key in the
+    pool and is retried without counting against the provider's breaker.
+    """
+    if pool is not None:
+        fn = _pooled(pool, fn, key_id, tokens)
+    breaker = _breakers[provider]
+    tracker = _latency_tracker(provider, op)
+    max_attempts = max_attempts or UPSTREAM_MAX_ATTEMPTS
+    deadline = time.monotonic() + deadline_seconds
+    
+    with span("upstream", provider=provider, op=op) as attrs:
+        for attempt in range(1, max_attempts + 1):
+            attrs["attempts"] = attempt
+            breaker.before_call()
+            remaining = deadline - time.monotonic()
+            start = time.monotonic()
+            try:
+                result, hedged, hedge_won = _run_hedged(fn, remaining, tracker.p95() if hedge else None)
+            except Exception as e:
+                if not _is_transient(e):
+                    breaker.record_success()  # the provider answered; the request was bad
+                    raise
+                throttled = _status_code(e) == 429
+                if throttled:
+                    breaker.record_throttled()
+                else:
+                    breaker.record_failure()
+                backoff = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+                if throttled and pool is not None:
+                    backoff = 0  # the pool cools the key down and acquire() picks or waits for another
+                if attempt == max_attempts or time.monotonic() + backoff >= deadline:
+                    raise
+                print(f"⚠️ {provider} {op} failed ({e}), retry {attempt}/{max_attempts - 1} in {backoff:.1f}s")
+                time.sleep(backoff)
+                continue
+            
+            breaker.record_success()
+            tracker.record(time.monotonic() - start)
+            if hedged:
+                attrs["hedged"] = True
+                attrs["hedge_won"] = hedge_won
+            return result
+
+
+# ==========================================
+# API Key Pools: Quota-Aware Key Scheduling
+# ==========================================
+class KeyPool:
+    """
+    API keys for one provider, scheduled by remaining per-minute headroom.
+    
+    Requests and tokens (characters for TTS) are tracked per key over a
+    sliding window. acquire() returns the key with the most headroom, waits
+    for the next free slot when every key is out of budget, and a 429 cools
+    down only that key.
+    """
+    def __init__(self, provider, keys, requests_per_window, tokens_per_window, window_seconds=60.0, usage_of=None):
+        self.provider = provider
+        self.keys = list(dict.fromkeys(keys))
+        self.requests_per_window = requests_per_window
+        self.tokens_per_window = tokens_per_window
+        self.window_seconds = window_seconds
+        self.usage_of = usage_of
+        self._lock = threading.Lock()
+        self._events = {key: [] for key in self.keys}  # [monotonic time, tokens]
+        self._cooldown_until = {key: 0.0 for key in self.keys}
+        self._throttle_streak = {key: 0 for key in self.keys}
+        self.totals = {key: {"requests": 0, "tokens": 0, "throttled": 0} for key in self.keys}
+    
+    @staticmethod
+    def key_id(key):
+        """Short fingerprint that is safe to log and store."""
+        return hashlib.sha256(key.encode()).hexdigest()[:8]
+    
+    def get(self, key_id=None):
+        """The key with this fingerprint, or the first key (which owns legacy records)."""
+        for key in self.keys:
+            if key_id and self.key_id(key) == key_id:
+                return key
+        return self.keys[0] if self.keys else None
+    
+    def _window(self, key, now):
+        events = self._events[key]
+        while events and events[0][0] <= now - self.window_seconds:
+            events.pop(0)
+        return len(events), sum(tokens for _, tokens in events)
+    
+    def _headroom(self, key, now):
+        requests, tokens = self._window(key, now)
+        return min(1 - requests / self.requests_per_window, 1 - tokens / self.tokens_per_window)
+    
+    def _next_slot(self, key, now, tokens):
+        """Earliest time (>= now and after earlier reservations) one more call fits in the window."""
+        events = self._events[key]
+        slot = max(now, events[-1][0]) if events else now
+        start, used = 0, sum(t for _, t in events)
+        while start < len(events) and events[start][0] <= slot - self.window_seconds:
+            used -= events[start][1]
+            start += 1
+        while len(events) - start >= self.requests_per_window or (
+                start < len(events) and used + tokens > self.tokens_per_window):
+            slot = events[start][0] + self.window_seconds * (1 + KEY_WINDOW_MARGIN)
+            used -= events[start][1]
+            start += 1
+        return max(slot, self._cooldown_until[key])
+    
+    def acquire(self, key_id=None, tokens=0):
+        """
+        Reserve one request (and `tokens`) on the key that can take it soonest,
+        preferring the most headroom; sleeps until the reserved slot.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [self.get(key_id)] if key_id else self.keys
+            slots = {key: self._next_slot(key, now, tokens) for key in candidates}
+            key = min(candidates, key=lambda k: (slots[k], -self._headroom(k, now)))
+            self._events[key].append([slots[key], tokens])
+            self.totals[key]["requests"] += 1
+            self.totals[key]["tokens"] += tokens
+        wait_s = slots[key] - now
+        if wait_s > 0:
+            print(f"⏳ {self.provider} key {self.key_id(key)} out of headroom, waiting {wait_s:.1f}s")
+            time.sleep(wait_s)
+        return key
+    
+    def settle(self, key, result, estimated_tokens=0):
+        """Replace the token estimate with actual usage and clear the throttle streak."""
+        actual = self.usage_of(result) if self.usage_of else None
+        with self._lock:
+            self._throttle_streak[key] = 0
+            if actual is not None and self._events[key]:
+                self._events[key][-1][1] += actual - estimated_tokens
+                self.totals[key]["tokens"] += actual - estimated_tokens
+    
+    def throttled(self, key):
+        """A 429 on this key: exponential, jittered cooldown for this key only."""
+        with self._lock:
+            self.totals[key]["throttled"] += 1
+            if time.monotonic() < self._cooldown_until[key]:
+                return  # calls already in flight when the cooldown started
+            self._throttle_streak[key] += 1
+            cooldown = min(KEY_THROTTLE_MAX_SECONDS, 2 ** (self._throttle_streak[key] - 1))
+            cooldown *= random.uniform(0.5, 1.0)
+            self._cooldown_until[key] = time.monotonic() + cooldown
+        print(f"🚦 {self.provider} key {self.key_id(key)} throttled, cooling down {cooldown:.1f}s")
+    
+    def snapshot(self):
+        """Per-key usage in the current window plus lifetime totals."""
+        with self._lock:
+            now = time.monotonic()
+            rows = []
+            for key in self.keys:
+                requests, tokens = self._window(key, now)
+                rows.append({
+                    "key": self.key_id(key),
+                    "window_requests": requests,
+                    "window_tokens": tokens,
+                    "headroom": round(self._headroom(key, now), 3),
+                    "cooling_down_s": round(max(0.0, self._cooldown_until[key] - now), 1),
+                    **self.totals[key]
+                })
+        return rows
+
+
+def _gemini_usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage else None
+
+
+_key_pools = {}
+_key_pools_lock = threading.Lock()
+_clients = {}
+
+
+def _key_pool(provider):
+    """The container's key pool for a provider, loaded from the secrets on first use."""
+    with _key_pools_lock:
+        if provider not in _key_pools:
+            if provider == "gemini":
+                _key_pools[provider] = KeyPool(provider, load_api_keys("GOOGLE_API_KEY"),
+                                               GEMINI_KEY_RPM, GEMINI_KEY_TPM, usage_of=_gemini_usage_tokens)
+            else:
+                _key_pools[provider] = KeyPool(provider, load_api_keys("ELEVENLABS_API_KEY"),
+                                               ELEVENLABS_KEY_RPM, ELEVENLABS_KEY_CHARS_PER_MINUTE)
+            print(f"🔑 {provider}: {len(_key_pools[provider].keys)} API key(s) in pool")
+        return _key_pools[provider]
+
+
+def _gemini_client(key):
+    """One genai.Client per key, reused across calls in this container."""
+    if ("gemini", key) not in _clients:
+        _clients[("gemini", key)] = genai.Client(api_key=key)
+    return _clients[("gemini", key)]
+
+
+def _elevenlabs_client(key):
+    """One ElevenLabs client per key, reused across calls in this container."""
+    if ("elevenlabs", key) not in _clients:
+        _clients[("elevenlabs", key)] = ElevenLabs(api_key=key)
+    return _clients[("elevenlabs", key)]
+
+
+def _pooled(pool, fn, key_id=None, tokens=0):
+    """Wrap fn(key) so each call (attempt or hedge) acquires a key and reports back."""
+    def call():
+        key = pool.acquire(key_id, tokens)
+        try:
+            result = fn(key)
+        except Exception as e:
+            if _status_code(e) == 429:
+                pool.throttled(key)
+            raise
+        pool.settle(key, result, tokens)
+        return result
+    return call
+
+
+def _warm_clients():
+    """
+    Build the key pools and SDK clients at import time in the container, so
+    memory snapshots include them instead of the first request paying for it.
+    
+    Providers whose secret is not attached (or not visible yet) are skipped
+    and load lazily on first use as before.
+    """
+    for provider, key_name, make_client in (("gemini", "GOOGLE_API_KEY", _gemini_client),
+                                            ("elevenlabs", "ELEVENLABS_API_KEY", _elevenlabs_client)):
+        if not load_api_keys(key_name):
+            continue
+        for key in _key_pool(provider).keys:
+            try:
+                make_client(key)
+            except Exception as e:
+                print(f"⚠️ Could not pre-build {provider} client: {e}")
+
+
+if not modal.is_local():
+    _warm_clients()
+_init_seconds = time.perf_counter() - _module_started
+
+
+# ==========================================
+# Volume Writes: Batched Write-Behind Commits
+# ==========================================
+class VolumeWriteBehind:
+    """
+    Write-behind commits for the shared volume.
+    
+    Writers call mark() after writing files. A background timer commits
+    VOLUME_COMMIT_DELAY_SECONDS after the first pending write, so writes in
+    the same window share one commit and requests do not wait for it. Files
+    are visible to this container immediately; other containers see them
+    after the commit, so anything another container waits for is passed as
+    after_commit (e.g. releasing the ingest lease). flush() commits now, for
+    callers that hand a file to someone else right away, and runs at exit.
+    """
+    
+    def __init__(self, delay=VOLUME_COMMIT_DELAY_SECONDS, enabled=VOLUME_WRITE_BEHIND):
+        self.delay = delay
+        self.enabled = enabled
+        self.writes = 0
+        self.commits = 0
+        self._dirty = False
+        self._callbacks = []
+        self._timer = None
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+    
+    def mark(self, after_commit=None):
+        """Record a write; after_commit runs once a commit covers it."""
+        with self._lock:
+            self.writes += 1
+            self._dirty = True
+            if after_commit is not None:
+                self._callbacks.append(after_commit)
+            if self.enabled:
+                self._schedule()
+        if not self.enabled:
+            self.flush()
+    
+    def _schedule(self):
+        # Caller holds self._lock
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def flush(self):
+        """Commit pending writes now; returns whether anything was committed."""
+        with self._commit_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return False
+                self._dirty = False
+                callbacks, self._callbacks = self._callbacks, []
+                writes, self.writes = self.writes, 0
+            try:
+                with span("volume_commit", writes=writes, deferred=self.enabled):
+                    vol.commit()
+            except Exception as e:
+                # Keep the writes pending for the next attempt
+                with self._lock:
+                    self._dirty = True
+                    self._callbacks = callbacks + self._callbacks
+                    self.writes += writes
+                    if self.enabled:
+                        self._schedule()
+                if not self.enabled:
+                    raise
+                print(f"⚠️ Volume commit failed ({e}), retrying in {self.delay:g}s")
+                return False
+            self.commits += 1
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ After-commit callback failed: {e}")
+        return True
+
+
+_volume_writes = VolumeWriteBehind()
+atexit.register(_volume_writes.flush)
+
+
+# ==========================================
+# Ingest Helpers: Gemini Files API + Volume Metadata
+# ==========================================
+def _cache_info_path(video_filename):
+    """Path of the ingest metadata record for a video (or clips/<clip>)."""
+    return f"{CACHE_INFO_DIR}/{video_filename.replace('.mp4', '').replace('/', '__')}.json"
+
+
+def _read_cache_info(video_filename):
+    """Load the ingest metadata record, or None if missing/unreadable."""
+    import json
+    
+    cache_info_path = _cache_info_path(video_filename)
+    if not os.path.exists(cache_info_path):
+        return None
+    try:
+        with open(cache_info_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Could not read cache info: {e}")
+        return None
+
+
+def _write_cache_info(video_filename, cache_info, after_commit=None):
+    """Persist the ingest metadata record (committed write-behind, see VolumeWriteBehind)."""
+    import json
+    
+    os.makedirs(CACHE_INFO_DIR, exist_ok=True)
+    with open(_cache_info_path(video_filename), 'w') as f:
+        json.dump(cache_info, f, indent=2)
+    _volume_writes.mark(after_commit)
+
+
+def _wait_for_video(video_path, attempts=10):
+    """Wait for a freshly uploaded video to become visible on the volume."""
+    for i in range(attempts):
+        if os.path.exists(video_path):
+            return True
+        print(f"⏳ Waiting for volume sync... ({i+1}/{attempts})")
+        time.sleep(1)
+        try:
+            vol.reload()
+        except Exception:
+            pass
+    return os.path.exists(video_path)
+
+
+def _get_active_file(cache_info):
+    """Return the Gemini file referenced by cache_info if it is still ACTIVE."""
+    file_name = (cache_info or {}).get("file_name")
+    if not file_name:
+        return None
+    try:
+        # Files belong to the project of the key that uploaded them
+        client = _gemini_client(_key_pool("gemini").get(cache_info.get("api_key_id")))
+        with span("files_get") as attrs:
+            video_file = client.files.get(name=file_name)
+            attrs["state"] = video_file.state.name
+    except Exception as e:
+        print(f"⚠️ Could not retrieve file: {e}")
+        return None
+    if video_file.state.name != 'ACTIVE':
+        print(f"⚠️ File state: {video_file.state.name}, re-uploading...")
+        return None
+    return video_file
+
+
+def _is_trusted(cache_info):
+    """
+    Whether cache_info can be used without a files.get round trip.
+    
+    A record is trusted when it was verified within FILE_VERIFY_WINDOW_SECONDS
+    and its known expiry is not about to pass.
+    """
+    if not cache_info or not cache_info.get("file_uri"):
+        return False
+    now = time.time()
+    if now - cache_info.get("verified_at", 0) > FILE_VERIFY_WINDOW_SECONDS:
+        return False
+    return cache_info.get("expires_at", 0) - now > FILE_EXPIRY_MARGIN_SECONDS
+
+
+def _file_record(video_filename, video_file, base=None):
+    """Build the ingest metadata record for a verified ACTIVE Gemini file."""
+    now = time.time()
+    expiration = getattr(video_file, "expiration_time", None)
+    record = dict(base or {})
+    record.update({
+        "file_name": video_file.name,
+        "file_uri": video_file.uri,
+        "mime_type": getattr(video_file, "mime_type", None) or "video/mp4",
+        "video_filename": video_filename,
+        "model": "gemini-2.5-flash",
+        "expires_at": expiration.timestamp() if expiration else now + GEMINI_FILE_TTL_SECONDS,
+        "verified_at": now,
+        "mode": "implicit_caching"
+    })
+    duration = _parse_seconds((getattr(video_file, "video_metadata", None) or {}).get("videoDuration"))
+    if duration:
+        record["duration_seconds"] = duration
+    record.setdefault("created_at", now)
+    return record
+
+
+def _parse_seconds(value):
+    """Parse a protobuf Duration string like "123.5s" (None when absent or malformed)."""
+    try:
+        return float(str(value).rstrip("s")) if value else None
+    except ValueError:
+        return None
+
+
+def _video_part(cache_info, clip=None):
+    """
+    Reference an ingested video by URI, without fetching the file object.
+    
+    Args:
+        cache_info: Ingest metadata record
+        clip: Optional (start_seconds, end_seconds) sent as video offsets so
+            only that span is tokenized; end may be None (until the end)
+    """
+    if clip is None:
+        return types.Part.from_uri(
+            file_uri=cache_info["file_uri"],
+            mime_type=cache_info.get("mime_type", "video/mp4")
+        )
+    
+    start, end = clip
+    return types.Part(
+        file_data=types.FileData(
+            file_uri=cache_info["file_uri"],
+            mime_type=cache_info.get("mime_type", "video/mp4")
+        ),
+        video_metadata=types.VideoMetadata(
+            start_offset=f"{start:g}s",
+            end_offset=f"{end:g}s" if end is not None else None
+        )
+    )
+
+
+def _is_missing_file_error(error):
+    """
+    Whether a Gemini error means the referenced file no longer exists.
+    
+    Only errors about a file resource count: a 404 for a wrong or retired
+    model name must not re-upload the video on every question.
+    """
+    code = _status_code(error)
+    message = str(error).lower()
+    if code == 404:
+        return "files/" in message
+    if code == 403:
+        # "You do not have permission to access the File ... or it may not exist."
+        return "files/" in message or "the file" in message
+    return False
+
+
+def _upload_and_process(video_path):
+    """
+    Upload a video to the Gemini Files API and wait until it is processed.
+    
+    The upload goes to the key with the most headroom; later calls that use
+    the file must use the same key.
+    
+    Returns:
+        tuple: (video_file, key)
+    """
+    key = _key_pool("gemini").acquire()
+    client = _gemini_client(key)
+    print(f"📤 Uploading video to Gemini Files API (key {KeyPool.key_id(key)})...")
+    with span("upload", bytes=os.path.getsize(video_path)):
+        video_file = client.files.upload(file=video_path)
+    
+    print("⏳ Waiting for video processing...")
+    with span("processing_poll") as attrs:
+        polls = 0
+        while video_file.state.name == 'PROCESSING':
+            print('.', end='', flush=True)
+            time.sleep(2)
+            video_file = client.files.get(name=video_file.name)
+            polls += 1
+        attrs["polls"] = polls
+    
+    if video_file.state.name == 'FAILED':
+        raise RuntimeError("Video processing failed")
+    
+    print(f"\n✅ Video uploaded: {video_file.uri}")
+    print(f"   File name: {video_file.name}")
+    return video_file, key
+
+
+def _end_lease(name, owner):
+    """
+    Claim the end of one lease instance; True for exactly one caller.
+    
+    Both the owner's release and a container breaking the lease once it is
+    stale go through this claim, so a lease is never removed or replaced by
+    two parties. Claims expire with the Dict's idle-entry TTL.
+    """
+    return ingest_leases.put(f"{name}/ended/{owner}", time.time(), skip_if_exists=True)
+
+
+def _take_lease(name, seconds=INGEST_LEASE_SECONDS):
+    """
+    Take a named cross-container lease with one atomic put.
+    
+    Returns:
+        str: owner token for _release_lease, or None when another container
+             holds the lease
+    """
+    token = uuid.uuid4().hex
+    lease = {"owner": token, "expires_at": time.time() + seconds}
+    if ingest_leases.put(name, lease, skip_if_exists=True):
+        return token
+    
+    # Break leases left behind by crashed or timed-out containers: the stale
+    # entry stays in place until one breaker has claimed its end
+    current = ingest_leases.get(name)
+    if current and current.get("expires_at", 0) < time.time() and _end_lease(name, current.get("owner")):
+        print(f"⚠️ Breaking stale lease {name}")
+        ingest_leases.put(name, lease)
+        return token
+    return None
+
+
+def _release_lease(name, token):
+    """Release a lease taken by _take_lease, unless it was broken and passed to another owner."""
+    if _end_lease(name, token):
+        ingest_leases.pop(name, None)
+
+
+def _reuse_existing(video_filename, stale_file_name=None):
+    """
+    Return (cache_info, status) for a usable existing upload, or (None, None).
+    
+    Records inside the validity window are trusted as-is; older ones are
+    checked with files.get and re-stamped with a fresh verified_at.
+    """
+    cache_info = _read_cache_info(video_filename)
+    if not cache_info or cache_info.get("file_name") == stale_file_name:
+        return None, None
+    if _is_trusted(cache_info):
+        return cache_info, "trusted"
+    
+    video_file = _get_active_file(cache_info)
+    if video_file is None:
+        return None, None
+    print(f"📂 Found existing uploaded file: {video_file.name}")
+    cache_info = _file_record(video_filename, video_file, base=cache_info)
+    _write_cache_info(video_filename, cache_info)
+    return cache_info, "existing"
+
+
+def _ingest_video(video_filename, stale_file_name=None, annotations=None):
+    """
+    Make sure a video is uploaded to Gemini exactly once.
+    
+    Concurrent callers across containers coordinate through an ingest lease
+    in a Modal Dict: the lease holder uploads and writes cache_info, while the
+    others wait for that record to appear instead of uploading a duplicate.
+    
+    Args:
+        video_filename: Video file in the volume
+        stale_file_name: Gemini file known to be gone (or being replaced); a
+            record pointing at it is ignored so the video is re-ingested
+        annotations: Extra fields stored on a freshly written record
+    
+    Returns:
+        tuple: (cache_info, status) where status is "trusted", "existing" or "uploaded"
+    """
+    video_path = f"{DATA_DIR}/{video_filename}"
+    deadline = time.time() + INGEST_WAIT_SECONDS
+    announced = False
+    
+    while True:
+        cache_info, status = _reuse_existing(video_filename, stale_file_name)
+        if cache_info is not None:
+            return cache_info, status
+        
+        token = _take_lease(video_filename)
+        if token is not None:
+            release = lambda: _release_lease(video_filename, token)  # noqa: E731
+            try:
+                # Another container may have finished between our check and the lease
+                vol.reload()
+                cache_info, status = _reuse_existing(video_filename, stale_file_name)
+                if cache_info is not None:
+                    return cache_info, status
+                
+                video_file, key = _upload_and_process(video_path)
+                cache_info = _file_record(
+                    video_filename, video_file,
+                    base={**(annotations or {}), "api_key_id": KeyPool.key_id(key)}
+                )
+                # Waiting containers look for the record once the lease is gone,
+                # so keep it until the record is committed
+                _write_cache_info(video_filename, cache_info, after_commit=release)
+                release = None
+                return cache_info, "uploaded"
+            finally:
+                if release is not None:
+                    release()
+        
+        if time.time() > deadline:
+            raise TimeoutError(f"Timed out waiting for ingest of {video_filename}")
+        if not announced:
+            print(f"⏳ Another container is ingesting {video_filename}, waiting...")
+            announced = True
+        time.sleep(2)
+        try:
+            vol.reload()
+        except Exception as e:
+            print(f"⚠️ Volume reload failed: {e}")
+
+
+def _ensure_ingested(video_filename, stale_file_name=None):
+    """Ingest a video, sharing one upload between concurrent calls in this container."""
+    result, shared = _ingest_flight.do(
+        (video_filename, stale_file_name),
+        lambda: _ingest_video(video_filename, stale_file_name)
+    )
+    if shared:
+        print(f"🔗 Joined in-flight ingest for {video_filename}")
+    return result
+
+
+# ==========================================
+# Usage Tracking: Hot Videos and Counters
+# ==========================================
+def _in_background(fn, *args):
+    """Run a best-effort bookkeeping call without blocking the request."""
+    def runner():
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"⚠️ Background task {fn.__name__} failed: {e}")
+    threading.Thread(target=runner, daemon=True).start()
+
+
+def _touch_video(video_filename):
+    """
+    Record that a video was just queried (drives the expiry refresher).
+    
+    Pass the name its ingest record is stored under: the transcoded copy or
+    the cut clip, not the uploaded original.
+    """
+    video_stats.put(f"last_used/{video_filename}", time.time())
+
+
+# Shared counters are sharded per container: each container is the only
+# writer of <prefix>/<container id> and puts its running total there, so
+# concurrent containers never overwrite each other's increments. Readers sum
+# the shards.
+_CONTAINER_ID = os.environ.get("MODAL_TASK_ID") or uuid.uuid4().hex[:12]
+_shard_counts = {}
+_shard_lock = threading.Lock()
+
+
+def _bump_shard(prefix, amount=1):
+    """Add to this container's shard of a counter."""
+    key = f"{prefix}/{_CONTAINER_ID}"
+    with _shard_lock:
+        _shard_counts[key] = _shard_counts.get(key, 0) + amount
+        # Under the lock, so an older total never overwrites a newer one
+        video_stats.put(key, _shard_counts[key])
+
+
+def _read_counter(name):
+    """Total of a counter bumped with _bump_counter, across containers."""
+    prefix = f"counter/{name}/"
+    return sum(count for key, count in video_stats.items() if isinstance(key, str) and key.startswith(prefix))
+
+
+def _bump_counter(name, amount=1):
+    """Increment a shared counter."""
+    _bump_shard(f"counter/{name}", amount)
+
+
+def _record_traffic(function_name):
+    """Count a request in its minute bucket (drives the warm-pool autoscaler)."""
+    _bump_shard(f"traffic/{function_name}/{int(time.time() // 60)}")
+
+
+def _credit_refresh(video_filename, cache_info):
+    """
+    Count a user-facing re-upload avoided by the background refresher.
+    
+    A question that arrives after the replaced file's expiry would have paid
+    the full upload + processing cost; credit each refreshed file once.
+    """
+    replaced_expires_at = cache_info.get("replaced_expires_at")
+    if not replaced_expires_at or time.time() < replaced_expires_at:
+        return
+    credit_key = f"refresh_credit/{cache_info['file_name']}"
+    if video_stats.put(credit_key, time.time(), skip_if_exists=True):
+        _bump_counter("reuploads_avoided")
+        print(f"♻️ Avoided a cold re-upload of {video_filename} (refreshed in background)")
+
+
+# ==========================================
+# Clips: Time-Range Questions
+# ==========================================
+def _normalize_clip(start_seconds, end_seconds):
+    """
+    Validate an optional time range.
+    
+    Returns:
+        (start, end) tuple, or None when no range was requested
+    
+    Raises:
+        ValueError: for negative or empty ranges
+    """
+    if start_seconds is None and end_seconds is None:
+        return None
+    start = float(start_seconds or 0)
+    end = float(end_seconds) if end_seconds is not None else None
+    if start < 0 or (end is not None and end <= start):
+        raise ValueError(f"Invalid time range: {start_seconds} - {end_seconds}")
+    return start, end
+
+
+def _supports_video_offsets():
+    """Whether the installed SDK can send video_metadata offsets."""
+    metadata = getattr(types, "VideoMetadata", None)
+    return metadata is not None and "start_offset" in getattr(metadata, "model_fields", {})
+
+
+def _cut_clip(video_filename, clip):
+    """
+    Cut a time range into its own video on the volume, once per range.
+    
+    Used when video offsets are unavailable: the clip is ingested like any
+    other video, so only its span is uploaded and tokenized.
+    
+    Returns:
+        str: clip filename relative to the volume root (clips/...)
+    """
+    import subprocess
+    
+    start, end = clip
+    stem = video_filename.rsplit(".", 1)[0].replace("/", "__")
+    clip_filename = f"clips/{stem}_{start:g}-{'end' if end is None else f'{end:g}'}.mp4"
+    clip_path = f"{DATA_DIR}/{clip_filename}"
+    if os.path.exists(clip_path):
+        return clip_filename
+    
+    os.makedirs(CLIPS_DIR, exist_ok=True)
+    tmp_path = f"{clip_path}.{uuid.uuid4().hex[:8]}.part.mp4"
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-ss", f"{start:g}", "-i", f"{DATA_DIR}/{video_filename}"]
+    if end is not None:
+        cmd += ["-t", f"{end - start:g}"]
+    cmd += ["-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", "-movflags", "+faststart", tmp_path]
+    
+    print(f"✂️ Cutting clip {clip_filename}...")
+    with span("clip_cut", start=start, end=end):
+        subprocess.run(cmd, check=True, capture_output=True, timeout=300)
+    os.replace(tmp_path, clip_path)
+    _volume_writes.mark()
+    return clip_filename
+
+
+def _clip_note(clip):
+    """Tell the model which part of the full video it is looking at."""
+    start, end = clip
+    until = f"{end:g}s" if end is not None else "the end"
+    return f"(You are given only the part of the video from {start:g}s to {until}; answer about that part.)"
+
+
+# ==========================================
+# Media Preflight: ffprobe Metadata and Upload Decisions
+# ==========================================
+# Per container: volume filename -> metadata (volume files never change)
+_media_cache = {}
+
+
+def _parse_rate(value):
+    """Parse an ffprobe frame rate like "30000/1001" (None when absent or 0/0)."""
+    try:
+        num, _, den = str(value).partition("/")
+        rate = float(num) / float(den or 1)
+        return round(rate, 3) if rate > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _parse_probe(probe):
+    """
+    Reduce `ffprobe -show_format -show_streams -of json` output to the fields
+    the upload decisions need.
+    """
+    streams = probe.get("streams") or []
+    fmt = probe.get("format") or {}
+    video = next((st for st in streams if st.get("codec_type") == "video"
+                  and not (st.get("disposition") or {}).get("attached_pic")), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    duration = _parse_seconds(fmt.get("duration")) or _parse_seconds((video or {}).get("duration"))
+    bitrate = fmt.get("bit_rate")
+    return {
+        "format": fmt.get("format_name"),
+        "duration_seconds": round(duration, 3) if duration else None,
+        "bitrate": int(bitrate) if str(bitrate or "").isdigit() else None,
+        "video_codec": (video or {}).get("codec_name"),
+        "width": (video or {}).get("width"),
+        "height": (video or {}).get("height"),
+        "fps": _parse_rate((video or {}).get("avg_frame_rate")) or _parse_rate((video or {}).get("r_frame_rate")),
+        "audio_codec": (audio or {}).get("codec_name"),
+    }
+
+
+def _probe_media(video_path):
+    """
+    Media metadata via ffprobe.
+    
+    Returns:
+        dict from _parse_probe, {"error": ...} when ffprobe cannot read the
+        file, or None when ffprobe is not installed (nothing is known)
+    """
+    import subprocess
+    
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", video_path],
+            capture_output=True, text=True, timeout=15
+        )
+    except FileNotFoundError:
+        return None
+    except (OSError, subprocess.SubprocessError) as e:
+        return {"error": str(e)}
+    if result.returncode != 0:
+        return {"error": result.stderr.strip()[-300:] or f"ffprobe exited with {result.returncode}"}
+    try:
+        return _parse_probe(json.loads(result.stdout or "{}"))
+    except ValueError as e:
+        return {"error": f"Unreadable ffprobe output: {e}"}
+
+
+def _media_info(video_filename, media=None):
+    """
+    Metadata for a video on the volume, probing it at most once.
+    
+    `media` is what the caller already measured with the same ffprobe fields
+    (the Space probes before uploading); it is stored under its content_hash
+    so other containers and re-uploads of the same bytes skip the probe.
+    
+    Returns:
+        dict (see _probe_media), or None when it cannot be measured here
+    """
+    if video_filename in _media_cache:
+        return _media_cache[video_filename]
+    
+    with span("media_probe") as attrs:
+        key = (media or {}).get("content_hash") or video_filename
+        if media and ("duration_seconds" in media or "error" in media):
+            source = "caller"
+        else:
+            try:
+                media, source = media_info.get(key), "shared"
+            except Exception as e:
+                print(f"⚠️ Media cache unavailable: {e}")
+                media = None
+            if media is None:
+                media, source = _probe_media(f"{DATA_DIR}/{video_filename}"), "ffprobe"
+        attrs.update(source=source, known=media is not None)
+    
+    if media is not None:
+        _media_cache[video_filename] = media
+        if source != "shared":
+            _in_background(media_info.put, key, media)
+    return media
+
+
+def _media_plan(media):
+    """
+    Upload decisions for a video from its metadata.
+    
+    Returns:
+        dict with "error" (why the video is rejected, or None), "transcode"
+        (codec Gemini does not decode) and "low_resolution" (long video)
+    """
+    plan = {"error": None, "transcode": False, "low_resolution": False}
+    if media is None:
+        return plan  # ffprobe unavailable: let Gemini decide
+    duration = media.get("duration_seconds")
+    if media.get("error"):
+        plan["error"] = "The file could not be read as a video (corrupt or unsupported container)."
+    elif not media.get("video_codec"):
+        plan["error"] = "The file has no video stream."
+    elif duration and duration > MAX_VIDEO_SECONDS:
+        plan["error"] = (f"The video is {duration / 60:.0f} minutes long; "
+                         f"videos up to {MAX_VIDEO_SECONDS / 60:.0f} minutes are supported.")
+    else:
+        plan["transcode"] = media["video_codec"] not in GEMINI_VIDEO_CODECS
+        plan["low_resolution"] = bool(duration and duration > LOW_RESOLUTION_SECONDS)
+    return plan
+
+
+class TranscodeError(Exception):
+    """The H.264 copy of a video is not available (failed, or still being made)."""
+    def __init__(self, message, pending=False):
+        super().__init__(message)
+        self.pending = pending
+
+
+def _transcoded_filename(video_filename):
+    """Volume path (relative to /data) of a video's H.264 copy."""
+    return f"transcoded/{video_filename.rsplit('.', 1)[0].replace('/', '__')}.mp4"
+
+
+def _transcode_video(video_filename):
+    """
+    The H.264/AAC copy of a video Gemini cannot decode, made once per video.
+    
+    The encode runs in _internal_transcode_video (its own, longer timeout),
+    started by the first question across containers; concurrent questions
+    in this container share one wait.
+    
+    Returns:
+        str: transcoded filename relative to the volume root (transcoded/...)
+    
+    Raises:
+        TranscodeError: the transcode failed, or is still running after
+            TRANSCODE_WAIT_SECONDS (pending=True)
+    """
+    out_filename = _transcoded_filename(video_filename)
+    if os.path.exists(f"{DATA_DIR}/{out_filename}"):
+        return out_filename
+    result, shared = _transcode_flight.do(video_filename, lambda: _await_transcode(video_filename, out_filename))
+    if shared:
+        print(f"🔗 Joined in-flight transcode wait for {video_filename}")
+    return result
+
+
+def _await_transcode(video_filename, out_filename):
+    """Start the transcode job unless one is running, then wait for its output."""
+    out_path = f"{DATA_DIR}/{out_filename}"
+    error = video_stats.get(f"transcode_error/{video_filename}")
+    if error:
+        raise TranscodeError(error)
+    
+    pending_key = f"transcode_pending/{video_filename}"
+    with span("transcode") as attrs:
+        started = video_stats.put(pending_key, time.time(), skip_if_exists=True)
+        if not started and video_stats.get(pending_key, 0) < time.time() - TRANSCODE_TIMEOUT_SECONDS - 300:
+            print(f"⚠️ Restarting abandoned transcode of {video_filename}")
+            video_stats.put(pending_key, time.time())
+            started = True
+        if started:
+            print(f"🔄 Transcoding {video_filename} to H.264 in the background...")
+            try:
+                _internal_transcode_video.spawn(video_filename)
+            except Exception:
+                video_stats.pop(pending_key, None)
+                raise
+        attrs["started"] = started
+        
+        deadline = time.time() + TRANSCODE_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(TRANSCODE_POLL_SECONDS)
+            running = video_stats.get(pending_key) is not None
+            vol.reload()
+            if os.path.exists(out_path):
+                return out_filename
+            error = video_stats.get(f"transcode_error/{video_filename}")
+            if error:
+                raise TranscodeError(error)
+            if not running:
+                raise TranscodeError("The video could not be converted to H.264.")
+        attrs["timed_out"] = True
+    raise TranscodeError("The video is still being converted to a format Gemini can read. "
+                         "Please ask again in a few minutes.", pending=True)
+
+
+def _preflight(video_filename, media=None):
+    """
+    Check a video before it is uploaded to Gemini or sent inline.
+    
+    Returns:
+        tuple: (media, plan); plan["error"] is set when the video is rejected
+    """
+    media = _media_info(video_filename, media)
+    plan = _media_plan(media)
+    with span("preflight", rejected=plan["error"] is not None, transcode=plan["transcode"],
+              low_resolution=plan["low_resolution"],
+              codec=(media or {}).get("video_codec"), duration=(media or {}).get("duration_seconds")):
+        pass
+    if plan["error"]:
+        print(f"🚫 Preflight rejected {video_filename}: {plan['error']}")
+    return media, plan
+
+
+def _source_filename(video_filename, plan):
+    """The file to ingest or send inline: the transcoded copy when the plan needs one."""
+    return _transcode_video(video_filename) if plan["transcode"] else video_filename
+
+
+def _media_resolution(plan):
+    """GenerateContentConfig media_resolution for a plan (None keeps the default)."""
+    return types.MediaResolution.MEDIA_RESOLUTION_LOW if plan.get("low_resolution") else None
+
+
+# ==========================================
+# Inline Fast Path: Small Videos Without the Files API
+# ==========================================
+def _inline_decision(video_filename, digest=None):
+    """
+    Whether to send a video as inline bytes instead of a Files API reference.
+    
+    Only small, short videos that have no Gemini file yet and are not hot
+    (fewer than INLINE_HOT_QUESTIONS inline questions so far) go inline.
+    
+    Returns:
+        tuple: (inline, reason, duration_seconds or None)
+    """
+    video_path = f"{DATA_DIR}/{video_filename}"
+    with span("inline_check") as attrs:
+        size = os.path.getsize(video_path)
+        attrs["bytes"] = size
+        if size > INLINE_MAX_BYTES:
+            reason, duration = "large", None
+        elif _read_cache_info(video_filename) is not None:
+            reason, duration = "ingested", None
+        elif _inline_hot(video_filename):
+            reason, duration = "hot", None
+        else:
+            duration = (digest or {}).get("duration_seconds") or (_media_info(video_filename) or {}).get("duration_seconds")
+            if duration is None:
+                reason = "unknown_duration"
+            elif duration > INLINE_MAX_SECONDS:
+                reason = "long"
+            else:
+                reason = "small"
+        attrs.update(inline=reason == "small", reason=reason)
+    return reason == "small", reason, duration
+
+
+def _inline_video_part(video_filename, clip=None):
+    """Video bytes as an inline part (with optional clip offsets)."""
+    import mimetypes
+    
+    with open(f"{DATA_DIR}/{video_filename}", 'rb') as f:
+        data = f.read()
+    start, end = clip if clip is not None else (None, None)
+    return types.Part(
+        inline_data=types.Blob(data=data, mime_type=mimetypes.guess_type(video_filename)[0] or "video/mp4"),
+        video_metadata=types.VideoMetadata(
+            start_offset=f"{start:g}s",
+            end_offset=f"{end:g}s" if end is not None else None
+        ) if clip is not None else None
+    )
+
+
+def _inline_hot(video_filename):
+    """Whether a video has had INLINE_HOT_QUESTIONS inline answers (its last slot is taken)."""
+    return (INLINE_HOT_QUESTIONS <= 0
+            or video_stats.get(f"inline_question/{video_filename}/{INLINE_HOT_QUESTIONS - 1}") is not None)
+
+
+def _count_inline_question(video_filename):
+    """
+    Count an inline answer; once the video is hot, ingest it for the next questions.
+    
+    Each answer claims the lowest free slot with an atomic put, so the count
+    never loses concurrent questions; the answer that claims the last slot
+    starts the ingest.
+    """
+    for slot in range(INLINE_HOT_QUESTIONS):
+        if video_stats.put(f"inline_question/{video_filename}/{slot}", time.time(), skip_if_exists=True):
+            break
+    else:
+        return  # already hot: its ingest was started by the last slot's owner
+    if slot == INLINE_HOT_QUESTIONS - 1:
+        print(f"🔥 {video_filename} is hot ({INLINE_HOT_QUESTIONS} inline questions), ingesting via Files API")
+        _ensure_ingested(video_filename)
+
+
+# ==========================================
+# Digest: Timestamped Timeline per Video
+# ==========================================
+DIGEST_PROMPT = """Watch the entire video and describe it as a timeline in JSON with exactly this shape:
+{"duration_seconds": number,
+ "summary": "3-5 sentences on what the video is about",
+ "scenes": [{"start": seconds, "end": seconds,
+             "description": "what happens and what is shown",
+             "objects": ["notable people, objects, on-screen text"],
+             "speech": "what is said (verbatim when short), empty if nothing"}]}
+Cover the whole video in order with 5-40 scenes depending on its length."""
+
+# Questions that need pixels rather than a timeline go straight to the video
+VISUAL_DETAIL_PATTERN = (
+    r"\b(colou?rs?|wearing|look(s)? like|appearance|expression|facial|exact(ly)?|precise(ly)?"
+    r"|read the|text on|logo|sign|font|frame|pixel|in detail|detailed|camera angle|lighting)\b"
+)
+# Only questions about the whole video; "how long is the bridge shown?" needs the model
+DURATION_PATTERN = (
+    r"^\s*(how long is|what('s| is) the (length|duration) of|how many (minutes|seconds) (long )?is)"
+    r" (this|the) video\W*$"
+)
+SUMMARY_PATTERN = r"^\s*(what('s| is) (this|the) video about|summari[sz]e (this|the) video)\W*$"
+
+
+def _digest_path(video_filename):
+    """Path of a video's digest JSON."""
+    return f"{DIGESTS_DIR}/{video_filename.replace('.mp4', '').replace('/', '__')}.json"
+
+
+def _read_digest(video_filename):
+    """Load a video's digest, or None if it has not been built yet."""
+    path = _digest_path(video_filename)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Could not read digest: {e}")
+        return None
+
+
+def _route_question(query, digest, clip=None):
+    """
+    Decide how to answer a question.
+    
+    Returns:
+        str: "local" (answer from the digest without any model call),
+             "digest" (cheap text-only call over the digest) or
+             "video" (full multimodal analysis)
+    """
+    import re
+    
+    if digest is None or clip is not None:
+        return "video"
+    if re.search(VISUAL_DETAIL_PATTERN, query, re.IGNORECASE):
+        return "video"
+    if re.match(DURATION_PATTERN, query, re.IGNORECASE) and digest.get("duration_seconds"):
+        return "local"
+    if re.match(SUMMARY_PATTERN, query, re.IGNORECASE) and digest.get("summary"):
+        return "local"
+    return "digest"
+
+
+def _answer_locally(query, digest):
+    """Answer duration / overview questions straight from the digest."""
+    import re
+    
+    if re.match(DURATION_PATTERN, query, re.IGNORECASE):
+        minutes, seconds = divmod(int(round(digest["duration_seconds"])), 60)
+        units = [f"{n} {unit}{'' if n == 1 else 's'}" for n, unit in ((minutes, "minute"), (seconds, "second"))
+                 if n or (unit == "second" and not minutes)]
+        return f"The video is about {' and '.join(units)} long."
+    return digest["summary"]
+
+
+def _answer_from_digest(query, digest, summaries, recent_turns):
+    """
+    Answer with a text-only call over the digest.
+    
+    Returns:
+        tuple: (answer text or None when the digest lacks the answer, response)
+    """
+    timeline = json.dumps({k: digest.get(k) for k in ("duration_seconds", "summary", "scenes")})
+    throughput_name = f"{DIGEST_ANSWER_MODEL}:digest"
+    budget = _answer_budget(query, DIGEST_ANSWER_MODEL, throughput_name)
+    with span("answer_budget", model=DIGEST_ANSWER_MODEL, route="digest",
+              **{k: v for k, v in budget.items() if k != "instruction"}):
+        pass
+    question = (
+        f"{query}\n\n{budget['instruction']} If the timeline does not contain enough "
+        f"information to answer, reply with exactly {DIGEST_ESCALATION_TOKEN}."
+    )
+    timeline_part = types.Part.from_text(text=f"Timeline of the video (JSON):\n{timeline}")
+    with span("generate", model=DIGEST_ANSWER_MODEL, route="digest"):
+        start = time.monotonic()
+        response = _call_upstream("gemini", f"generate:{DIGEST_ANSWER_MODEL}", lambda key: _gemini_client(key).models.generate_content(
+            model=DIGEST_ANSWER_MODEL,
+            contents=_build_prompt(timeline_part, summaries, recent_turns, question),
+            config=_answer_config(budget, system_instruction=SYSTEM_INSTRUCTION)
+        ), GENERATE_DEADLINE_SECONDS, hedge=True, pool=_key_pool("gemini"))
+        _record_generate(throughput_name, response, time.monotonic() - start)
+    text = (_finish_answer(response) or "").strip()
+    if not text or DIGEST_ESCALATION_TOKEN in text:
+        return None, response
+    return text, response
+
+
+def _request_digest(video_filename):
+    """Build the digest in the background once per video."""
+    if os.path.exists(_digest_path(video_filename)):
+        return
+    if not video_stats.put(f"digest_pending/{video_filename}", time.time(), skip_if_exists=True):
+        return
+    _internal_build_digest.spawn(video_filename)
+    print(f"🗂️ Digest build scheduled for {video_filename}")
+
+
+# ==========================================
+# Model Routing: Question Complexity -> Gemini Tier
+# ==========================================
+# Reasoning-heavy wording needs the standard model
+COMPLEX_QUESTION_PATTERN = (
+    r"\b(why|explain|compare|contrast|analy[sz]e|reason|reasoning|infer|predict|implications?|"
+    r"evaluate|critique|relationship|differences?|differ|motivations?|intent|strategy|argument|"
+    r"step[- ]by[- ]step|in detail|detailed|how does|how do|what would|what if)\b"
+)
+# Short factual lookups are fine on the fast tier
+SIMPLE_QUESTION_PATTERN = (
+    r"^\s*(what|who|where|which|when|is|are|was|were|does|do|did|can|how many|how long|name|list)\b"
+)
+
+
+def _video_duration(cache_info, digest=None):
+    """Video length in seconds from the ingest record or the digest, if known."""
+    return (cache_info or {}).get("duration_seconds") or (digest or {}).get("duration_seconds")
+
+
+def _route_model(query, duration=None, clip=None):
+    """
+    Pick the Gemini tier for a full video question.
+    
+    Each model keeps its own implicit cache, so a video asked both simple and
+    complex questions warms two prefixes; the fast tier's savings outweigh it.
+    
+    Returns:
+        tuple: (model, decision) where decision holds the tier, score and the
+        features behind it, for logging
+    """
+    import re
+    
+    if MODEL_ROUTING in ("standard", "fast"):
+        tier = MODEL_ROUTING
+        return (STANDARD_MODEL if tier == "standard" else FAST_MODEL), {"tier": tier, "score": None, "reasons": ["pinned"]}
+    
+    words = len(query.split())
+    score, reasons = 0, []
+    if re.search(COMPLEX_QUESTION_PATTERN, query, re.IGNORECASE):
+        score += 2
+        reasons.append("reasoning")
+    if words > 25:
+        score += 1
+        reasons.append("long_question")
+    if query.count("?") > 1:
+        score += 1
+        reasons.append("multi_part")
+    span_seconds = duration
+    if clip is not None:
+        span_seconds = (clip[1] if clip[1] is not None else duration or clip[0]) - clip[0]
+    if span_seconds and span_seconds > ROUTER_LONG_VIDEO_SECONDS:
+        score += 1
+        reasons.append("long_video")
+    if re.match(SIMPLE_QUESTION_PATTERN, query, re.IGNORECASE) and words <= 15:
+        score -= 1
+        reasons.append("simple_form")
+    
+    tier = "standard" if score > 0 else "fast"
+    # Borderline questions (length only, no reasoning cue) take the fast tier
+    # while the standard model is slow
+    standard_p95 = _latency_tracker("gemini", f"generate:{STANDARD_MODEL}").p95()
+    borderline = score == 1 and "reasoning" not in reasons
+    if tier == "standard" and borderline and standard_p95 and standard_p95 > ROUTER_SLOW_P95_SECONDS:
+        tier = "fast"
+        reasons.append("standard_slow")
+    
+    model = STANDARD_MODEL if tier == "standard" else FAST_MODEL
+    return model, {"tier": tier, "score": score, "reasons": reasons}
+
+
+# ==========================================
+# Answer Budget: Length and Output Tokens from the Audio Deadline
+# ==========================================
+class ThroughputModel:
+    """
+    Rolling least-squares fit of call duration against output size.
+    
+    seconds = fixed + per_unit * units over the last `size` successful calls;
+    `default` is used until BUDGET_MIN_SAMPLES calls have been recorded or
+    while the sizes are too alike to separate the two terms.
+    """
+    def __init__(self, default, size=100):
+        self.default = default
+        self._samples = []
+        self._size = size
+        self._lock = threading.Lock()
+    
+    def record(self, units, seconds):
+        with self._lock:
+            self._samples.append([units, seconds])
+            if len(self._samples) > self._size:
+                self._samples.pop(0)
+    
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+    
+    def load(self, samples):
+        """Replace the samples (e.g. with ones published by another container)."""
+        with self._lock:
+            self._samples = [list(sample) for sample in samples][-self._size:]
+    
+    def fit(self):
+        """
+        Returns:
+            tuple: (fixed seconds, seconds per unit)
+        """
+        samples = self.samples()
+        if len(samples) < BUDGET_MIN_SAMPLES:
+            return self.default
+        n = len(samples)
+        mean_units = sum(units for units, _ in samples) / n
+        mean_seconds = sum(seconds for _, seconds in samples) / n
+        variance = sum((units - mean_units) ** 2 for units, _ in samples)
+        per_unit = self.default[1]
+        if variance > 0:
+            slope = sum((units - mean_units) * (seconds - mean_seconds) for units, seconds in samples) / variance
+            if slope > 0:
+                per_unit = slope
+        return max(0.0, mean_seconds - per_unit * mean_units), per_unit
+
+
+_throughput = {}
+_throughput_lock = threading.Lock()
+_throughput_loaded = {"tts": 0.0}
+
+
+def _throughput_model(name):
+    """ThroughputModel for a model name (suffix ":digest" for digest answers) or "tts"."""
+    with _throughput_lock:
+        if name not in _throughput:
+            _throughput[name] = ThroughputModel(THROUGHPUT_DEFAULTS.get(name.split(":")[0],
+                                                                        THROUGHPUT_DEFAULTS[STANDARD_MODEL]))
+        return _throughput[name]
+
+
+def _publish_tts_throughput():
+    """Share this TTS container's samples with the question containers."""
+    video_stats.put("throughput/tts", _throughput_model("tts").samples())
+
+
+def _load_tts_throughput():
+    samples = video_stats.get("throughput/tts")
+    if samples:
+        _throughput_model("tts").load(samples)
+
+
+def _tts_throughput():
+    """TTS runs in other containers: reload their samples in the background when stale."""
+    if time.time() - _throughput_loaded["tts"] > THROUGHPUT_REFRESH_SECONDS:
+        _throughput_loaded["tts"] = time.time()
+        _in_background(_load_tts_throughput)
+    return _throughput_model("tts")
+
+
+def _question_type(query):
+    """short (factual lookup), detailed (reasoning) or standard, from the routing patterns."""
+    import re
+    
+    if re.search(COMPLEX_QUESTION_PATTERN, query, re.IGNORECASE):
+        return "detailed"
+    if re.match(SIMPLE_QUESTION_PATTERN, query, re.IGNORECASE) and len(query.split()) <= 15:
+        return "short"
+    return "standard"
+
+
+def _answer_budget(query, model, throughput_name=None):
+    """
+    Words, thinking tokens and max_output_tokens for one answer.
+    
+    The time left until ANSWER_AUDIO_TARGET_SECONDS (minus the reserve and
+    the fixed cost of both calls) is split by the fitted per-token and
+    per-character times, sized for an answer that runs to the token cap;
+    thinking gives way first when time is short, and the question type caps
+    the words.
+    
+    Returns:
+        dict with the length instruction, max_output_tokens (None when
+        ANSWER_BUDGET is off) and thinking_tokens (None for models that do
+        not think), plus the numbers behind them for the answer_budget span
+    """
+    if not ANSWER_BUDGET:
+        return {"instruction": ANSWER_LENGTH_INSTRUCTION.format(low=150, high=200), "max_output_tokens": None,
+                "thinking_tokens": None}
+    
+    kind = _question_type(query)
+    gen_fixed, per_token = _throughput_model(throughput_name or model).fit()
+    tts_fixed, per_char = _tts_throughput().fit()
+    started = _request_started.get() or time.time()
+    remaining = (ANSWER_AUDIO_TARGET_SECONDS - (time.time() - started) - ANSWER_BUDGET_RESERVE_SECONDS
+                 - gen_fixed - tts_fixed)
+    # Plan for the longest answer the token cap lets through
+    per_word = (per_token * TOKENS_PER_WORD + per_char * CHARS_PER_WORD) * ANSWER_TOKEN_SLACK
+    
+    thinking = ANSWER_THINKING_TOKENS[kind] if model in THINKING_MODELS else None
+    words = (remaining - (thinking or 0) * per_token) / per_word
+    if thinking and words < ANSWER_MIN_WORDS:
+        thinking = int(max(0.0, remaining - ANSWER_MIN_WORDS * per_word) / per_token)
+        thinking = thinking if thinking >= 128 else 0  # too little to be worth thinking
+        words = (remaining - thinking * per_token) / per_word
+    high = int(max(ANSWER_MIN_WORDS, min(ANSWER_WORDS[kind], words)))
+    low = max(ANSWER_MIN_WORDS // 2, int(high * 0.75))
+    answer_tokens = math.ceil(high * TOKENS_PER_WORD * ANSWER_TOKEN_SLACK)
+    predicted = gen_fixed + tts_fixed + (thinking or 0) * per_token + high * per_word
+    return {
+        "instruction": ANSWER_LENGTH_INSTRUCTION.format(low=low, high=high),
+        "max_output_tokens": answer_tokens + (thinking or 0),
+        "thinking_tokens": thinking,
+        "type": kind,
+        "words": high,
+        "limited_by": "time" if words < ANSWER_WORDS[kind] else "type",
+        "remaining_s": round(remaining + gen_fixed + tts_fixed, 2),
+        "predicted_s": round(predicted, 2),
+    }
+
+
+def _answer_config(budget, **config):
+    """GenerateContentConfig with the budget's output and thinking limits."""
+    if budget["max_output_tokens"]:
+        config["max_output_tokens"] = budget["max_output_tokens"]
+    if budget["thinking_tokens"] is not None:
+        config["thinking_config"] = types.ThinkingConfig(thinking_budget=budget["thinking_tokens"])
+    return types.GenerateContentConfig(**config)
+
+
+def _record_generate(name, response, seconds):
+    """Feed an answer's output tokens and duration into its ThroughputModel."""
+    usage = _extract_usage(response)
+    if usage and usage["candidate_tokens"] + usage["thoughts_tokens"]:
+        _throughput_model(name).record(usage["candidate_tokens"] + usage["thoughts_tokens"], seconds)
+
+
+def _finish_answer(response):
+    """
+    The answer text; one cut off at max_output_tokens is trimmed back to its
+    last full sentence so the speech does not stop mid-word.
+    """
+    text = response.text
+    candidates = getattr(response, "candidates", None) or []
+    reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    if not text or getattr(reason, "name", reason) != "MAX_TOKENS":
+        return text
+    text = text.rstrip()
+    if text.endswith((".", "!", "?")):
+        return text
+    end = max(text.rfind(mark) for mark in (". ", "! ", "? "))
+    if end >= len(text) // 2:
+        return text[:end + 1]
+    return text + "..."
+
 
 # ==========================================
-# Flexible API Key Loading
+# Search Index: BM25 over Video Digests
 # ==========================================
-def get_api_key(key_name):
-    """Flexible API key loading for multiple environments."""
-    key = os.environ.get(key_name)
-    if key:
-        print(f"✅ Using {key_name} from environment variable")
-        return key
-    print(f"⚠️ {key_name} not found in environment")
-    return None
+SEARCH_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have he her his in is it its of on or "
+    "she that the their them they this to was were what when where which who will with "
+    "you your video videos show shows shown does do did about there here".split()
+)
+
+
+def _tokenize(text):
+    """Lowercase word tokens without stopwords (with naive plural folding)."""
+    import re
+    
+    tokens = []
+    for token in re.findall(r"\w+", (text or "").lower()):
+        if token in SEARCH_STOPWORDS or len(token) < 2:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _scene_extra_text(scene):
+    """Searchable text of a digest scene besides its description."""
+    return " ".join([" ".join(scene.get("objects") or []), scene.get("speech") or ""])
+
+
+class VideoSearchIndex:
+    """
+    BM25 inverted index over per-video digests.
+    
+    Each video is one document (summary + all scenes). The index keeps only
+    postings and document lengths; scene timestamps for the top results are
+    read back from the digests at query time, which keeps the on-volume file
+    small at library scale. Updates are incremental: re-adding a video
+    replaces its previous postings.
+    """
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self):
+        self.videos = []     # doc id -> video filename (None once removed)
+        self.ids = {}        # video filename -> doc id
+        self.lengths = {}    # doc id -> document length in tokens
+        self.postings = {}   # term -> {doc id: term frequency}
+        self.total_length = 0
+    
+    def __len__(self):
+        return len(self.lengths)
+    
+    @staticmethod
+    def document_tokens(digest):
+        """Tokens of a digest: summary plus every scene's text."""
+        tokens = _tokenize(digest.get("summary"))
+        for scene in digest.get("scenes") or []:
+            tokens.extend(_tokenize(f"{scene.get('description') or ''} {_scene_extra_text(scene)}"))
+        return tokens
+    
+    def add(self, video_filename, digest):
+        """Index (or re-index) one video's digest."""
+        from collections import Counter
+        
+        self.remove(video_filename)
+        doc_id = len(self.videos)
+        self.videos.append(video_filename)
+        self.ids[video_filename] = doc_id
+        
+        tokens = self.document_tokens(digest)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+    
+    def remove(self, video_filename):
+        """Drop a video from the index (no-op if absent; scans the postings)."""
+        doc_id = self.ids.pop(video_filename, None)
+        if doc_id is None:
+            return
+        self.videos[doc_id] = None
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in [term for term, docs in self.postings.items() if doc_id in docs]:
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+    
+    def _idf(self, term):
+        import math
+        
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.lengths) - df + 0.5) / (df + 0.5))
+    
+    def search(self, query, top_k=10, load_digest=None, scenes_per_video=3):
+        """
+        Rank videos for a query.
+        
+        Args:
+            query: Free-text query
+            top_k: Number of videos to return
+            load_digest: Optional callable(video_filename) -> digest, used to
+                attach the best-matching scenes of each result
+            scenes_per_video: Scenes (timestamps) to return per video
+        
+        Returns:
+            list of dicts with video, score and, with load_digest, summary,
+            timestamps_ms and scenes (start_ms / end_ms / description)
+        """
+        import heapq
+        
+        terms = set(_tokenize(query))
+        if not terms or not self.lengths:
+            return []
+        
+        avg_length = self.total_length / len(self.lengths) or 1
+        idf = {term: self._idf(term) for term in terms if term in self.postings}
+        scores = {}
+        for term, weight in idf.items():
+            for doc_id, tf in self.postings[term].items():
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf * (self.K1 + 1) / (tf + norm)
+        
+        results = []
+        for doc_id, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]):
+            result = {"video": self.videos[doc_id], "score": round(score, 4)}
+            digest = load_digest(result["video"]) if load_digest else None
+            if digest:
+                ranked = []
+                for scene in digest.get("scenes") or []:
+                    scene_terms = set(_tokenize(f"{scene.get('description') or ''} {_scene_extra_text(scene)}"))
+                    scene_score = sum(weight for term, weight in idf.items() if term in scene_terms)
+                    if scene_score > 0:
+                        ranked.append((scene_score, scene))
+                ranked = heapq.nlargest(scenes_per_video, ranked, key=lambda item: item[0])
+                scenes = [
+                    {"start_ms": int(float(scene.get("start") or 0) * 1000),
+                     "end_ms": int(float(scene.get("end") or 0) * 1000),
+                     "description": scene.get("description") or ""}
+                    for _, scene in ranked
+                ]
+                result.update({
+                    "summary": digest.get("summary") or "",
+                    "timestamps_ms": [scene["start_ms"] for scene in scenes],
+                    "scenes": scenes
+                })
+            results.append(result)
+        return results
+    
+    def to_dict(self):
+        """Serializable form; postings are flattened to [doc_id, tf, doc_id, tf, ...]."""
+        return {
+            "version": 2,
+            "videos": self.videos,
+            "lengths": [self.lengths.get(doc_id, 0) for doc_id in range(len(self.videos))],
+            "postings": {
+                term: [value for item in docs.items() for value in item]
+                for term, docs in self.postings.items()
+            }
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.videos = data.get("videos", [])
+        index.ids = {video: doc_id for doc_id, video in enumerate(index.videos) if video is not None}
+        index.lengths = {
+            doc_id: length for doc_id, length in enumerate(data.get("lengths", []))
+            if index.videos[doc_id] is not None
+        }
+        index.total_length = sum(index.lengths.values())
+        index.postings = {
+            term: dict(zip(flat[::2], flat[1::2])) for term, flat in data.get("postings", {}).items()
+        }
+        return index
+    
+    def save(self, path):
+        """Write the index atomically (readers never see a partial file)."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """Load an index from disk, or return an empty one."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+
+# Loaded index per container, reused until the file on the volume changes
+_search_index_cache = {"mtime": None, "index": None, "reloaded_at": 0.0}
+SEARCH_RELOAD_SECONDS = 30
+
+
+def _get_search_index():
+    """Return the on-volume index, reloading only when it has changed."""
+    # Pick up commits from the indexer at most every SEARCH_RELOAD_SECONDS
+    if time.time() - _search_index_cache["reloaded_at"] > SEARCH_RELOAD_SECONDS:
+        try:
+            vol.reload()
+        except Exception as e:
+            print(f"⚠️ Volume reload failed: {e}")
+        _search_index_cache["reloaded_at"] = time.time()
+    try:
+        mtime = os.path.getmtime(SEARCH_INDEX_PATH)
+    except OSError:
+        return VideoSearchIndex()
+    if _search_index_cache["mtime"] != mtime:
+        with span("search_index_load"):
+            _search_index_cache["index"] = VideoSearchIndex.load(SEARCH_INDEX_PATH)
+        _search_index_cache["mtime"] = mtime
+    return _search_index_cache["index"]
+
 
 # ==========================================
-# Modal Image with New Google GenAI SDK
+# Prompt Builder: Stable Prefix + Compacted History
 # ==========================================
-image = (
-    Image.debian_slim()
-    .apt_install("ffmpeg")
-    .pip_install(
-        "google-genai>=1.0.0",  # New unified SDK with context caching
-        "elevenlabs>=1.0.0",
-        "mcp",
-        "fastapi",
-        "uvicorn",
+def _estimate_tokens(text):
+    """Rough token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _normalize_history(history):
+    """Keep text turns only, mapped to Gemini roles ("user" / "model")."""
+    turns = []
+    for turn in history or []:
+        role = turn.get("role")
+        content = (turn.get("content") or "").strip()
+        if role not in ("user", "assistant", "model") or not content:
+            continue
+        turns.append({"role": "user" if role == "user" else "model", "content": content})
+    return turns
+
+
+def _history_key(history):
+    """Stable digest of a conversation (part of the singleflight key)."""
+    return hashlib.sha256(json.dumps(_normalize_history(history)).encode()).hexdigest()[:16]
+
+
+def _summarize_block(block):
+    """Summarize a block of turns once; later turns reuse the stored summary."""
+    key = hashlib.sha256(json.dumps(block).encode()).hexdigest()
+    summary = conversation_summaries.get(key)
+    if summary:
+        return summary
+    
+    transcript = "\n".join(
+        f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in block
     )
-)
+    try:
+        with span("summarize_history", turns=len(block)):
+            response = _call_upstream("gemini", "summarize", lambda key: _gemini_client(key).models.generate_content(
+                model=SUMMARY_MODEL,
+                contents=[
+                    "Summarize this part of a conversation about a video in at most 80 words. "
+                    "Keep what the user asked about and the facts the assistant stated.\n\n" + transcript
+                ]
+            ), GENERATE_DEADLINE_SECONDS, hedge=True, pool=_key_pool("gemini"))
+        summary = (response.text or "").strip()
+    except Exception as e:
+        print(f"⚠️ History summary failed: {e}")
+        return transcript[:400]
+    
+    if summary:
+        conversation_summaries.put(key, summary)
+    return summary
+
+
+def _compact_history(history):
+    """
+    Split a conversation into summarized older turns and verbatim recent turns.
+    
+    Recent turns are kept while they fit HISTORY_TOKEN_BUDGET. Everything older
+    is folded into fixed, start-aligned blocks of HISTORY_SUMMARY_BLOCK turns,
+    so a block's summary - and the prompt prefix it belongs to - does not
+    change as the conversation grows.
+    
+    Returns:
+        tuple: (summaries, recent_turns)
+    """
+    turns = _normalize_history(history)
+    cut = len(turns)
+    kept_tokens = 0
+    while cut > 0:
+        tokens = _estimate_tokens(turns[cut - 1]["content"])
+        if kept_tokens + tokens > HISTORY_TOKEN_BUDGET:
+            break
+        kept_tokens += tokens
+        cut -= 1
+    
+    folded = min(len(turns), -(-cut // HISTORY_SUMMARY_BLOCK) * HISTORY_SUMMARY_BLOCK)
+    summaries = [
+        _summarize_block(turns[i:i + HISTORY_SUMMARY_BLOCK])
+        for i in range(0, folded, HISTORY_SUMMARY_BLOCK)
+    ]
+    return [summary for summary in summaries if summary], turns[folded:]
+
+
+def _build_prompt(video_part, summaries, recent_turns, question):
+    """
+    Assemble contents with the cacheable parts first.
+    
+    Consecutive turns with the same role are merged so the conversation
+    alternates user/model as the API expects.
+    """
+    contents = [types.Content(role="user", parts=[video_part])]
+    
+    def add_turn(role, text):
+        part = types.Part.from_text(text=text)
+        if contents[-1].role == role:
+            contents[-1].parts.append(part)
+        else:
+            contents.append(types.Content(role=role, parts=[part]))
+    
+    if summaries:
+        add_turn("user", "Summary of the earlier conversation:\n" + "\n\n".join(summaries))
+    for turn in recent_turns:
+        add_turn(turn["role"], turn["content"])
+    add_turn("user", question)
+    return contents
+
+
+# ==========================================
+# Token Accounting: usage_metadata per Video and Model
+# ==========================================
+USAGE_FIELDS = ("prompt_tokens", "cached_tokens", "candidate_tokens", "thoughts_tokens", "total_tokens")
+
+
+def _extract_usage(response):
+    """Pull token counts out of a generate_content response."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_token_count or 0,
+        "cached_tokens": usage.cached_content_token_count or 0,
+        "candidate_tokens": usage.candidates_token_count or 0,
+        "thoughts_tokens": getattr(usage, "thoughts_token_count", None) or 0,
+        "total_tokens": usage.total_token_count or 0,
+    }
+
+
+def _estimate_cost(model, usage):
+    """
+    Estimate USD cost of token counts, and what it would cost with no cache hits.
+    
+    Returns:
+        tuple: (cost, uncached_cost)
+    """
+    pricing = MODEL_PRICING.get(model, MODEL_PRICING["gemini-2.5-flash"])
+    cached = usage["cached_tokens"]
+    fresh = usage["prompt_tokens"] - cached
+    output = usage["candidate_tokens"] + usage["thoughts_tokens"]
+    cost = (fresh * pricing["input"] + cached * pricing["cached_input"] + output * pricing["output"]) / 1e6
+    uncached = (usage["prompt_tokens"] * pricing["input"] + output * pricing["output"]) / 1e6
+    return cost, uncached
+
+
+def _record_usage(video_filename, model, usage):
+    """
+    Store one request's token counts under its own key.
+    
+    A single put per request, so concurrent containers never overwrite each
+    other; _rollup_usage folds the events into the totals.
+    """
+    now = time.time()
+    video_stats.put(f"usage_event/{time.time_ns()}-{uuid.uuid4().hex[:8]}", {
+        "video": video_filename,
+        "model": model,
+        "day": time.strftime("%Y-%m-%d", time.gmtime(now)),
+        **{field: usage[field] for field in USAGE_FIELDS},
+    })
+
+
+def _add_usage(totals, model, usage, questions=1):
+    """Add token counts to a {model: totals} dict in place."""
+    merged = totals.setdefault(model, {"questions": 0, **{field: 0 for field in USAGE_FIELDS}})
+    merged["questions"] += questions
+    for field in USAGE_FIELDS:
+        merged[field] += usage[field]
+
+
+def _rollup_usage():
+    """
+    Fold pending usage events into per-video and per-day totals.
+    
+    Runs in one container at a time (lease), so the totals are read and
+    written by a single writer.
+    
+    Returns:
+        int: events folded in (0 when another container holds the lease)
+    """
+    token = _take_lease(USAGE_ROLLUP_LEASE)
+    if token is None:
+        return 0
+    try:
+        keys = [key for key in video_stats.keys() if isinstance(key, str) and key.startswith("usage_event/")]
+        by_video, by_day = {}, {}
+        for key in keys:
+            event = video_stats.get(key)
+            if event:
+                _add_usage(by_video.setdefault(event["video"], {}), event["model"], event)
+                _add_usage(by_day.setdefault(event["day"], {}), event["model"], event)
+        for prefix, groups in (("usage_video", by_video), ("usage_day", by_day)):
+            for name, models in groups.items():
+                totals = video_stats.get(f"{prefix}/{name}") or {}
+                for model, usage in models.items():
+                    _add_usage(totals, model, usage, usage["questions"])
+                video_stats.put(f"{prefix}/{name}", totals)
+        for key in keys:
+            video_stats.pop(key, None)
+        return len(keys)
+    finally:
+        _release_lease(USAGE_ROLLUP_LEASE, token)
+
+
+def _summarize_usage(model, totals):
+    """Turn accumulated token totals into cache-hit ratio and cost per question."""
+    cost, uncached = _estimate_cost(model, totals)
+    questions = max(1, totals["questions"])
+    prompt_tokens = totals["prompt_tokens"]
+    return {
+        "model": model,
+        "questions": totals["questions"],
+        **{field: totals[field] for field in USAGE_FIELDS},
+        "cache_hit_ratio": round(totals["cached_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0,
+        "est_cost_usd": round(cost, 6),
+        "est_cost_per_question_usd": round(cost / questions, 6),
+        "est_savings_ratio": round(1 - cost / uncached, 3) if uncached else 0.0,
+    }
 
-app = App("mcp-video-agent")
-vol = Volume.from_name("video-storage", create_if_missing=True)
 
 # ==========================================
 # Video Upload: Upload and Store Video File Reference
@@ -38,9 +2517,12 @@ vol = Volume.from_name("video-storage", create_if_missing=True)
     image=image,
     volumes={"/data": vol},
     secrets=[Secret.from_name("my-google-secret")],
-    timeout=600
+    timeout=600,
+    enable_memory_snapshot=MEMORY_SNAPSHOT
 )
-def _internal_create_cache(video_filename: str = "demo_video.mp4", ttl_seconds: int = 3600):
+def _internal_create_cache(video_filename: str = "demo_video.mp4", ttl_seconds: int = 3600,
+                           request_id: str = None, sent_at: float = None, media: dict = None,
+                           progress: bool = False):
     """
     Upload video to Gemini Files API and store the reference.
     This enables implicit caching (automatic with Gemini 2.5 models).
@@ -51,99 +2533,275 @@ def _internal_create_cache(video_filename: str = "demo_video.mp4", ttl_seconds:
     Args:
         video_filename: Video file in the Modal Volume
         ttl_seconds: Not used for implicit caching, kept for API compatibility
+        request_id: Trace ID shared with the caller's latency spans
+        sent_at: Caller's wall-clock time when the call was issued
+        media: ffprobe metadata the caller already measured (optional)
+        progress: Publish stage updates under request_id (see request_progress)
     
     Returns:
         dict with upload info
     """
-    from google import genai
-    import time
-    import json
-    
-    video_path = f"/data/{video_filename}"
-    cache_info_path = f"/data/cache_info/{video_filename.replace('.mp4', '')}.json"
+    _begin_request(request_id, sent_at, progress=progress)
+    video_path = f"{DATA_DIR}/{video_filename}"
     
     # Wait for volume sync
     print(f"📂 Checking video: {video_path}")
-    for i in range(10):
-        if os.path.exists(video_path):
-            break
-        print(f"⏳ Waiting for volume sync... ({i+1}/10)")
-        time.sleep(1)
-    else:
+    with span("volume_wait"):
+        found = _wait_for_video(video_path)
+    if not found:
         return {"error": f"Video not found: {video_filename}"}
     
-    # Initialize client
-    api_key = get_api_key("GOOGLE_API_KEY")
-    if not api_key:
+    if not _key_pool("gemini").keys:
         return {"error": "GOOGLE_API_KEY not set"}
     
-    client = genai.Client(api_key=api_key)
+    try:
+        _, plan = _preflight(video_filename, media)
+        if plan["error"]:
+            return {"error": plan["error"]}
+        cache_info, status = _ensure_ingested(_source_filename(video_filename, plan))
+    except Exception as e:
+        print(f"❌ Ingest failed: {e}")
+        return {"error": str(e)}
     
-    # Check if we have an existing uploaded file
-    os.makedirs("/data/cache_info", exist_ok=True)
-    if os.path.exists(cache_info_path):
-        try:
-            with open(cache_info_path, 'r') as f:
-                existing_info = json.load(f)
-            
-            file_name = existing_info.get("file_name")
-            if file_name:
-                try:
-                    # Check if file still exists
-                    file_info = client.files.get(name=file_name)
-                    if file_info.state.name == 'ACTIVE':
-                        print(f"📂 Found existing uploaded file: {file_name}")
-                        return {
-                            "status": "existing",
-                            "file_name": file_name,
-                            "file_uri": existing_info.get("file_uri"),
-                            "video": video_filename,
-                            "message": "Video already uploaded! Implicit caching is active."
-                        }
-                except Exception as e:
-                    print(f"⚠️ Existing file expired or invalid: {e}")
-        except Exception as e:
-            print(f"⚠️ Could not read cache info: {e}")
+    try:
+        _request_digest(video_filename)
+    except Exception as e:
+        print(f"⚠️ Could not schedule digest: {e}")
     
-    # Upload video to Gemini Files API
-    print(f"📤 Uploading video to Gemini Files API...")
-    video_file = client.files.upload(file=video_path)
+    if status != "uploaded":
+        status = "existing"
+        message = "Video already uploaded! Implicit caching is active."
+    else:
+        message = "Video uploaded! Gemini 2.5 will use implicit caching automatically."
     
-    # Wait for processing
-    print("⏳ Waiting for video processing...")
-    while video_file.state.name == 'PROCESSING':
-        print('.', end='', flush=True)
-        time.sleep(2)
-        video_file = client.files.get(name=video_file.name)
+    return {
+        "status": status,
+        "file_name": cache_info["file_name"],
+        "file_uri": cache_info["file_uri"],
+        "video": video_filename,
+        "message": message
+    }
+
+
+# ==========================================
+# Chunked Uploads: Server-Side Assembly
+# ==========================================
+def _upload_part_path(upload_id, index):
+    return f"{UPLOADS_DIR}/{upload_id}/{index:05d}.part"
+
+
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    timeout=600
+)
+def _internal_assemble_upload(upload_id: str, video_filename: str, parts: list,
+                              request_id: str = None, sent_at: float = None):
+    """
+    Join the uploaded parts of a chunked upload into one video on the volume.
     
-    if video_file.state.name == 'FAILED':
-        return {"error": "Video processing failed"}
+    Every part is checked against its size and SHA-256 before anything is
+    written; when some are missing or corrupt, nothing is assembled and the
+    caller re-sends only those parts. Calling it again after success is a
+    no-op, so a caller that lost the response can simply retry.
     
-    print(f"\n✅ Video uploaded: {video_file.uri}")
-    print(f"   File name: {video_file.name}")
+    Args:
+        upload_id: Parts directory under uploads/ (the Space uses the content hash)
+        video_filename: Target file in the volume
+        parts: [{"index": int, "size": int, "sha256": str}] in file order
+        request_id: Trace ID shared with the caller's latency spans
+        sent_at: Caller's wall-clock time when the call was issued
     
-    # Save file info (for implicit caching)
-    cache_info = {
-        "file_name": video_file.name,
-        "file_uri": video_file.uri,
-        "video_filename": video_filename,
-        "model": "gemini-2.5-flash",
-        "created_at": time.time(),
-        "mode": "implicit_caching"
-    }
+    Returns:
+        dict: {"status": "assembled", "bytes": n}, {"status": "incomplete",
+        "missing": [index, ...]} or {"error": ...}
+    """
+    _begin_request(request_id, sent_at)
+    if not upload_id.isalnum() or os.path.basename(video_filename) != video_filename:
+        return {"error": f"Invalid upload: {upload_id} -> {video_filename}"}
     
-    with open(cache_info_path, 'w') as f:
-        json.dump(cache_info, f, indent=2)
+    target_path = f"{DATA_DIR}/{video_filename}"
+    total = sum(part["size"] for part in parts)
+    vol.reload()  # parts were uploaded after this container last looked
+    if os.path.exists(target_path) and os.path.getsize(target_path) == total:
+        return {"status": "assembled", "bytes": total}
     
-    vol.commit()
+    with span("assemble_upload", parts=len(parts), bytes=total) as attrs:
+        missing = []
+        for part in parts:
+            path = _upload_part_path(upload_id, part["index"])
+            if not os.path.exists(path) or os.path.getsize(path) != part["size"]:
+                missing.append(part["index"])
+                continue
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != part["sha256"]:
+                print(f"⚠️ Part {part['index']} of {upload_id} failed its checksum")
+                missing.append(part["index"])
+        attrs["missing"] = len(missing)
+        if missing:
+            return {"status": "incomplete", "missing": missing}
+        
+        tmp_path = f"{target_path}.{uuid.uuid4().hex[:8]}.part"
+        with open(tmp_path, 'wb') as out:
+            for part in parts:
+                with open(_upload_part_path(upload_id, part["index"]), 'rb') as f:
+                    shutil.copyfileobj(f, out, 8 * 1024 * 1024)
+        os.replace(tmp_path, target_path)
+        shutil.rmtree(f"{UPLOADS_DIR}/{upload_id}", ignore_errors=True)
     
-    return {
-        "status": "uploaded",
-        "file_name": video_file.name,
-        "file_uri": video_file.uri,
-        "video": video_filename,
-        "message": "Video uploaded! Gemini 2.5 will use implicit caching automatically."
-    }
+    # The next call (analyze) runs in another container
+    _volume_writes.mark()
+    _volume_writes.flush()
+    print(f"✅ Assembled {video_filename} from {len(parts)} parts ({total / (1024 * 1024):.1f}MB)")
+    return {"status": "assembled", "bytes": total}
+
+
+# ==========================================
+# Transcode: H.264 Copies off the Request Path
+# ==========================================
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    timeout=TRANSCODE_TIMEOUT_SECONDS + 120
+)
+def _internal_transcode_video(video_filename: str):
+    """
+    Re-encode a video Gemini cannot decode to H.264/AAC MP4.
+    
+    Started once per video by _transcode_video, which polls the volume for
+    the result. Failures are recorded under transcode_error/ so questions
+    get a clear rejection instead of starting the encode again.
+    
+    Returns:
+        dict with "filename", or "error"
+    """
+    import glob
+    import subprocess
+    
+    out_filename = _transcoded_filename(video_filename)
+    out_path = f"{DATA_DIR}/{out_filename}"
+    tmp_path = f"{out_path}.{uuid.uuid4().hex[:8]}.part.mp4"
+    try:
+        vol.reload()
+        if os.path.exists(out_path):
+            return {"filename": out_filename}
+        os.makedirs(TRANSCODED_DIR, exist_ok=True)
+        # Leftovers of runs that were killed mid-encode
+        for stale in glob.glob(f"{glob.escape(out_path)}.*.part.mp4"):
+            os.remove(stale)
+        
+        cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", f"{DATA_DIR}/{video_filename}",
+               "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", "-movflags", "+faststart", tmp_path]
+        error = None
+        with span("transcode_encode") as attrs:
+            try:
+                subprocess.run(cmd, check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT_SECONDS)
+                os.replace(tmp_path, out_path)
+            except subprocess.TimeoutExpired:
+                error = (f"Converting the video to H.264 took longer than "
+                         f"{TRANSCODE_TIMEOUT_SECONDS // 60} minutes; please upload an H.264 MP4.")
+            except subprocess.CalledProcessError as e:
+                detail = (e.stderr or b"").decode(errors="replace").strip()[-200:]
+                error = f"The video could not be converted to H.264: {detail or f'ffmpeg exited with {e.returncode}'}"
+            except OSError as e:
+                error = f"The video could not be converted to H.264: {e}"
+            attrs["error"] = error is not None
+        
+        if error:
+            print(f"❌ Transcode of {video_filename} failed: {error}")
+            video_stats.put(f"transcode_error/{video_filename}", error)
+            return {"error": error}
+        # The waiting question runs in another container
+        _volume_writes.mark()
+        _volume_writes.flush()
+        print(f"✅ Transcoded {video_filename} -> {out_filename}")
+        return {"filename": out_filename}
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        video_stats.pop(f"transcode_pending/{video_filename}", None)
+
+
+# ==========================================
+# Digest Build: One Gemini Pass per Video
+# ==========================================
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    secrets=[Secret.from_name("my-google-secret")],
+    timeout=900
+)
+def _internal_build_digest(video_filename: str = "demo_video.mp4", force: bool = False):
+    """
+    Build the timestamped scene/object/speech timeline for a video.
+    
+    Args:
+        video_filename: Video file in the volume
+        force: Rebuild even if a digest already exists
+    
+    Returns:
+        dict with digest status and scene count
+    """
+    try:
+        if not force:
+            digest = _read_digest(video_filename)
+            if digest is not None:
+                return {"status": "existing", "video": video_filename, "scenes": len(digest.get("scenes", []))}
+        
+        if not _key_pool("gemini").keys:
+            return {"error": "GOOGLE_API_KEY not set"}
+        
+        _, plan = _preflight(video_filename)
+        if plan["error"]:
+            return {"error": plan["error"]}
+        source_filename = _source_filename(video_filename, plan)
+        inline, _, _ = _inline_decision(source_filename)
+        if inline:
+            video_part, key_id = _inline_video_part(source_filename), None
+        else:
+            cache_info, _ = _ensure_ingested(source_filename)
+            video_part, key_id = _video_part(cache_info), cache_info.get("api_key_id")
+        print(f"🗂️ Building digest for {video_filename}{' (inline)' if inline else ''}...")
+        with span("digest_build", model=DIGEST_MODEL, inline=inline):
+            response = _call_upstream("gemini", "digest", lambda key: _gemini_client(key).models.generate_content(
+                model=DIGEST_MODEL,
+                contents=[video_part, DIGEST_PROMPT],
+                config=types.GenerateContentConfig(response_mime_type="application/json",
+                                                   media_resolution=_media_resolution(plan))
+            ), DIGEST_DEADLINE_SECONDS, pool=_key_pool("gemini"), key_id=key_id)
+        digest = json.loads(response.text)
+        digest.update({
+            "video_filename": video_filename,
+            "model": DIGEST_MODEL,
+            "created_at": time.time()
+        })
+        
+        usage = _extract_usage(response)
+        if usage:
+            _record_usage(video_filename, DIGEST_MODEL, usage)
+        
+        os.makedirs(DIGESTS_DIR, exist_ok=True)
+        with open(_digest_path(video_filename), 'w') as f:
+            json.dump(digest, f, indent=2)
+        # The search indexer reads the digest from another container
+        _volume_writes.mark()
+        _volume_writes.flush()
+        
+        print(f"✅ Digest ready: {len(digest.get('scenes', []))} scenes")
+        try:
+            video_stats.put(f"index_pending/{video_filename}", time.time())
+            _internal_update_search_index.spawn()
+        except Exception as e:
+            print(f"⚠️ Could not schedule search indexing: {e}")
+        return {"status": "built", "video": video_filename, "scenes": len(digest.get("scenes", []))}
+    except Exception as e:
+        print(f"❌ Digest build failed: {e}")
+        return {"error": str(e)}
+    finally:
+        video_stats.pop(f"digest_pending/{video_filename}", None)
 
 
 # ==========================================
@@ -154,129 +2812,221 @@ def _internal_create_cache(video_filename: str = "demo_video.mp4", ttl_seconds:
     volumes={"/data": vol},
     secrets=[Secret.from_name("my-google-secret")],
     timeout=600,
-    max_containers=5  # Limit concurrent containers for cost control
+    max_containers=5,  # Limit concurrent containers for cost control
+    enable_memory_snapshot=MEMORY_SNAPSHOT
 )
-def _internal_analyze_video(query: str, video_filename: str = "demo_video.mp4"):
+@modal.concurrent(max_inputs=8)  # Let duplicate questions meet in one container
+def _internal_analyze_video(query: str, video_filename: str = "demo_video.mp4",
+                            request_id: str = None, sent_at: float = None,
+                            history: list = None,
+                            start_seconds: float = None, end_seconds: float = None,
+                            media: dict = None, progress: bool = False):
     """
     Analyze video using Context Cache (if available) or direct upload (fallback).
     
+    Identical (video, question) pairs that arrive while one is already being
+    answered in this container share that answer instead of calling Gemini again.
+    
     Args:
         query: User's question
         video_filename: Video file in the volume
+        request_id: Trace ID shared with the caller's latency spans
+        sent_at: Caller's wall-clock time when the call was issued
+        history: Earlier turns as [{"role": "user"|"assistant", "content": str}]
+        start_seconds: Optional start of the time range to analyze
+        end_seconds: Optional end of the time range (default: end of video)
+        media: ffprobe metadata the caller already measured (optional)
+        progress: Publish stage updates under request_id (see request_progress)
     
     Returns:
         str: Analysis result
     """
-    from google import genai
-    from google.genai import types
-    import json
-    import time
+    _begin_request(request_id, sent_at, "_internal_analyze_video", progress)
+    try:
+        clip = _normalize_clip(start_seconds, end_seconds)
+    except ValueError as e:
+        return f"⚠️ {e}"
     
-    video_path = f"/data/{video_filename}"
-    cache_info_path = f"/data/cache_info/{video_filename.replace('.mp4', '')}.json"
+    result, shared = _query_flight.do(
+        (video_filename, query, _history_key(history), clip),
+        lambda: _analyze_video(query, video_filename, history, clip, media)
+    )
+    if shared:
+        print(f"🔗 Shared in-flight answer for: {query[:60]}")
+    return result
+
+
+def _analyze_video(query, video_filename, history=None, clip=None, media=None):
+    """Answer one question about a video (body of _internal_analyze_video)."""
+    video_path = f"{DATA_DIR}/{video_filename}"
     
     # Wait for volume sync
     print(f"📂 Checking video: {video_filename}")
-    for i in range(10):
-        if os.path.exists(video_path):
-            break
-        print(f"⏳ Waiting for volume sync... ({i+1}/10)")
-        time.sleep(1)
-    else:
-        files = os.listdir("/data") if os.path.exists("/data") else []
+    with span("volume_wait"):
+        found = _wait_for_video(video_path)
+    if not found:
+        files = os.listdir(DATA_DIR) if os.path.exists(DATA_DIR) else []
         return f"❌ Error: Video not found: {video_filename}\nFiles in /data: {files[:10]}"
     
-    # Initialize client
-    api_key = get_api_key("GOOGLE_API_KEY")
-    if not api_key:
+    if not _key_pool("gemini").keys:
         return "❌ Error: GOOGLE_API_KEY not set"
     
-    client = genai.Client(api_key=api_key)
-    
-    # ==========================================
-    # Try to use pre-uploaded file (implicit caching)
-    # ==========================================
-    video_file = None
-    
-    if os.path.exists(cache_info_path):
-        try:
-            with open(cache_info_path, 'r') as f:
-                cache_info = json.load(f)
-            
-            file_name = cache_info.get("file_name")
-            
-            if file_name:
-                print(f"📂 Found pre-uploaded file: {file_name}")
-                
-                # Try to get the existing file
-                try:
-                    video_file = client.files.get(name=file_name)
-                    if video_file.state.name == 'ACTIVE':
-                        print(f"✅ Using cached file (implicit caching active)")
-                    else:
-                        print(f"⚠️ File state: {video_file.state.name}, re-uploading...")
-                        video_file = None
-                except Exception as e:
-                    print(f"⚠️ Could not retrieve file: {e}")
-                    video_file = None
-            
+    # Reject unusable videos before anything is uploaded or tokenized
+    media, plan = _preflight(video_filename, media)
+    if plan["error"]:
+        return f"❌ {plan['error']}"
+    # Hotness is recorded under the name the ingest record is stored under,
+    # which is what the expiry refresher looks up
+    record_filename = _transcoded_filename(video_filename) if plan["transcode"] else video_filename
+    
+    summaries, recent_turns = _compact_history(history)
+    if summaries or recent_turns:
+        print(f"💬 History: {len(summaries)} summarized blocks + {len(recent_turns)} recent turns")
+    
+    # ==========================================
+    # Answer from the digest when the question allows it
+    # ==========================================
+    digest = _read_digest(video_filename)
+    route = _route_question(query, digest, clip)
+    if route == "local":
+        print(f"🗂️ Answered from digest (no model call)")
+        _in_background(_touch_video, record_filename)
+        return _answer_locally(query, digest)
+    if route == "digest":
+        try:
+            answer, response = _answer_from_digest(query, digest, summaries, recent_turns)
+            usage = _extract_usage(response)
+            if usage:
+                _in_background(_record_usage, video_filename, DIGEST_ANSWER_MODEL, usage)
+            if answer:
+                print(f"🗂️ Answered from digest ({DIGEST_ANSWER_MODEL})")
+                _in_background(_touch_video, record_filename)
+                return answer
+            print(f"🎬 Digest lacks the answer, escalating to full video analysis")
         except Exception as e:
-            print(f"⚠️ Cache info read failed: {e}")
+            print(f"⚠️ Digest answer failed ({e}), escalating to full video analysis")
+    
+    # Time ranges use API video offsets when possible, else a cached ffmpeg clip
+    use_offsets = clip is not None and CLIP_MODE != "ffmpeg" and _supports_video_offsets()
     
     # ==========================================
-    # Upload video if not already uploaded
+    # Send small videos inline, else use pre-uploaded file (implicit caching) or upload once
     # ==========================================
-    if video_file is None:
-        print(f"🎬 Uploading video to Gemini...")
-        
-        video_file = client.files.upload(file=video_path)
-        
-        # Wait for processing
-        while video_file.state.name == 'PROCESSING':
-            print('.', end='', flush=True)
-            time.sleep(2)
-            video_file = client.files.get(name=video_file.name)
-        
-        if video_file.state.name == 'FAILED':
-            return "❌ Video processing failed"
-        
-        print(f"\n✅ Video uploaded: {video_file.uri}")
-        
-        # Save file info for future use
-        os.makedirs("/data/cache_info", exist_ok=True)
-        cache_info = {
-            "file_name": video_file.name,
-            "file_uri": video_file.uri,
-            "video_filename": video_filename,
-            "model": "gemini-2.5-flash",
-            "created_at": time.time(),
-            "mode": "implicit_caching"
-        }
-        with open(cache_info_path, 'w') as f:
-            json.dump(cache_info, f, indent=2)
-        vol.commit()
+    try:
+        source_filename = _source_filename(video_filename, plan)
+        ingest_filename = source_filename
+        if clip is not None and not use_offsets:
+            ingest_filename = _cut_clip(source_filename, clip)
+        inline, inline_reason, duration = _inline_decision(ingest_filename, digest if ingest_filename == video_filename else None)
+        if inline:
+            cache_info, status = {"duration_seconds": duration}, "inline"
+            print(f"⚡ Sending {ingest_filename} inline ({duration:g}s, no Files API upload)")
+        else:
+            cache_info, status = _ensure_ingested(ingest_filename)
+        if status == "trusted":
+            print(f"✅ Using cached file (verified {int(time.time() - cache_info['verified_at'])}s ago)")
+        elif status == "existing":
+            print(f"✅ Using cached file (implicit caching active)")
+    except TranscodeError as e:
+        return f"{'⚠️' if e.pending else '❌'} {e}"
+    except RuntimeError:
+        return "❌ Video processing failed"
+    except Exception as e:
+        print(f"❌ Ingest failed: {e}")
+        return f"❌ Error: {str(e)}"
+    
+    _in_background(_touch_video, ingest_filename)
+    if status == "inline":
+        _in_background(_count_inline_question, ingest_filename)
+    elif status != "uploaded":
+        _in_background(_credit_refresh, video_filename, cache_info)
+    if digest is None:
+        _in_background(_request_digest, video_filename)
     
     # ==========================================
     # Generate content using the file
     # ==========================================
     try:
-        print(f"🧠 Analyzing with Gemini 2.5 Flash...")
-        
-        # Generate content (implicit caching happens automatically)
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                video_file,
-                f"{query}\n\nPlease provide a concise response within 150-200 words. Be direct and informative. Do NOT mention specific timestamps unless asked."
-            ]
+        model, decision = _route_model(
+            query, _video_duration(cache_info, digest) or (media or {}).get("duration_seconds"), clip
         )
+        with span("model_route", model=model, **decision):
+            pass
+        print(f"🧠 Analyzing with {model} ({decision['tier']}: {', '.join(decision['reasons']) or 'no complexity signals'})...")
+        
+        inline_part = _inline_video_part(ingest_filename, clip if use_offsets else None) if status == "inline" else None
+        
+        def generate(model, attempt=0):
+            # Generate content (implicit caching happens automatically)
+            if status == "inline":
+                video_part = inline_part
+            else:
+                video_part = _video_part(cache_info, clip if use_offsets else None)
+            # Length and output tokens from the time left for this answer and its speech
+            budget = _answer_budget(query, model)
+            with span("answer_budget", model=model, route="video",
+                      **{k: v for k, v in budget.items() if k != "instruction"}):
+                pass
+            question = f"{query}\n\n{budget['instruction']}"
+            if clip is not None:
+                question = f"{_clip_note(clip)}\n\n{question}"
+            with span("generate", model=model, tier=decision["tier"], attempt=attempt, clip=clip is not None,
+                      inline=status == "inline") as attrs:
+                start = time.monotonic()
+                response = _call_upstream("gemini", f"generate:{model}", lambda key: _gemini_client(key).models.generate_content(
+                    model=model,
+                    contents=_build_prompt(video_part, summaries, recent_turns, question),
+                    config=_answer_config(budget, system_instruction=SYSTEM_INSTRUCTION,
+                                          media_resolution=_media_resolution(plan))
+                ), GENERATE_DEADLINE_SECONDS, hedge=True,
+                   pool=_key_pool("gemini"), key_id=cache_info.get("api_key_id"))
+                _record_generate(model, response, time.monotonic() - start)
+                attrs["answered"] = bool(response.text)
+            
+            # Record token usage to track implicit-cache hits and cost
+            usage = _extract_usage(response)
+            if usage:
+                cost, _ = _estimate_cost(model, usage)
+                print(f"📊 Usage ({model}): {usage['prompt_tokens']} prompt ({usage['cached_tokens']} cached), "
+                      f"{usage['candidate_tokens']} output, ~${cost:.5f}")
+                _in_background(_record_usage, video_filename, model, usage)
+            return response
         
-        # Print usage metadata to see caching info
-        if hasattr(response, 'usage_metadata'):
-            print(f"📊 Usage: {response.usage_metadata}")
+        for attempt in range(2):
+            try:
+                response = generate(model, attempt)
+                break
+            except Exception as e:
+                if attempt > 0:
+                    raise
+                if status == "inline":
+                    if _status_code(e) not in (400, 413):
+                        raise
+                    # Inline request rejected (size or format): use the Files API instead
+                    print(f"⚠️ Inline video rejected ({e}), uploading via Files API...")
+                    cache_info, status = _ensure_ingested(ingest_filename)
+                elif _is_missing_file_error(e):
+                    # The trusted record outlived its file: re-ingest and retry once
+                    print(f"⚠️ Gemini file {cache_info['file_name']} is gone ({e}), re-ingesting...")
+                    cache_info, _ = _ensure_ingested(ingest_filename, stale_file_name=cache_info["file_name"])
+                elif use_offsets and getattr(e, "code", None) == 400:
+                    # Offsets rejected for this file: fall back to a cut clip
+                    print(f"⚠️ Video offsets rejected ({e}), cutting a clip instead...")
+                    use_offsets = False
+                    ingest_filename = _cut_clip(source_filename, clip)
+                    cache_info, _ = _ensure_ingested(ingest_filename)
+                else:
+                    raise
         
-        if response.text:
-            return response.text
+        if not response.text and model != STANDARD_MODEL:
+            # The fast tier came back empty: ask the standard model before giving up
+            print(f"⚠️ No answer from {model}, escalating to {STANDARD_MODEL}")
+            decision["reasons"].append("escalated")
+            response = generate(STANDARD_MODEL)
+        
+        answer = _finish_answer(response)
+        if answer:
+            return answer
         else:
             return "⚠️ No response generated. The content may have been blocked."
         
@@ -297,7 +3047,7 @@ def _internal_view_cache(video_filename: str = "demo_video.mp4"):
     """View the cache status for a video."""
     import json
     
-    cache_info_path = f"/data/cache_info/{video_filename.replace('.mp4', '')}.json"
+    cache_info_path = _cache_info_path(video_filename)
     
     if not os.path.exists(cache_info_path):
         return {
@@ -310,10 +3060,9 @@ def _internal_view_cache(video_filename: str = "demo_video.mp4"):
         with open(cache_info_path, 'r') as f:
             cache_info = json.load(f)
         
-        import time
         created_at = cache_info.get("created_at", 0)
-        ttl = cache_info.get("ttl_seconds", 3600)
-        expires_at = created_at + ttl
+        expires_at = cache_info.get("expires_at") or created_at + cache_info.get("ttl_seconds", 3600)
+        ttl = int(expires_at - created_at)
         remaining = expires_at - time.time()
         
         return {
@@ -329,6 +3078,59 @@ def _internal_view_cache(video_filename: str = "demo_video.mp4"):
         return {"error": str(e)}
 
 
+# ==========================================
+# Usage Report: Token Counts, Cache Hits and Cost
+# ==========================================
+@app.function(
+    image=image,
+    timeout=60
+)
+def _internal_usage_report(video_filename: str = None, days: int = USAGE_REPORT_DAYS):
+    """
+    Summarize token usage and implicit-cache hits (on demand, not per question).
+    
+    Args:
+        video_filename: Limit the report to one video (default: every video
+            over the last `days` days)
+        days: Days covered by the report without a video
+    
+    Returns:
+        dict with per-(video, model) or per-(day, model) rows and an overall summary
+    """
+    _rollup_usage()  # include questions since the last scheduled rollup
+    overall = {}
+    if video_filename:
+        groups = {video_filename: video_stats.get(f"usage_video/{video_filename}") or {}}
+    else:
+        today = time.time() // 86400 * 86400
+        groups = {}
+        for i in range(days):
+            day = time.strftime("%Y-%m-%d", time.gmtime(today - i * 86400))
+            groups[day] = video_stats.get(f"usage_day/{day}") or {}
+    
+    rows = []
+    for name, models in groups.items():
+        for model, totals in models.items():
+            rows.append({"video" if video_filename else "day": name, **_summarize_usage(model, totals)})
+            _add_usage(overall, model, totals, totals["questions"])
+    return {
+        "videos" if video_filename else "days": rows,
+        "overall": [_summarize_usage(model, totals) for model, totals in overall.items()],
+    }
+
+
+@app.function(
+    image=image,
+    timeout=300,
+    schedule=modal.Period(minutes=10)
+)
+def _internal_rollup_usage():
+    """Fold recorded usage events into the per-video and per-day totals."""
+    folded = _rollup_usage()
+    print(f"📊 Usage rollup: {folded} requests folded in")
+    return {"folded": folded}
+
+
 # ==========================================
 # Delete Cache
 # ==========================================
@@ -340,10 +3142,9 @@ def _internal_view_cache(video_filename: str = "demo_video.mp4"):
 )
 def _internal_delete_cache(video_filename: str = "demo_video.mp4"):
     """Delete the cache for a video."""
-    from google import genai
     import json
     
-    cache_info_path = f"/data/cache_info/{video_filename.replace('.mp4', '')}.json"
+    cache_info_path = _cache_info_path(video_filename)
     
     if not os.path.exists(cache_info_path):
         return {"status": "no_cache", "message": "No cache to delete"}
@@ -372,20 +3173,347 @@ def _internal_delete_cache(video_filename: str = "demo_video.mp4"):
         return {"error": str(e)}
 
 
+# ==========================================
+# Warm Pools: Traffic-Driven Min/Buffer Containers
+# ==========================================
+def _warm_pool_plan(peak_rates, budget_usd_per_hour=None):
+    """
+    Warm containers per function for the given peak request rates.
+    
+    By Little's law a function needs rate x busy_seconds / max_inputs
+    containers to absorb its busiest minute without cold starts. While the
+    budget lasts, every function with traffic gets one warm container, then
+    the rest of what it needs, then one buffer container (busiest first);
+    idle functions scale to zero.
+    
+    Args:
+        peak_rates: {function name: requests per second in the busiest minute}
+        budget_usd_per_hour: Cost cap (default WARM_POOL_BUDGET_USD_PER_HOUR)
+    
+    Returns:
+        dict: {function name: {"min_containers": int, "buffer_containers": int}}
+    """
+    budget = WARM_POOL_BUDGET_USD_PER_HOUR if budget_usd_per_hour is None else budget_usd_per_hour
+    affordable = int(budget // CONTAINER_COST_USD_PER_HOUR) if CONTAINER_COST_USD_PER_HOUR > 0 else 0
+    busiest = sorted(WARM_POOL_FUNCTIONS, key=lambda name: peak_rates.get(name, 0), reverse=True)
+    
+    plan = {name: {"min_containers": 0, "buffer_containers": 0} for name in busiest}
+    needed = {}
+    for name in busiest:
+        spec, rate = WARM_POOL_FUNCTIONS[name], peak_rates.get(name, 0)
+        needed[name] = min(math.ceil(rate * spec["busy_seconds"] / spec["max_inputs"]), spec["max_containers"])
+    for target in (lambda name: min(needed[name], 1), lambda name: needed[name]):
+        for name in busiest:
+            extra = min(target(name) - plan[name]["min_containers"], affordable)
+            if extra > 0:
+                plan[name]["min_containers"] += extra
+                affordable -= extra
+    for name in busiest:
+        if needed[name] and affordable > 0 and plan[name]["min_containers"] < WARM_POOL_FUNCTIONS[name]["max_containers"]:
+            plan[name]["buffer_containers"] = 1
+            affordable -= 1
+    return plan
+
+
+@app.function(
+    image=image,
+    timeout=120,
+    schedule=modal.Period(minutes=5)
+)
+def _internal_autoscale_warm_pools(dry_run: bool = False):
+    """
+    Resize the warm pools of the user-facing functions from recent traffic.
+    
+    Reads the per-minute request counts of the last WARM_POOL_WINDOW_MINUTES,
+    plans min/buffer containers within the cost cap and applies them with
+    update_autoscaler. A redeploy resets the pools to the static decorator
+    settings until the next run.
+    
+    Args:
+        dry_run: Only report the plan
+    
+    Returns:
+        dict with the peak rates, the plan and its estimated idle cost
+    """
+    now_minute = int(time.time() // 60)
+    minutes, stale = {}, []
+    for key, count in video_stats.items():
+        if not isinstance(key, str) or not key.startswith("traffic/"):
+            continue
+        # traffic/<function>/<minute>/<container>: sum the containers' shards
+        _, name, minute = key.split("/")[:3]
+        if now_minute - int(minute) > WARM_POOL_WINDOW_MINUTES:
+            stale.append(key)
+        else:
+            minutes[name, minute] = minutes.get((name, minute), 0) + count
+    for key in stale:
+        video_stats.pop(key, None)
+    peaks = {}
+    for (name, _), count in minutes.items():
+        peaks[name] = max(peaks.get(name, 0), count)
+    
+    peak_rates = {name: round(count / 60, 3) for name, count in peaks.items()}
+    plan = _warm_pool_plan(peak_rates)
+    warm = sum(settings["min_containers"] for settings in plan.values())
+    
+    with span("autoscale", warm_containers=warm, dry_run=dry_run) as attrs:
+        for name, settings in plan.items():
+            print(f"🔥 {name}: peak {peak_rates.get(name, 0)}/s -> "
+                  f"{settings['min_containers']} warm + {settings['buffer_containers']} buffer")
+            if not dry_run:
+                try:
+                    modal.Function.from_name(app.name, name).update_autoscaler(**settings)
+                except Exception as e:
+                    attrs["error"] = type(e).__name__
+                    print(f"⚠️ Could not update {name}: {e}")
+    
+    result = {
+        "peak_rates": peak_rates,
+        "plan": plan,
+        "est_idle_cost_usd_per_hour": round(warm * CONTAINER_COST_USD_PER_HOUR, 3),
+        "budget_usd_per_hour": WARM_POOL_BUDGET_USD_PER_HOUR,
+        "updated_at": time.time()
+    }
+    video_stats.put("warm_pool/plan", result)
+    return result
+
+
+# ==========================================
+# Background Refresh: Re-ingest Hot Videos Before Expiry
+# ==========================================
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    secrets=[Secret.from_name("my-google-secret")],
+    timeout=1800,
+    schedule=modal.Period(minutes=30)
+)
+def _internal_refresh_expiring_files():
+    """
+    Re-upload recently used videos whose Gemini file is about to expire.
+    
+    Runs on a schedule so hot videos always have a valid file and the next
+    question never pays the upload + processing cost inside
+    _internal_analyze_video.
+    
+    Returns:
+        dict with scan/refresh counts and the cumulative re-uploads avoided
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import json
+    
+    if not _key_pool("gemini").keys:
+        return {"error": "GOOGLE_API_KEY not set"}
+    
+    now = time.time()
+    candidates = []
+    scanned = 0
+    for entry in sorted(os.listdir(CACHE_INFO_DIR)) if os.path.exists(CACHE_INFO_DIR) else []:
+        if not entry.endswith(".json"):
+            continue
+        scanned += 1
+        try:
+            with open(f"{CACHE_INFO_DIR}/{entry}", 'r') as f:
+                cache_info = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Skipping unreadable {entry}: {e}")
+            continue
+        
+        video_filename = cache_info.get("video_filename")
+        expires_at = cache_info.get("expires_at")
+        if not video_filename or not expires_at or expires_at - now > REFRESH_AHEAD_SECONDS:
+            continue
+        last_used_at = video_stats.get(f"last_used/{video_filename}", 0)
+        if now - last_used_at > REFRESH_HOT_WINDOW_SECONDS:
+            continue
+        if not os.path.exists(f"{DATA_DIR}/{video_filename}"):
+            continue
+        candidates.append(cache_info)
+    
+    print(f"🔄 {len(candidates)} of {scanned} ingested videos are hot and expiring soon")
+    
+    def refresh(cache_info):
+        video_filename = cache_info["video_filename"]
+        try:
+            _ingest_video(
+                video_filename,
+                stale_file_name=cache_info["file_name"],
+                annotations={
+                    "refreshed_at": time.time(),
+                    "replaced_expires_at": cache_info["expires_at"]
+                }
+            )
+            print(f"✅ Refreshed {video_filename}")
+            return True
+        except Exception as e:
+            print(f"❌ Refresh failed for {video_filename}: {e}")
+            return False
+    
+    with ThreadPoolExecutor(max_workers=REFRESH_PARALLELISM) as pool:
+        results = list(pool.map(refresh, candidates))
+    _volume_writes.flush()
+    
+    refreshed = sum(results)
+    _bump_counter("background_refreshes", refreshed)
+    report = {
+        "scanned": scanned,
+        "candidates": len(candidates),
+        "refreshed": refreshed,
+        "failed": len(results) - refreshed,
+        "reuploads_avoided_total": _read_counter("reuploads_avoided"),
+    }
+    print(f"📊 Refresh report: {report}")
+    return report
+
+
+# ==========================================
+# Cross-Video Search: Index Maintenance + Query
+# ==========================================
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    timeout=SEARCH_INDEX_TIMEOUT,
+    schedule=modal.Period(minutes=15)
+)
+def _internal_update_search_index(video_filenames: list = None, rebuild: bool = False):
+    """
+    Fold new or changed digests into the on-volume BM25 index.
+    
+    Without arguments, indexes every video queued by digest builds. Only one
+    container updates the index at a time (lease); a run that finds the lease
+    taken exits, since the holder keeps draining the queue until it is empty.
+    A run that finds it no longer owns the lease stops before saving, so it
+    never overwrites documents added by the new holder.
+    The 15-minute schedule sweeps anything queued while the lease was held.
+    
+    Args:
+        video_filenames: Explicit videos to (re)index
+        rebuild: Re-index every digest on the volume from scratch
+    
+    Returns:
+        dict with the number of videos indexed and the index size
+    """
+    token = _take_lease(SEARCH_INDEX_LEASE, seconds=SEARCH_INDEX_TIMEOUT)
+    if token is None:
+        # Queue explicit videos for the holder (or the next sweep)
+        for video_filename in video_filenames or []:
+            video_stats.put(f"index_pending/{video_filename}", time.time())
+        return {"status": "busy"}
+    
+    try:
+        vol.reload()
+        index = VideoSearchIndex() if rebuild else VideoSearchIndex.load(SEARCH_INDEX_PATH)
+        indexed = 0
+        
+        if rebuild and os.path.exists(DIGESTS_DIR):
+            video_filenames = []
+            for entry in sorted(os.listdir(DIGESTS_DIR)):
+                if entry.endswith(".json"):
+                    with open(f"{DIGESTS_DIR}/{entry}", 'r') as f:
+                        video_filenames.append(json.load(f)["video_filename"])
+        
+        while True:
+            batch = list(video_filenames or [])
+            video_filenames = None
+            pending = [key for key in video_stats.keys()
+                       if isinstance(key, str) and key.startswith("index_pending/")]
+            batch.extend(key[len("index_pending/"):] for key in pending)
+            if not batch:
+                break
+            
+            with span("search_index_update", videos=len(batch)):
+                for video_filename in dict.fromkeys(batch):
+                    digest = _read_digest(video_filename)
+                    if digest is None:
+                        index.remove(video_filename)
+                    else:
+                        index.add(video_filename, digest)
+                        indexed += 1
+                if (ingest_leases.get(SEARCH_INDEX_LEASE) or {}).get("owner") != token:
+                    print("⚠️ Search index lease lost, leaving the queue to its holder")
+                    for video_filename in batch:
+                        video_stats.put(f"index_pending/{video_filename}", time.time())
+                    return {"status": "busy"}
+                index.save(SEARCH_INDEX_PATH)
+                vol.commit()
+            for key in pending:
+                video_stats.pop(key, None)
+        
+        print(f"🔎 Search index: {indexed} videos updated, {len(index)} total")
+        return {"status": "updated", "indexed": indexed, "total_videos": len(index)}
+    finally:
+        _release_lease(SEARCH_INDEX_LEASE, token)
+
+
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    timeout=60
+)
+def search_videos(query: str, top_k: int = 10):
+    """
+    Search all indexed videos by content (no Gemini call).
+    
+    Args:
+        query: Free-text search, e.g. "person unboxing a laptop"
+        top_k: Number of videos to return
+    
+    Returns:
+        dict with ranked videos, their best-matching moments in milliseconds
+        and the search time
+    """
+    start = time.perf_counter()
+    index = _get_search_index()
+    with span("search", videos=len(index)):
+        results = index.search(query, top_k=top_k, load_digest=_read_digest)
+    return {
+        "query": query,
+        "results": results,
+        "indexed_videos": len(index),
+        "took_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
+
+
 # ==========================================
 # TTS Function
 # ==========================================
+def _speech_cache_path(text, output_format):
+    """Volume path of the cached speech for text in output_format."""
+    key = hashlib.sha256(f"{TTS_VOICE_ID}|{TTS_MODEL_ID}|{output_format}|{text}".encode()).hexdigest()
+    return f"{TTS_CACHE_DIR}/{key}.{TTS_FORMATS[output_format][0]}"
+
+
 @app.function(
     image=image,
     volumes={"/data": vol},
     secrets=[Secret.from_name("my-elevenlabs-secret")],
     timeout=600,
-    max_containers=5  # Limit concurrent TTS containers
+    max_containers=5,  # Limit concurrent TTS containers
+    enable_memory_snapshot=MEMORY_SNAPSHOT
 )
-def _internal_speak_text(text: str, audio_filename: str = "response.mp3"):
-    from elevenlabs.client import ElevenLabs
-    import time
+def _internal_speak_text(text: str, audio_filename: str = None,
+                         request_id: str = None, sent_at: float = None, return_bytes: bool = False,
+                         progress: bool = False, output_format: str = None):
+    """
+    Synthesize speech for an answer.
     
+    With return_bytes=True the audio comes back in the call result instead
+    of a file, so concurrent sessions cannot see each other's audio.
+    Otherwise the path of the audio on the volume is returned: its tts_cache/
+    entry, or a copy at audio_filename when the caller names one (and then
+    owns that file). Errors are returned as strings. progress=True publishes
+    stage updates under request_id.
+    
+    output_format is one of TTS_FORMATS (default DEFAULT_TTS_FORMAT). In every
+    mode speech is cached under tts_cache/ by text and format, so the same
+    answer in the same format is synthesized once; _internal_prune_tts_cache
+    bounds the cache by age and size. Path mode without audio_filename
+    writes nothing outside tts_cache/, so no per-request files pile up.
+    """
+    _begin_request(request_id, sent_at, "_internal_speak_text", progress)
+    output_format = output_format or DEFAULT_TTS_FORMAT
+    if output_format not in TTS_FORMATS:
+        return f"❌ Error: unsupported output format {output_format} (use one of: {', '.join(TTS_FORMATS)})"
     max_chars = 2500
     
     # Remove mode prefix from TTS
@@ -398,34 +3526,72 @@ def _internal_speak_text(text: str, audio_filename: str = "response.mp3"):
     else:
         safe_text = text
     
-    print(f"🗣️ Generating speech ({len(safe_text)} chars)...")
-    print(f"📁 Output file: {audio_filename}")
+    print(f"🗣️ Generating speech ({len(safe_text)} chars, {output_format})...")
+    print(f"📁 Output: {'call result' if return_bytes else audio_filename or 'tts_cache/'}")
     start_time = time.time()
     
     try:
-        api_key = get_api_key("ELEVENLABS_API_KEY")
-        if not api_key:
-            return "❌ Error: ELEVENLABS_API_KEY not set"
+        cache_path = _speech_cache_path(safe_text, output_format)
+        with span("tts_cache", output_format=output_format) as lookup:
+            lookup["hit"] = os.path.exists(cache_path)
+            if lookup["hit"]:
+                with open(cache_path, "rb") as f:
+                    audio = f.read()
+                # mtime is the last use, so pruning drops the least recently used entries
+                os.utime(cache_path)
+                _volume_writes.mark()
         
-        client = ElevenLabs(api_key=api_key)
-        
-        audio_generator = client.text_to_speech.convert(
-            voice_id="21m00Tcm4TlvDq8ikWAM",
-            output_format="mp3_44100_128",
-            text=safe_text,
-            model_id="eleven_multilingual_v2"
-        )
+        if not lookup["hit"]:
+            pool = _key_pool("elevenlabs")
+            if not pool.keys:
+                return "❌ Error: ELEVENLABS_API_KEY not set"
+            
+            def synthesize(key):
+                # The response streams, so the deadline covers reading all of it
+                return b"".join(_elevenlabs_client(key).text_to_speech.convert(
+                    voice_id=TTS_VOICE_ID,
+                    output_format=output_format,
+                    text=safe_text,
+                    model_id=TTS_MODEL_ID
+                ))
+            
+            def synthesize_and_cache():
+                with span("tts", chars=len(safe_text), output_format=output_format) as attrs:
+                    start = time.monotonic()
+                    audio = _call_upstream("elevenlabs", "tts", synthesize, TTS_DEADLINE_SECONDS, hedge=TTS_HEDGE,
+                                           pool=pool, tokens=len(safe_text))
+                    _throughput_model("tts").record(len(safe_text), time.monotonic() - start)
+                    attrs["bytes"] = len(audio)
+                # Question containers size answers from these timings
+                _in_background(_publish_tts_throughput)
+                os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{cache_path}.{uuid.uuid4().hex[:8]}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(audio)
+                os.replace(tmp_path, cache_path)
+                _volume_writes.mark()
+                return audio
+            
+            audio, _ = _speech_flight.do(cache_path, synthesize_and_cache)
         
-        # Use dynamic filename
-        output_path = f"/data/{audio_filename}"
-        with open(output_path, "wb") as f:
-            for chunk in audio_generator:
-                f.write(chunk)
+        if return_bytes:
+            print(f"✅ Speech ready in {time.time() - start_time:.2f}s ({len(audio) / 1024:.1f}KB)")
+            return audio
         
-        vol.commit()
+        if audio_filename is None:
+            # The cache entry is the file: no per-request copy to clean up
+            output_path = cache_path
+        else:
+            output_path = f"{DATA_DIR}/{audio_filename}"
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, "wb") as f:
+                f.write(audio)
+            _volume_writes.mark()
+        # The caller reads the file right after this returns
+        _volume_writes.flush()
         
         elapsed = time.time() - start_time
-        print(f"✅ Speech generated in {elapsed:.2f}s: {output_path}")
+        print(f"✅ Speech ready in {elapsed:.2f}s: {output_path}")
         return output_path
     
     except Exception as e:
@@ -433,42 +3599,451 @@ def _internal_speak_text(text: str, audio_filename: str = "response.mp3"):
         return str(e)
 
 
+@app.function(
+    image=image,
+    volumes={"/data": vol},
+    timeout=300,
+    schedule=modal.Period(hours=1)
+)
+def _internal_prune_tts_cache(max_age_hours: float = TTS_CACHE_MAX_AGE_HOURS, max_mb: float = TTS_CACHE_MAX_MB):
+    """
+    Delete cached speech unused for max_age_hours, then the least recently
+    used entries (a cache hit refreshes the mtime) until tts_cache/ is under
+    max_mb.
+    
+    Returns:
+        dict with the files removed and kept and the cache size left
+    """
+    vol.reload()
+    entries = []
+    for name in os.listdir(TTS_CACHE_DIR) if os.path.exists(TTS_CACHE_DIR) else []:
+        path = f"{TTS_CACHE_DIR}/{name}"
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    
+    cutoff = time.time() - max_age_hours * 3600
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if mtime >= cutoff and total <= max_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        vol.commit()
+    print(f"🧹 TTS cache: removed {removed} files, {len(entries) - removed} left ({total / (1024 * 1024):.1f}MB)")
+    return {"removed": removed, "kept": len(entries) - removed, "mb": round(total / (1024 * 1024), 1)}
+
+
+# ==========================================
+# MCP Server: Async Tools with Auth, Rate Limits and Progress
+# ==========================================
+class ClientRateLimiter:
+    """Sliding one-hour window of units (questions) per MCP client."""
+    def __init__(self, units_per_hour=MCP_QUESTIONS_PER_HOUR):
+        self.units_per_hour = units_per_hour
+        self._used = {}
+    
+    def acquire(self, client, units=1):
+        """
+        Take `units` from the client's hourly budget if they all fit.
+        
+        Returns:
+            tuple: (allowed, remaining)
+        """
+        cutoff = time.time() - 3600
+        used = [t for t in self._used.get(client, []) if t > cutoff]
+        allowed = len(used) + units <= self.units_per_hour
+        if allowed:
+            used += [time.time()] * units
+        self._used[client] = used
+        return allowed, self.units_per_hour - len(used)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines: concurrent callers with the same key share
+    one backend call (and its progress key) instead of each making their own.
+    """
+    def __init__(self):
+        self._calls = {}
+    
+    def start(self, key, make_call):
+        """
+        Return (task, progress_key, shared) for the key's in-flight call,
+        starting make_call(progress_key) when there is none.
+        """
+        if key in self._calls:
+            task, progress_key = self._calls[key]
+            return task, progress_key, True
+        progress_key = f"mcp-{uuid.uuid4().hex[:12]}"
+        task = asyncio.ensure_future(make_call(progress_key))
+        self._calls[key] = (task, progress_key)
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return task, progress_key, False
+
+
+class _BearerAuth:
+    """
+    ASGI middleware: reject requests without a known bearer token and record
+    the client name in the scope for the tools' rate limits.
+    """
+    def __init__(self, app, tokens):
+        self.app = app
+        self.tokens = tokens
+    
+    def client_for(self, header):
+        scheme, _, token = header.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        for known, client in self.tokens.items():
+            if hmac.compare_digest(known.encode(), token.encode()):
+                return client
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            header = dict(scope.get("headers") or []).get(b"authorization", b"").decode("latin-1")
+            client = self.client_for(header)
+            if client is None:
+                body = json.dumps({"error": "Missing or unknown bearer token"}).encode()
+                await send({"type": "http.response.start", "status": 401,
+                            "headers": [(b"content-type", b"application/json"),
+                                        (b"www-authenticate", b"Bearer")]})
+                await send({"type": "http.response.body", "body": body})
+                return
+            scope["mcp_client"] = client
+        await self.app(scope, receive, send)
+
+
+def _load_mcp_tokens():
+    """Bearer token -> client name from MCP_CLIENT_TOKENS (JSON object)."""
+    try:
+        tokens = json.loads(os.environ.get("MCP_CLIENT_TOKENS") or "{}")
+    except ValueError:
+        print("⚠️ MCP_CLIENT_TOKENS is not valid JSON; rejecting all MCP clients")
+        return {}
+    if not tokens:
+        print("⚠️ MCP_CLIENT_TOKENS is empty; rejecting all MCP clients")
+    return tokens
+
+
+def _build_mcp_app(functions=None, progress_store=None, tokens=None, limiter=None):
+    """
+    The MCP server as an ASGI app (streamable HTTP, stateless).
+    
+    Tools call the same backend functions as the Space, so they share its
+    ingest records, digests, Gemini implicit cache and per-container
+    singleflight; identical concurrent requests from MCP clients are also
+    coalesced here. While a backend call runs, its latest stage is polled
+    from request_progress and sent to the client as a progress notification.
+    
+    Args:
+        functions: name -> function handle with .remote.aio (default: this app's)
+        progress_store: Dict-like with .get.aio / .pop.aio (default: request_progress)
+        tokens: bearer token -> client name (default: MCP_CLIENT_TOKENS)
+        limiter: ClientRateLimiter (default: MCP_QUESTIONS_PER_HOUR per client)
+    """
+    from mcp.server.fastmcp import Context, FastMCP
+    from mcp.server.fastmcp.utilities.types import Audio
+    
+    functions = functions or {
+        "_internal_analyze_video": _internal_analyze_video,
+        "_internal_create_cache": _internal_create_cache,
+        "_internal_speak_text": _internal_speak_text,
+    }
+    progress_store = progress_store if progress_store is not None else request_progress
+    tokens = tokens if tokens is not None else _load_mcp_tokens()
+    limiter = limiter or ClientRateLimiter()
+    flight = AsyncSingleFlight()
+    
+    mcp = FastMCP("VideoAgent", stateless_http=True)
+    
+    def client_of(ctx):
+        request = ctx.request_context.request
+        return (request.scope.get("mcp_client") if request is not None else None) or "anonymous"
+    
+    class Progress:
+        """Monotonic progress notifications for one tool call."""
+        def __init__(self, ctx):
+            self.ctx = ctx
+            self.value = 0
+        
+        async def report(self, message):
+            self.value += 1
+            try:
+                await self.ctx.report_progress(self.value, None, message)
+            except Exception as e:
+                print(f"⚠️ Progress notification failed: {e}")
+    
+    async def call(progress, label, key, function_name, *args, **kwargs):
+        """Run a backend function (shared with identical in-flight calls), reporting its stages."""
+        fn = functions[function_name]
+        task, progress_key, shared = flight.start(key, lambda progress_key: fn.remote.aio(
+            *args, request_id=progress_key, sent_at=time.time(), progress=True, **kwargs
+        ))
+        if shared:
+            print(f"🔗 MCP: joined in-flight {function_name} call")
+        last_stage = None
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=MCP_PROGRESS_POLL_SECONDS)
+                if done:
+                    return task.result()
+                update = await progress_store.get.aio(progress_key)
+                if update and update["stage"] != last_stage:
+                    last_stage = update["stage"]
+                    await progress.report(f"{label}{update['message']}")
+        finally:
+            if not shared and task.done():
+                try:
+                    await progress_store.pop.aio(progress_key, None)
+                except Exception:
+                    pass
+    
+    def limited(ctx, units):
+        """Error message when the client is over its hourly budget, else None."""
+        allowed, remaining = limiter.acquire(client_of(ctx), units)
+        if allowed:
+            return None
+        return (f"⚠️ Rate limit exceeded: {units} question(s) requested, {remaining} remaining this hour "
+                f"({limiter.units_per_hour}/hour).")
+    
+    async def ask(progress, label, video_filename, question, start_seconds=None, end_seconds=None):
+        return await call(progress, label, ("analyze", video_filename, question, start_seconds, end_seconds),
+                          "_internal_analyze_video", question, video_filename=video_filename,
+                          start_seconds=start_seconds, end_seconds=end_seconds)
+    
+    @mcp.tool()
+    async def analyze_video_tool(question: str, ctx: Context, video_filename: str = "demo_video.mp4",
+                                 start_seconds: float | None = None, end_seconds: float | None = None) -> str:
+        """Answer a question about a video on the volume (optionally only a time range, in seconds)."""
+        print(f"📡 MCP Request ({client_of(ctx)}): Analyze Video - {question[:60]}")
+        error = limited(ctx, 1)
+        if error:
+            return error
+        progress = Progress(ctx)
+        await progress.report("Question received")
+        return await ask(progress, "", video_filename, question, start_seconds, end_seconds)
+    
+    @mcp.tool()
+    async def analyze_video_batch_tool(questions: list[str], ctx: Context,
+                                       video_filename: str = "demo_video.mp4") -> dict:
+        """Answer several questions about one video; the video is ingested once and shared."""
+        print(f"📡 MCP Request ({client_of(ctx)}): Batch of {len(questions)} questions")
+        if not questions or len(questions) > MCP_MAX_BATCH:
+            return {"error": f"Send between 1 and {MCP_MAX_BATCH} questions per batch."}
+        error = limited(ctx, len(questions))
+        if error:
+            return {"error": error}
+        progress = Progress(ctx)
+        await progress.report(f"{len(questions)} questions received")
+        slots = asyncio.Semaphore(MCP_BATCH_PARALLELISM)
+        answered = 0
+        
+        async def one(i, question):
+            nonlocal answered
+            async with slots:
+                answer = await ask(progress, f"[{i + 1}/{len(questions)}] ", video_filename, question)
+            answered += 1
+            await progress.report(f"Answered {answered}/{len(questions)}")
+            return {"question": question, "answer": answer}
+        
+        answers = await asyncio.gather(*(one(i, q) for i, q in enumerate(questions)))
+        return {"video": video_filename, "answers": answers}
+    
+    @mcp.tool()
+    async def create_cache_tool(ctx: Context, video_filename: str = "demo_video.mp4") -> str:
+        """Upload a video to Gemini ahead of time so the first question is fast."""
+        print(f"📡 MCP Request ({client_of(ctx)}): Create Cache - {video_filename}")
+        error = limited(ctx, 1)
+        if error:
+            return error
+        result = await call(Progress(ctx), "", ("ingest", video_filename), "_internal_create_cache", video_filename)
+        if "error" in result:
+            return f"❌ {result['error']}"
+        return f"Cache status: {result.get('status', 'unknown')} - {result.get('message', '')}"
+    
+    @mcp.tool()
+    async def speak_text_tool(text_to_speak: str, ctx: Context, output_format: str = DEFAULT_TTS_FORMAT):
+        """
+        Convert text to speech using ElevenLabs.
+        
+        output_format: mp3_44100_128 (default), mp3_44100_64, mp3_22050_32,
+        opus_48000_64 or opus_48000_32; lower bitrates download faster.
+        """
+        print(f"📡 MCP Request ({client_of(ctx)}): Speak Text ({output_format})")
+        if output_format not in TTS_FORMATS:
+            return f"❌ Unsupported output format {output_format} (use one of: {', '.join(TTS_FORMATS)})"
+        error = limited(ctx, 1)
+        if error:
+            return error
+        text_key = hashlib.sha256(text_to_speak.encode()).hexdigest()
+        audio = await call(Progress(ctx), "", ("speak", output_format, text_key),
+                           "_internal_speak_text", text_to_speak, return_bytes=True, output_format=output_format)
+        if not isinstance(audio, bytes):
+            return f"❌ TTS failed: {audio}"
+        return Audio(data=audio, format=TTS_FORMATS[output_format][0])
+    
+    return _BearerAuth(mcp.streamable_http_app(), tokens)
+
+
+@app.function(
+    image=image,
+    secrets=[Secret.from_name("my-mcp-secret")],
+    max_containers=1,  # Rate limits are per container
+    timeout=900
+)
+@modal.concurrent(max_inputs=100)
+@asgi_app()
+def mcp_server():
+    """
+    MCP endpoint (streamable HTTP at /mcp) for Claude Desktop and other MCP clients.
+    
+    Clients send `Authorization: Bearer <token>` with a token from MCP_CLIENT_TOKENS.
+    """
+    return _build_mcp_app()
+
+
 # ==========================================
-# MCP Server Interface (TEMPORARILY DISABLED FOR COST CONTROL)
-# ==========================================
-# To enable: uncomment the code below and redeploy with `modal deploy backend/modal_app.py`
-# 
-# @app.function(image=image)
-# @asgi_app()
-# def mcp_server():
-#     from mcp.server.fastapi import FastMCP
-#     
-#     mcp = FastMCP("VideoAgent")
-# 
-#     @mcp.tool()
-#     async def analyze_video_tool(question: str) -> str:
-#         """Analyze the video using cached context or direct upload."""
-#         print(f"📡 MCP Request: Analyze Video - {question}")
-#         return _internal_analyze_video.remote(question)
-# 
-#     @mcp.tool()
-#     async def create_cache_tool(video_filename: str = "demo_video.mp4") -> str:
-#         """Create a context cache for faster video queries."""
-#         print(f"📡 MCP Request: Create Cache - {video_filename}")
-#         result = _internal_create_cache.remote(video_filename)
-#         return f"Cache status: {result.get('status', 'unknown')} - {result.get('message', '')}"
-# 
-#     @mcp.tool()
-#     async def speak_text_tool(text_to_speak: str) -> str:
-#         """Convert text to speech using ElevenLabs."""
-#         print(f"📡 MCP Request: Speak Text")
-#         return _internal_speak_text.remote(text_to_speak)
-# 
-#     return mcp.app
-
-# Note: MCP Server is temporarily disabled to prevent unauthorized API usage.
-# The HF Space Gradio interface is the primary way to use this application.
-# Contact the developer if you need MCP access for evaluation.
+# Bulk Ingest: Pre-seed a Video Library
+# ==========================================
+def _bulk_sources(source):
+    """
+    Resolve a directory or manifest into local video paths.
+    
+    A manifest is either a text file (one path per line, # comments) or a
+    JSON list of paths / {"path": ...} objects; relative paths are resolved
+    against the manifest's directory.
+    """
+    from pathlib import Path
+    
+    source = Path(source).expanduser()
+    if source.is_dir():
+        return sorted(str(p) for p in source.rglob("*") if p.suffix.lower() in VIDEO_EXTENSIONS)
+    
+    base = source.parent
+    text = source.read_text()
+    if source.suffix.lower() == ".json":
+        entries = [e["path"] if isinstance(e, dict) else e for e in json.loads(text)]
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    return [str(p if p.is_absolute() else base / p) for p in map(Path, entries)]
+
+
+def _bulk_remote_name(local_path):
+    """Stable volume name: library/<stem>_<content hash><ext> (reruns map to the same file)."""
+    from pathlib import Path
+    
+    digest = hashlib.md5()
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            digest.update(chunk)
+    path = Path(local_path)
+    stem = "".join(c if c.isalnum() or c in "-_" else "_" for c in path.stem)[:60]
+    return f"{BULK_PREFIX}/{stem}_{digest.hexdigest()[:8]}{path.suffix.lower()}"
+
+
+@app.local_entrypoint()
+def bulk_ingest(source: str, parallelism: int = 8, batch_size: int = 16, job: str = ""):
+    """
+    Upload a directory or manifest of videos and ingest them into Gemini.
+    
+    Videos go to the volume in batches via vol.batch_upload(), then through
+    _internal_create_cache.map() with at most `parallelism` containers.
+    Progress is recorded per job in the stats Dict, so re-running the same
+    command resumes where it stopped.
+    
+    Usage:
+        modal run backend/modal_app.py::bulk_ingest --source ./videos
+        modal run backend/modal_app.py::bulk_ingest --source manifest.txt --parallelism 16
+    """
+    paths = _bulk_sources(source)
+    if not paths:
+        print(f"⚠️ No videos found in {source}")
+        return
+    
+    print(f"🔢 Hashing {len(paths)} videos...")
+    start = time.time()
+    files = {_bulk_remote_name(path): path for path in paths}
+    job = job or hashlib.md5("\n".join(sorted(files)).encode()).hexdigest()[:12]
+    progress_key = f"bulk/{job}"
+    progress = video_stats.get(progress_key) or {}
+    print(f"📋 Job {job}: {len(files)} videos ({time.time() - start:.1f}s to hash)")
+    
+    # ---- 0. Preflight locally: don't upload what the backend would reject ----
+    probed, rejected = {}, {}
+    for name in [name for name in files if progress.get(name) not in ("uploaded", "ingested")]:
+        media = _probe_media(files[name])
+        error = _media_plan(media)["error"]
+        if error:
+            rejected[files[name]] = error
+            progress[name] = "rejected"
+            print(f"🚫 {files[name]}: {error}")
+            del files[name]
+        elif media is not None:
+            probed[name] = media
+    if probed:
+        media_info.update(probed)  # the backend skips its own probe for these
+    if rejected:
+        video_stats.put(progress_key, progress)  # saved even when nothing is left to upload
+    
+    # ---- 1. Upload to the volume in batches ----
+    to_upload = [name for name in files if progress.get(name) not in ("uploaded", "ingested")]
+    uploaded_bytes = 0
+    start = time.time()
+    for i in range(0, len(to_upload), batch_size):
+        batch_names = to_upload[i:i + batch_size]
+        with vol.batch_upload(force=True) as batch:
+            for name in batch_names:
+                batch.put_file(files[name], f"/{name}")
+        uploaded_bytes += sum(os.path.getsize(files[name]) for name in batch_names)
+        progress.update({name: "uploaded" for name in batch_names})
+        video_stats.put(progress_key, progress)
+        print(f"📤 Uploaded {min(i + batch_size, len(to_upload))}/{len(to_upload)}")
+    upload_s = time.time() - start
+    
+    # ---- 2. Ingest into Gemini with bounded parallelism ----
+    to_ingest = [name for name in files if progress.get(name) != "ingested"]
+    ingest_fn = _internal_create_cache.with_options(max_containers=parallelism)
+    failed = 0
+    start = time.time()
+    for done, (name, result) in enumerate(
+        zip(to_ingest, ingest_fn.map(to_ingest, return_exceptions=True) if to_ingest else []), start=1
+    ):
+        if isinstance(result, dict) and "error" not in result:
+            progress[name] = "ingested"
+        else:
+            failed += 1
+            progress[name] = "failed"
+            print(f"❌ {name}: {result.get('error') if isinstance(result, dict) else result}")
+        if done % batch_size == 0 or done == len(to_ingest):
+            video_stats.put(progress_key, progress)
+            print(f"🧠 Ingested {done}/{len(to_ingest)}")
+    ingest_s = time.time() - start
+    
+    upload_mb = uploaded_bytes / (1024 * 1024)
+    total_s = upload_s + ingest_s
+    print(f"\n📊 Bulk ingest report (job {job})")
+    print(f"   Videos:     {len(files) + len(rejected)} total, {len(rejected)} rejected, {len(to_upload)} uploaded, "
+          f"{len(to_ingest) - failed} ingested, {failed} failed")
+    print(f"   Upload:     {upload_mb:.1f} MB in {upload_s:.1f}s ({upload_mb / upload_s if upload_s else 0:.1f} MB/s)")
+    print(f"   Ingest:     {len(to_ingest) / ingest_s * 60 if ingest_s else 0:.1f} videos/min")
+    print(f"   Overall:    {len(to_ingest) / total_s * 60 if total_s else 0:.1f} videos/min")
+    if rejected:
+        print("   Rejected before upload:")
+        for path, error in rejected.items():
+            print(f"     {path}: {error}")
+    if failed:
+        print(f"   Re-run the same command to retry the {failed} failed videos.")
 
 
 # ==========================================
@@ -491,6 +4066,10 @@ def main():
     # Test TTS
     if "❌" not in text_result:
         print("\n--- TTS ---")
-        audio_path = _internal_speak_text.remote(text_result)
-        os.system("modal volume get video-storage response.mp3 .")
-        print("✨ response.mp3 downloaded!")
+        audio = _internal_speak_text.remote(text_result, return_bytes=True)
+        if isinstance(audio, bytes):
+            with open("response.mp3", "wb") as f:
+                f.write(audio)
+            print("✨ response.mp3 saved!")
+        else:
+            print(f"❌ TTS failed: {audio}")
@@ -0,0 +1,38 @@
+"""
+Benchmarks for the MCP Video Agent.
+
+Run from the repository root, e.g.:
+    pip install -r bench/requirements.txt
+    python -m bench.search_bench --videos 10000
+"""
+
+import importlib.util
+import sys
+
+# Imported by backend/modal_app.py, hf_space/app.py and frontend/app.py.
+# The backend imports its SDKs inside image.imports(), which hides a missing
+# package until first use fails with a NameError, so check them up front.
+APP_MODULES = {
+    "modal": "modal",
+    "google.genai": "google-genai",
+    "elevenlabs": "elevenlabs",
+    "gradio": "gradio",
+}
+
+
+def require(modules):
+    """Exit with the packages to install when any module is missing (module -> requirement)."""
+    missing = []
+    for module, requirement in modules.items():
+        try:
+            found = importlib.util.find_spec(module) is not None
+        except ImportError:  # parent package missing
+            found = False
+        if not found:
+            missing.append(requirement)
+    if missing:
+        sys.exit(f"❌ Missing bench dependencies: {', '.join(missing)}\n"
+                 f"   pip install -r bench/requirements.txt")
+
+
+require(APP_MODULES)
@@ -0,0 +1,147 @@
+"""
+Answer Budget Benchmark - fixed answer length vs the audio-deadline budget.
+
+Runs simulated users through hf_space/app.py and backend/modal_app.py (the
+fakes from bench.e2e_bench) twice:
+
+- fixed: ANSWER_BUDGET=0, every question asks for 150-200 words with no
+  output-token cap
+- budget: ANSWER_BUDGET=1, length, thinking and max_output_tokens are set
+  from ANSWER_AUDIO_TARGET_SECONDS, the measured model and TTS speed and
+  the question type
+
+The fake model writes `--verbosity` times the requested length and thinks
+`--thinking-tokens` on the standard model; output tokens cost
+1 / --tokens-per-second and speech 1 / --tts-chars-per-second seconds. The
+report has the time from asking the backend to finished audio (p50/p95, share
+within the target), answer length by question type and cut-off answers.
+
+Usage:
+    python -m bench.answer_budget_bench --users 4 --questions 10 --target 10 --out bench_answer_budget.json
+"""
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import percentile
+from bench.e2e_bench import QUESTIONS, SpanSink, build_parser, wire
+from bench.fakes import FakeElevenLabs, FakeGenaiClient
+
+MODES = {"fixed": "0", "budget": "1"}
+
+
+def run_mode(args):
+    no_progress = lambda *a, **k: None  # noqa: E731
+    sink = SpanSink()
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings(), contextlib.redirect_stdout(sink):
+        warnings.simplefilter("ignore")
+        space, backend, fakes = wire(args, os.path.join(tmp, "volume"))
+        gemini = FakeGenaiClient(
+            upload_latency=args.upload_latency, processing_seconds=args.processing_seconds,
+            generate_latency=args.generate_latency, video_seconds=args.video_seconds,
+            follow_length=True, verbosity=args.verbosity, tokens_per_second=args.tokens_per_second,
+            thinking_tokens={backend.STANDARD_MODEL: args.thinking_tokens},
+        )
+        tts = FakeElevenLabs(first_chunk_latency=args.tts_first_chunk, chunk_latency=args.tts_chunk_latency,
+                             chars_per_second=args.tts_chars_per_second)
+        backend._gemini_client = lambda key: gemini
+        backend._elevenlabs_client = lambda key: tts
+
+        videos = []
+        for i in range(args.users):
+            path = os.path.join(tmp, f"video_{i}.mp4")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(int(args.video_mb * 1024 * 1024)))
+            videos.append(path)
+        barrier = threading.Barrier(args.users)
+
+        def user(i):
+            history = None
+            barrier.wait()
+            for q in range(args.questions):
+                for history in space.process_interaction(QUESTIONS[(i + q) % len(QUESTIONS)], history, videos[i],
+                                                         f"user{i}", progress=no_progress):
+                    pass
+
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            list(pool.map(user, range(args.users)))
+        backend._volume_writes.flush()
+
+    by_request = defaultdict(dict)
+    for span in sink.spans:
+        if span["component"] == "space" and span["stage"] in ("analyze", "tts"):
+            by_request[span["request_id"]][span["stage"]] = span["duration_ms"] / 1000
+        elif span["component"] == "backend" and span["stage"] == "tts":
+            by_request[span["request_id"]]["chars"] = span["chars"]
+        elif span["component"] == "backend" and span["stage"] == "answer_budget":
+            # Without ANSWER_BUDGET every question has the same fixed length
+            by_request[span["request_id"]].setdefault("type", span.get("type", "fixed"))
+    answered = [r for r in by_request.values() if "analyze" in r and "tts" in r]
+    seconds = [r["analyze"] + r["tts"] for r in answered]
+    words = defaultdict(list)
+    for r in answered:
+        if "chars" in r:
+            # Duration and overview questions answered from the digest skip the model
+            words[r.get("type", "local")].append(round(r["chars"] / 6))
+    return {
+        "answers": len(answered),
+        "to_audio_p50_s": round(percentile(seconds, 50), 2),
+        "to_audio_p95_s": round(percentile(seconds, 95), 2),
+        "within_target": round(sum(s <= args.target for s in seconds) / len(seconds), 2),
+        "answer_words_p50": {kind: round(percentile(values, 50)) for kind, values in sorted(words.items())},
+        "cut_off_answers": sum(1 for s in sink.spans if s["stage"] == "tts" and s["component"] == "backend"
+                               and s.get("chars", 0) >= 2500),
+        "generate_calls": gemini.models.calls,
+    }
+
+
+def main(argv=None):
+    parser = build_parser(__doc__)
+    parser.set_defaults(users=4, questions=10, generate_latency=1.0)
+    parser.add_argument("--target", type=float, default=10, help="ANSWER_AUDIO_TARGET_SECONDS")
+    parser.add_argument("--verbosity", type=float, default=1.4, help="Answer length / requested upper bound")
+    parser.add_argument("--thinking-tokens", type=int, default=800, help="Tokens the standard model thinks")
+    parser.add_argument("--tokens-per-second", type=float, default=120, help="Model output speed")
+    parser.add_argument("--tts-chars-per-second", type=float, default=250, help="Speech synthesis speed")
+    args = parser.parse_args(argv)
+
+    saved = {name: os.environ.get(name) for name in ("ANSWER_BUDGET", "ANSWER_AUDIO_TARGET_SECONDS")}
+    results = {"target_s": args.target}
+    try:
+        for mode, flag in MODES.items():
+            # Read by backend/modal_app.py at import; wire() loads a fresh copy per run
+            os.environ.update(ANSWER_BUDGET=flag, ANSWER_AUDIO_TARGET_SECONDS=str(args.target))
+            print(f"⏱️ {mode}: {args.users} users x {args.questions} questions, target {args.target:g}s to audio...")
+            results[mode] = run_mode(args)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    fixed, budget = results["fixed"], results["budget"]
+    print()
+    print(f"{'metric':<20} {'fixed':>28} {'budget':>28}")
+    for key in fixed:
+        print(f"{key:<20} {fixed[key]!s:>28} {budget[key]!s:>28}")
+    results["passed"] = (budget["within_target"] >= 0.9 and budget["to_audio_p95_s"] < fixed["to_audio_p95_s"]
+                         and budget["answers"] == fixed["answers"])
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    print("✅ Budgeted answers finish their audio within the target" if results["passed"]
+          else "❌ Answer budget expectations not met")
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Audio Isolation Check - concurrent sessions each get their own audio.
+
+Runs N chat sessions in parallel through frontend/app.py and hf_space/app.py
+against fake Modal functions (analysis echoes the question, TTS encodes the
+text it was given) and checks that the audio embedded in every session's
+reply decodes to that session's own answer. Exits non-zero on any mix-up.
+
+Usage:
+    python -m bench.audio_isolation --sessions 32
+"""
+
+import argparse
+import base64
+import hashlib
+import importlib.util
+import io
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fakes import FakeFunction, FakeVolume
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_PATTERN = re.compile(r"data:audio/mpeg;base64,([A-Za-z0-9+/=]+)")
+AUDIO_HEADER = b"ID3-fake-audio:"
+
+
+def load_app(name, relative_path):
+    path = os.path.join(ROOT, relative_path)
+    if os.path.dirname(path) not in sys.path:
+        sys.path.insert(0, os.path.dirname(path))  # sibling modules such as volume_upload.py
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fake_backend(volume, latency):
+    """Fake deployed functions with the backend's call signatures."""
+    def analyze(query, video_filename=None, **kwargs):
+        return f"Answer to: {query}"
+
+    def speak(text, audio_filename=None, request_id=None, sent_at=None, return_bytes=False, output_format=None):
+        # Padded past the apps' "audio looks complete" size check
+        audio = AUDIO_HEADER + text.encode() + b"\0" * 2048
+        if return_bytes:
+            return audio
+        # Like the backend: the speech cache entry (keyed by text) is the file
+        audio_filename = audio_filename or f"tts_cache/{hashlib.sha256(text.encode()).hexdigest()}.mp3"
+        with volume.batch_upload(force=True) as batch:
+            batch.put_file(io.BytesIO(audio), f"/{audio_filename}")
+        return f"/data/{audio_filename}"
+
+    def usage(video_filename=None):
+        return {"videos": []}
+
+    return {
+        "_internal_analyze_video": FakeFunction(analyze, latency),
+        "_internal_speak_text": FakeFunction(speak, latency),
+        "_internal_usage_report": FakeFunction(usage),
+        "__volume__": volume,
+    }
+
+
+def decode_audio_text(history):
+    match = AUDIO_PATTERN.search(history[-1]["content"])
+    if not match:
+        return None
+    audio = base64.b64decode(match.group(1))
+    return audio[len(AUDIO_HEADER):].rstrip(b"\0").decode() if audio.startswith(AUDIO_HEADER) else None
+
+
+def run_sessions(label, app, call, sessions, video):
+    barrier = threading.Barrier(sessions)
+
+    def session(i):
+        question = f"question from user {i}?"
+        barrier.wait()  # start every session at once
+        history = None
+        for history in call(app, question, video, i):
+            pass
+        return decode_audio_text(history) == f"Answer to: {question}"
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(session, range(sessions)))
+    print(f"   {label:<10} {sum(results)}/{sessions} sessions got their own audio")
+    return all(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake function call")
+    args = parser.parse_args(argv)
+
+    print(f"🎧 Running {args.sessions} concurrent sessions per app...")
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "video.mp4")
+        with open(video, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        volume = FakeVolume(os.path.join(tmp, "volume"))
+        no_progress = lambda *a, **k: None  # noqa: E731
+
+        frontend = load_app("frontend_app", "frontend/app.py")
+        frontend._modal_handles.update(fake_backend(volume, args.latency))
+        ok = run_sessions("frontend", frontend,
+                          lambda app, q, v, i: app.process_interaction(q, None, v, progress=no_progress),
+                          args.sessions, video)
+
+        space = load_app("space_app", "hf_space/app.py")
+        space._modal_handles.update(fake_backend(volume, args.latency))
+        ok &= run_sessions("hf_space", space,
+                           lambda app, q, v, i: app.process_interaction(q, None, v, f"user{i}", progress=no_progress),
+                           args.sessions, video)
+
+    print("✅ No audio crossed sessions" if ok else "❌ Some sessions received another user's audio")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
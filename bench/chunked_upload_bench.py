@@ -0,0 +1,169 @@
+"""
+Chunked Upload Benchmark - one-shot vs parallel resumable part uploads.
+
+Uploads a video from hf_space/app.py to a FakeVolume that models a
+high-latency link (per-call round trip, per-stream bandwidth) and can drop
+connections, with backend/modal_app.py's _internal_assemble_upload joining
+the parts in-process:
+
+- clean link: upload_to_modal_volume (one put) vs chunked_upload_to_modal_volume
+- flaky link: a dropped one-shot upload starts over from zero, a dropped
+  part only re-sends that part
+- resume: an upload that gives up part-way is retried and only the parts
+  that never arrived are sent again
+
+Every assembled file is compared byte for byte with the source.
+
+Usage:
+    python -m bench.chunked_upload_bench --video-mb 64 --rpc-latency 0.15 --stream-mbps 4 --out bench_chunked.json
+"""
+
+import argparse
+import contextlib
+import filecmp
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+from bench.e2e_bench import load_module, use_data_root
+from bench.fakes import FakeFunction, FakeVolume
+
+ONE_SHOT_ATTEMPTS = 3
+
+
+def setup(space, backend, root, args, fail_rate=0.0, seed=None):
+    volume = FakeVolume(root, rpc_latency=args.rpc_latency, bytes_per_second=args.stream_mbps * 1024 * 1024,
+                        upload_fail_rate=fail_rate, seed=seed)
+    use_data_root(backend, root)
+    backend.vol = volume
+    space._modal_handles.update({
+        "__volume__": volume,
+        "_internal_assemble_upload": FakeFunction(backend._internal_assemble_upload.local, args.rpc_latency),
+    })
+    return volume
+
+
+def one_shot(space, video, name):
+    """upload_to_modal_volume, retried from zero like a user re-sending the question."""
+    for attempt in range(ONE_SHOT_ATTEMPTS):
+        ok, _ = space.upload_to_modal_volume(video, name)
+        if ok:
+            return True, attempt
+    return False, ONE_SHOT_ATTEMPTS - 1
+
+
+def chunked(space, video, name, upload_id):
+    state = space.UploadState(os.path.getsize(video))
+    ok, error = space.chunked_upload_to_modal_volume(video, name, upload_id, state)
+    return ok, state, error
+
+
+def report(volume, video, target, seconds, **extra):
+    size = os.path.getsize(video)
+    intact = os.path.exists(target) and filecmp.cmp(video, target, shallow=False)
+    return {
+        "seconds": round(seconds, 2),
+        "mb_per_second": round(size / (1024 * 1024) / seconds, 2),
+        "sent_mb": round(volume.uploaded_bytes / (1024 * 1024), 1),
+        "failed_calls": volume.failed_uploads,
+        "intact": intact,
+        **extra,
+    }
+
+
+def run(args, space, backend, tmp):
+    video = os.path.join(tmp, "video.mp4")
+    with open(video, 'wb') as f:
+        f.write(os.urandom(int(args.video_mb * 1024 * 1024)))
+    results = {"video_mb": args.video_mb, "rpc_latency_ms": args.rpc_latency * 1000,
+               "stream_mbps": args.stream_mbps, "part_mb": space.UPLOAD_PART_MB,
+               "parallelism": space.UPLOAD_PARALLELISM}
+
+    for link, fail_rate in (("clean", 0.0), ("flaky", args.fail_rate)):
+        root = os.path.join(tmp, f"{link}_one_shot")
+        volume = setup(space, backend, root, args, fail_rate, seed=1)
+        start = time.perf_counter()
+        ok, retries = one_shot(space, video, "video.mp4")
+        results[f"{link}_one_shot"] = report(volume, video, os.path.join(root, "video.mp4"),
+                                             time.perf_counter() - start, ok=ok, restarts=retries)
+
+        root = os.path.join(tmp, f"{link}_chunked")
+        volume = setup(space, backend, root, args, fail_rate, seed=1)
+        start = time.perf_counter()
+        ok, state, _ = chunked(space, video, "video.mp4", f"{link}chunked")
+        results[f"{link}_chunked"] = report(volume, video, os.path.join(root, "video.mp4"),
+                                            time.perf_counter() - start, ok=ok, part_retries=state.retries)
+
+    # Resume: the first attempt gives up on every part whose single try fails
+    root = os.path.join(tmp, "resume")
+    volume = setup(space, backend, root, args, fail_rate=0.5, seed=2)
+    attempts = space.UPLOAD_PART_ATTEMPTS
+    space.UPLOAD_PART_ATTEMPTS = 1
+    first_ok, _, _ = chunked(space, video, "video.mp4", "resume")
+    space.UPLOAD_PART_ATTEMPTS = attempts
+    stored = sum(os.path.getsize(os.path.join(root, "uploads", "resume", name))
+                 for name in os.listdir(os.path.join(root, "uploads", "resume")))
+    volume.upload_fail_rate, sent_before = 0.0, volume.uploaded_bytes
+    start = time.perf_counter()
+    ok, state, _ = chunked(space, video, "video.mp4", "resume")
+    resend = volume.uploaded_bytes - sent_before
+    results["resume"] = {
+        "first_attempt_ok": first_ok,
+        "parts_kept_mb": round(stored / (1024 * 1024), 1),
+        "resumed_parts": state.resumed_parts,
+        "resent_mb": round(resend / (1024 * 1024), 1),
+        "seconds": round(time.perf_counter() - start, 2),
+        "ok": ok,
+        "intact": filecmp.cmp(video, os.path.join(root, "video.mp4"), shallow=False),
+        "parts_cleaned_up": not os.path.exists(os.path.join(root, "uploads", "resume")),
+    }
+
+    size = os.path.getsize(video)
+    results["clean_speedup"] = round(results["clean_one_shot"]["seconds"] / results["clean_chunked"]["seconds"], 1)
+    results["passed"] = (
+        all(results[name]["intact"] for name in ("clean_one_shot", "clean_chunked", "flaky_chunked"))
+        and results["clean_speedup"] > 1.5
+        and results["flaky_chunked"]["sent_mb"] < results["flaky_one_shot"]["sent_mb"]
+        and not first_ok and ok and results["resume"]["intact"] and resend == size - stored
+    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video-mb", type=float, default=64)
+    parser.add_argument("--rpc-latency", type=float, default=0.15, help="Seconds per volume round trip")
+    parser.add_argument("--stream-mbps", type=float, default=4, help="MB/s per upload stream")
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="Share of uploads dropped on the flaky link")
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        backend = load_module("modal_app", "backend/modal_app.py")
+        space = load_module("space_app", "hf_space/app.py")
+
+    print(f"📦 Uploading {args.video_mb:g}MB over a {args.rpc_latency * 1000:g} ms, "
+          f"{args.stream_mbps:g} MB/s-per-stream link...")
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings(), \
+            contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        results = run(args, space, backend, tmp)
+
+    for key, value in results.items():
+        print(f"   {key:<16} {value}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    print("✅ Chunked uploads are faster and resend only missing parts" if results["passed"]
+          else "❌ Chunked upload expectations not met")
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Commit Benchmark - synchronous vs write-behind volume commits.
+
+Runs the end-to-end benchmark (bench.e2e_bench) twice against a FakeVolume
+whose commit() costs --commit-latency seconds:
+
+- sync: VOLUME_WRITE_BEHIND=0, every ingest record / clip write commits
+  before the request continues
+- deferred: VOLUME_WRITE_BEHIND=1, writes are committed in the background
+  and batched over VOLUME_COMMIT_DELAY_SECONDS
+
+Inline uploads are disabled and every question re-verifies its Gemini file
+(INLINE_MAX_MB=0, FILE_VERIFY_WINDOW_SECONDS=0), so each request writes
+metadata and the commit cost is on every request in sync mode. The report
+has per-request latency percentiles and commit counts for both modes.
+
+Usage:
+    python -m bench.commit_bench --users 8 --questions 3 --commit-latency 0.2 --out bench_commits.json
+"""
+
+import json
+import os
+
+from bench.e2e_bench import build_parser, run
+
+MODES = {"sync": "0", "deferred": "1"}
+
+
+def main(argv=None):
+    parser = build_parser(__doc__)
+    parser.set_defaults(users=8, commit_latency=0.2)
+    args = parser.parse_args(argv)
+
+    env = {"INLINE_MAX_MB": "0", "FILE_VERIFY_WINDOW_SECONDS": "0"}
+    saved = {name: os.environ.get(name) for name in [*env, "VOLUME_WRITE_BEHIND"]}
+    results = {"commit_latency_ms": args.commit_latency * 1000}
+    try:
+        for mode, flag in MODES.items():
+            # Read by backend/modal_app.py at import; e2e_bench loads a fresh copy per run
+            os.environ.update(env, VOLUME_WRITE_BEHIND=flag)
+            print(f"💾 {mode}: {args.users} users x {args.questions} questions, "
+                  f"{args.commit_latency * 1000:g} ms per commit...")
+            report = run(args)
+            commit_stage = next((row for row in report["stages"] if row["stage"] == "volume_commit"), None)
+            results[mode] = {
+                "failed": report["failed"],
+                "interaction_p50_ms": report["interaction_p50_ms"],
+                "interaction_p95_ms": report["interaction_p95_ms"],
+                "first_question_p50_ms": report["first_question_p50_ms"],
+                "follow_up_p50_ms": report["follow_up_p50_ms"],
+                "follow_up_p95_ms": report["follow_up_p95_ms"],
+                "throughput_per_second": report["throughput_per_second"],
+                "volume_commits": report["upstream_calls"]["volume_commits"],
+                "volume_commit_spans": commit_stage["count"] if commit_stage else 0,
+            }
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    sync, deferred = results["sync"], results["deferred"]
+    results["interaction_p50_saved_ms"] = round(sync["interaction_p50_ms"] - deferred["interaction_p50_ms"], 1)
+    results["interaction_p95_saved_ms"] = round(sync["interaction_p95_ms"] - deferred["interaction_p95_ms"], 1)
+    results["commits_saved"] = sync["volume_commits"] - deferred["volume_commits"]
+
+    print()
+    print(f"{'metric':<24} {'sync':>10} {'deferred':>10}")
+    for key in sync:
+        print(f"{key:<24} {sync[key]!s:>10} {deferred[key]!s:>10}")
+    print(f"   p50 saved: {results['interaction_p50_saved_ms']} ms, p95 saved: "
+          f"{results['interaction_p95_saved_ms']} ms, commits saved: {results['commits_saved']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
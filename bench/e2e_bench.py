@@ -0,0 +1,292 @@
+"""
+End-to-End Benchmark - simulated users through the Space and the backend.
+
+Wires hf_space/app.py's process_interaction to backend/modal_app.py's
+functions run in-process (.local()), with every cloud service replaced by a
+fake from bench.fakes:
+
+- Modal Volume and Dicts: FakeVolume / FakeDict, shared by both sides
+- Modal function calls: FakeFunction with a per-call RPC latency
+- Gemini: FakeGenaiClient (upload, processing and generation latency)
+- ElevenLabs: FakeElevenLabs (streamed chunks)
+
+N users each upload a video and ask a few questions at the same time. The
+report has per-stage latency percentiles from the Space and backend spans,
+end-to-end interaction latency (first question vs follow-ups), throughput,
+upstream call counts and peak memory. Save it as JSON and pass it back with
+--compare to fail on regressions before deploying.
+
+Usage:
+    python -m bench.e2e_bench --users 16 --questions 3 --out bench_e2e.json
+    python -m bench.e2e_bench --users 16 --questions 3 --compare bench_e2e.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import percentile
+from bench.fakes import FakeDict, FakeElevenLabs, FakeFunction, FakeGenaiClient, FakeVolume
+from tools.latency_report import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = [
+    "What is happening in this video?",
+    "Why does the presenter pick up the laptop?",
+    "What color is the laptop?",
+    "How long is the video?",
+    "Compare the first and the last scene.",
+]
+
+
+def load_module(name, relative_path):
+    path = os.path.join(ROOT, relative_path)
+    if os.path.dirname(path) not in sys.path:
+        sys.path.insert(0, os.path.dirname(path))  # sibling modules such as volume_upload.py
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SpanSink:
+    """
+    sys.stdout replacement that keeps JSON span lines and drops the rest.
+
+    print() writes the text and the newline separately, so each span arrives
+    as one write even when threads interleave.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if text.startswith('{"event": "span"'):
+            record = json.loads(text)
+            with self._lock:
+                self.spans.append(record)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def use_data_root(backend, root):
+    """Point every /data path of the backend at `root` (the fake volume's directory)."""
+    if not hasattr(backend, "_bench_data_paths"):
+        backend._bench_data_paths = {
+            name: value for name, value in vars(backend).items()
+            if isinstance(value, str) and (value == "/data" or value.startswith("/data/"))
+        }
+    for name, value in backend._bench_data_paths.items():
+        setattr(backend, name, root + value[len("/data"):])
+
+
+def wire(args, root):
+    """Load both apps and point them at shared fakes; returns (space, backend, fakes)."""
+    backend = load_module("modal_app", "backend/modal_app.py")
+    space = load_module("space_app", "hf_space/app.py")
+
+    volume = FakeVolume(root, rpc_latency=args.rpc_latency, bytes_per_second=args.volume_mbps * 1024 * 1024,
+                        commit_latency=args.commit_latency)
+    gemini = FakeGenaiClient(
+        upload_latency=args.upload_latency,
+        upload_bytes_per_second=args.gemini_mbps * 1024 * 1024,
+        processing_seconds=args.processing_seconds,
+        generate_latency=args.generate_latency,
+        video_seconds=args.video_seconds,
+    )
+    tts = FakeElevenLabs(first_chunk_latency=args.tts_first_chunk, chunk_latency=args.tts_chunk_latency)
+
+    use_data_root(backend, root)
+    # The bench videos are random bytes, so ffprobe reports an H.264 video of the configured length
+    media = {"format": "mov,mp4,m4a,3gp,3g2,mj2", "duration_seconds": args.video_seconds, "bitrate": None,
+             "video_codec": "h264", "width": 1280, "height": 720, "fps": 30.0, "audio_codec": "aac"}
+    backend._probe_media = lambda path: dict(media)
+    space.probe_media = lambda path: dict(media)
+    backend.vol = volume
+    backend.ingest_leases = FakeDict(args.rpc_latency)
+    backend.video_stats = FakeDict(args.rpc_latency)
+    backend.conversation_summaries = FakeDict(args.rpc_latency)
+    backend.media_info = FakeDict(args.rpc_latency)
+    backend.request_progress = FakeDict(args.rpc_latency)
+    backend._gemini_client = lambda key: gemini
+    backend._elevenlabs_client = lambda key: tts
+    backend._key_pools["gemini"] = backend.KeyPool(
+        "gemini", [f"bench-gemini-{i}" for i in range(args.keys)],
+        backend.GEMINI_KEY_RPM, backend.GEMINI_KEY_TPM, usage_of=backend._gemini_usage_tokens
+    )
+    backend._key_pools["elevenlabs"] = backend.KeyPool(
+        "elevenlabs", [f"bench-elevenlabs-{i}" for i in range(args.keys)],
+        backend.ELEVENLABS_KEY_RPM, backend.ELEVENLABS_KEY_CHARS_PER_MINUTE
+    )
+    # Functions the backend spawns on itself
+    backend._internal_build_digest = FakeFunction(backend._internal_build_digest.local, args.rpc_latency)
+    backend._internal_update_search_index = FakeFunction(backend._internal_update_search_index.local,
+                                                         args.rpc_latency)
+    backend._internal_transcode_video = FakeFunction(backend._internal_transcode_video.local, args.rpc_latency)
+
+    space._modal_handles.update({
+        "_internal_analyze_video": FakeFunction(backend._internal_analyze_video.local, args.rpc_latency),
+        "_internal_speak_text": FakeFunction(backend._internal_speak_text.local, args.rpc_latency),
+        "_internal_usage_report": FakeFunction(backend._internal_usage_report.local, args.rpc_latency),
+        "_internal_assemble_upload": FakeFunction(backend._internal_assemble_upload.local, args.rpc_latency),
+        "__volume__": volume,
+    })
+    space.rate_limiter = space.RateLimiter(max_requests_per_hour=10 ** 9)
+    return space, backend, {"volume": volume, "gemini": gemini, "tts": tts}
+
+
+def run(args):
+    no_progress = lambda *a, **k: None  # noqa: E731
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sink = SpanSink()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        videos = []
+        for i in range(args.videos or args.users):
+            path = os.path.join(tmp, f"video_{i}.mp4")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(int(args.video_mb * 1024 * 1024)))
+            videos.append(path)
+        space, backend, fakes = wire(args, os.path.join(tmp, "volume"))
+        barrier = threading.Barrier(args.users)
+
+        def user(i):
+            video = videos[i % len(videos)]
+            history, timings = None, []
+            barrier.wait()  # every user starts at once
+            for q in range(args.questions):
+                question = QUESTIONS[(i + q) % len(QUESTIONS)]
+                start = time.perf_counter()
+                for history in space.process_interaction(question, history, video, f"user{i}",
+                                                         progress=no_progress):
+                    pass
+                ok = "data:audio/mpeg;base64," in history[-1]["content"]
+                timings.append(((time.perf_counter() - start) * 1000, q == 0, ok))
+            return timings
+
+        with warnings.catch_warnings(), contextlib.redirect_stdout(sink):
+            # .local() warns that the real volume is not mounted
+            warnings.simplefilter("ignore")
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.users) as pool:
+                timings = [t for user_timings in pool.map(user, range(args.users)) for t in user_timings]
+            wall = time.perf_counter() - start
+            backend._volume_writes.flush()  # count commits still waiting on the write-behind timer
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ok = [ms for ms, _, success in timings if success]
+    first = [ms for ms, is_first, success in timings if success and is_first]
+    follow_up = [ms for ms, is_first, success in timings if success and not is_first]
+
+    def pcts(values, prefix):
+        return {f"{prefix}_p{p}_ms": round(percentile(values, p), 1) if values else None for p in (50, 95, 99)}
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "compare", "tolerance", "min_delta_ms")},
+        "interactions": len(timings),
+        "failed": len(timings) - len(ok),
+        "wall_seconds": round(wall, 2),
+        "throughput_per_second": round(len(ok) / wall, 2),
+        **pcts(ok, "interaction"),
+        **pcts(first, "first_question"),
+        **pcts(follow_up, "follow_up"),
+        "upstream_calls": {
+            "gemini_uploads": fakes["gemini"].files.uploads,
+            "gemini_files_get": fakes["gemini"].files.gets,
+            "gemini_generate": fakes["gemini"].models.calls,
+            "gemini_generate_inline": fakes["gemini"].models.inline_calls,
+            "tts": fakes["tts"].calls,
+            "volume_commits": fakes["volume"].commits,
+            "volume_reloads": fakes["volume"].reloads,
+        },
+        "baseline_rss_mb": round(baseline_rss / 1024, 1),
+        "peak_rss_mb": round(peak_rss / 1024, 1),
+        "stages": summarize(sink.spans),
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Metrics whose p95 grew by more than `tolerance` and `min_delta_ms` since the baseline."""
+    def p95s(report):
+        values = {"interaction": report["interaction_p95_ms"], "follow_up": report["follow_up_p95_ms"]}
+        values.update({f"{row['component']}.{row['stage']}": row["p95_ms"] for row in report["stages"]})
+        return values
+
+    current = p95s(results)
+    regressions = []
+    for name, before in p95s(baseline).items():
+        after = current.get(name)
+        if before and after and after > before * (1 + tolerance) and after - before > min_delta_ms:
+            regressions.append({"metric": name, "baseline_p95_ms": before, "p95_ms": after})
+    return regressions
+
+
+def build_parser(description=__doc__):
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="Concurrent simulated users")
+    parser.add_argument("--questions", type=int, default=3, help="Questions per user")
+    parser.add_argument("--videos", type=int, default=0, help="Distinct videos (default: one per user)")
+    parser.add_argument("--video-mb", type=float, default=2)
+    parser.add_argument("--video-seconds", type=float, default=60, help="Reported length of the test videos")
+    parser.add_argument("--keys", type=int, default=1, help="API keys per provider")
+    parser.add_argument("--rpc-latency", type=float, default=0.02, help="Seconds per Modal round trip")
+    parser.add_argument("--volume-mbps", type=float, default=100, help="Volume transfer rate (MB/s)")
+    parser.add_argument("--commit-latency", type=float, help="Seconds per volume commit (default: --rpc-latency)")
+    parser.add_argument("--upload-latency", type=float, default=0.3, help="Gemini files.upload seconds")
+    parser.add_argument("--gemini-mbps", type=float, default=50, help="Upload rate to Gemini (MB/s)")
+    parser.add_argument("--processing-seconds", type=float, default=0.5, help="Gemini PROCESSING time")
+    parser.add_argument("--generate-latency", type=float, default=0.6, help="Gemini generate_content seconds")
+    parser.add_argument("--tts-first-chunk", type=float, default=0.3, help="ElevenLabs first chunk seconds")
+    parser.add_argument("--tts-chunk-latency", type=float, default=0.05, help="ElevenLabs seconds per chunk")
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    parser.add_argument("--compare", metavar="BASELINE", help="Fail if p95s regressed against this JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 growth for --compare")
+    parser.add_argument("--min-delta-ms", type=float, default=50, help="Ignore p95 changes smaller than this")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    print(f"🧪 {args.users} users x {args.questions} questions through the Space and backend (fakes)...")
+    results = run(args)
+    for key, value in results.items():
+        if key not in ("config", "stages"):
+            print(f"   {key:<24} {value}")
+    print()
+    print(f"{'component':<10} {'stage':<34} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in results["stages"]:
+        print(f"{row['component']:<10} {row['stage']:<34} {row['count']:>6} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+
+    failed = results["failed"] > 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"❌ {regression['metric']}: p95 {regression['baseline_p95_ms']} -> {regression['p95_ms']} ms")
+        if not regressions:
+            print(f"✅ No p95 regressions beyond {args.tolerance:.0%}")
+        failed |= bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,559 @@
+"""
+In-process stand-ins for the cloud services the app talks to.
+
+They mirror only the parts of the SDK surface the app uses, and can add
+per-call latency so benchmarks see realistic round trips without network
+access or credentials.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+_aio_pool = ThreadPoolExecutor(max_workers=256, thread_name_prefix="fake-aio")
+
+
+class _with_aio:
+    """
+    Method decorator adding the SDK's `.aio` variant.
+
+    The call runs on a shared worker pool sized like the SDK's own concurrency
+    (the event loop's default executor has only a few threads on small hosts).
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        bound = self.fn.__get__(obj, objtype)
+
+        async def aio(*args, **kwargs):
+            import asyncio
+
+            return await asyncio.get_running_loop().run_in_executor(_aio_pool, lambda: bound(*args, **kwargs))
+
+        def method(*args, **kwargs):
+            return bound(*args, **kwargs)
+
+        method.aio = aio
+        return method
+
+
+class FakeVolume:
+    """
+    Directory-backed stand-in for modal.Volume.
+
+    `rpc_latency` is slept once per round trip (batch commit, read_file,
+    commit, reload); `bytes_per_second` (optional) adds transfer time.
+    `commit_latency` (optional) replaces rpc_latency for commit(), which is
+    usually the slowest call. bytes_per_second applies per call, like a
+    high-latency link where each stream is limited by its TCP window.
+    `upload_fail_rate` makes that share of batch uploads fail after sending
+    their bytes (nothing is written), like a dropped connection.
+    """
+
+    def __init__(self, root, rpc_latency=0.0, bytes_per_second=None, commit_latency=None,
+                 upload_fail_rate=0.0, seed=None):
+        self.root = root
+        self.rpc_latency = rpc_latency
+        self.bytes_per_second = bytes_per_second
+        self.commit_latency = commit_latency
+        self.upload_fail_rate = upload_fail_rate
+        self.commits = 0
+        self.reloads = 0
+        self.uploads = 0
+        self.failed_uploads = 0
+        self.uploaded_bytes = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, remote_path):
+        return os.path.join(self.root, str(remote_path).lstrip("/"))
+
+    def _transfer(self, num_bytes):
+        delay = self.rpc_latency
+        if self.bytes_per_second:
+            delay += num_bytes / self.bytes_per_second
+        if delay:
+            time.sleep(delay)
+
+    @contextmanager
+    def batch_upload(self, force=False):
+        batch = _FakeUploadBatch()
+        yield batch
+        contents = []
+        for source, remote_path in batch.files:
+            if os.path.exists(self._path(remote_path)) and not force:
+                raise FileExistsError(remote_path)
+            if isinstance(source, (str, os.PathLike)):
+                with open(source, 'rb') as f:
+                    contents.append((remote_path, f.read()))
+            else:
+                source.seek(0)
+                contents.append((remote_path, source.read()))
+        total = sum(len(data) for _, data in contents)
+        self._transfer(total)
+        with self._lock:
+            self.uploads += 1
+            self.uploaded_bytes += total
+            failed = self._random.random() < self.upload_fail_rate
+            self.failed_uploads += failed
+        if failed:
+            raise ConnectionError("Connection reset during upload (injected)")
+        for remote_path, data in contents:
+            path = self._path(remote_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def listdir(self, remote_path, recursive=False):
+        path = self._path(remote_path)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(remote_path)
+        self._transfer(0)
+        return [SimpleNamespace(path=os.path.join(str(remote_path).lstrip("/"), name),
+                                size=os.path.getsize(os.path.join(path, name)))
+                for name in sorted(os.listdir(path))]
+
+    def read_file(self, remote_path):
+        path = self._path(remote_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(remote_path)
+        self._transfer(os.path.getsize(path))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b""):
+                yield chunk
+
+    def commit(self):
+        self.commits += 1
+        if self.commit_latency is not None:
+            time.sleep(self.commit_latency)
+        else:
+            self._transfer(0)
+
+    def reload(self):
+        self.reloads += 1
+        self._transfer(0)
+
+
+class _FakeUploadBatch:
+    def __init__(self):
+        self.files = []
+
+    def put_file(self, local_file, remote_path, mode=None):
+        self.files.append((local_file, remote_path))
+
+
+class FakeFunction:
+    """
+    Stand-in for a deployed modal.Function backed by a local callable.
+
+    .remote() runs inline after `latency` seconds (.remote.aio() on a worker
+    thread); .spawn() runs on a thread and returns a handle whose .get()
+    waits for the result.
+    """
+
+    def __init__(self, fn, latency=0.0):
+        self.fn = fn
+        self.latency = latency
+        self.calls = 0
+
+    @_with_aio
+    def remote(self, *args, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.fn(*args, **kwargs)
+
+    def spawn(self, *args, **kwargs):
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.remote, *args, **kwargs)
+        executor.shutdown(wait=False)
+        return _FakeFunctionCall(future)
+
+
+class _FakeFunctionCall:
+    def __init__(self, future):
+        self._future = future
+
+    def get(self, timeout=None):
+        return self._future.result(timeout=timeout)
+
+
+class FakeDict:
+    """
+    In-memory stand-in for modal.Dict (get/put/pop/keys/items, get/put/pop
+    also as .aio).
+
+    `rpc_latency` is slept once per call, like a round trip to the Dict
+    service.
+    """
+
+    def __init__(self, rpc_latency=0.0):
+        self.rpc_latency = rpc_latency
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _rpc(self):
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+    @_with_aio
+    def get(self, key, default=None):
+        self._rpc()
+        with self._lock:
+            return self._data.get(key, default)
+
+    @_with_aio
+    def put(self, key, value, skip_if_exists=False):
+        self._rpc()
+        with self._lock:
+            if skip_if_exists and key in self._data:
+                return False
+            self._data[key] = value
+            return True
+
+    @_with_aio
+    def pop(self, key, *default):
+        self._rpc()
+        with self._lock:
+            return self._data.pop(key, *default)
+
+    def keys(self):
+        self._rpc()
+        with self._lock:
+            return list(self._data)
+
+    def items(self):
+        self._rpc()
+        with self._lock:
+            return list(self._data.items())
+
+
+class FakeUpstreamError(Exception):
+    """HTTP-style error carrying a status code, like the SDKs' API errors."""
+
+    def __init__(self, code, message="fake upstream error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FlakyUpstream:
+    """
+    Fault-injecting stand-in for one upstream API call.
+
+    Each call sleeps `latency` (jittered +/-50%), or `tail_latency` for a
+    `tail_rate` fraction of calls, then fails with `error_code` for an
+    `error_rate` fraction. Set `down = True` to simulate an outage.
+    """
+
+    def __init__(self, latency=0.05, tail_latency=1.0, tail_rate=0.0, error_rate=0.0, error_code=503, seed=0):
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.down = False
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            tail, jitter, fail = self._rng.random(), self._rng.random(), self._rng.random()
+        if self.down:
+            time.sleep(self.latency)
+            raise FakeUpstreamError(503)
+        time.sleep(self.tail_latency if tail < self.tail_rate else self.latency * (0.5 + jitter))
+        if fail < self.error_rate:
+            raise FakeUpstreamError(self.error_code)
+        return "ok"
+
+
+class QuotaProvider:
+    """
+    Fake provider that enforces per-key request/token limits like a real API.
+
+    `limits` maps key -> (requests, tokens) allowed per `window_seconds`;
+    calls over the limit raise FakeUpstreamError(429). Responses carry
+    usage_metadata.total_token_count like a Gemini response.
+    """
+
+    def __init__(self, limits, window_seconds=1.0, latency=0.01):
+        self.limits = limits
+        self.window_seconds = window_seconds
+        self.latency = latency
+        self.accepted = {key: 0 for key in limits}
+        self.throttled = {key: 0 for key in limits}
+        self._events = {key: [] for key in limits}
+        self._lock = threading.Lock()
+
+    def call(self, key, tokens=0):
+        with self._lock:
+            now = time.monotonic()
+            events = self._events[key]
+            while events and events[0][0] <= now - self.window_seconds:
+                events.pop(0)
+            max_requests, max_tokens = self.limits[key]
+            if len(events) >= max_requests or sum(t for _, t in events) + tokens > max_tokens:
+                self.throttled[key] += 1
+                raise FakeUpstreamError(429)
+            events.append((now, tokens))
+            self.accepted[key] += 1
+        time.sleep(self.latency)
+        return _FakeResponse(tokens)
+
+
+class _FakeResponse:
+    def __init__(self, tokens):
+        self.usage_metadata = type("UsageMetadata", (), {"total_token_count": tokens})()
+
+
+class FakeGenaiClient:
+    """
+    Stand-in for google.genai.Client: files.upload/get/delete and
+    models.generate_content.
+
+    - upload sleeps `upload_latency` plus size / `upload_bytes_per_second`
+    - an uploaded file stays PROCESSING for `processing_seconds`
+    - generate_content sleeps `generate_latency` (jittered +/-25%), plus the
+      transfer time of inline video bytes, and answers with `answer_words`
+      words; JSON requests get a digest-shaped timeline
+    - with `follow_length` the answer has `verbosity` times the upper bound
+      of the prompt's "within X-Y words" and is numbered, so answers differ;
+      `thinking_tokens` (model -> tokens) are spent before answering, capped
+      by the thinking budget; max_output_tokens cuts the answer
+      (finish_reason MAX_TOKENS); every output token adds
+      1 / `tokens_per_second` seconds
+    - usage reports `prompt_tokens` per video, with 90% cached after a
+      video's first use (like Gemini's implicit cache)
+    - a deleted or unknown file fails with 403 PERMISSION_DENIED, and a model
+      outside `known_models` (when set) with 404 NOT_FOUND, worded like the API
+
+    One instance can serve every key; `files` and `models` are thread safe.
+    """
+
+    def __init__(self, upload_latency=0.2, upload_bytes_per_second=None, processing_seconds=1.0,
+                 generate_latency=0.5, answer_words=120, prompt_tokens=30000, video_seconds=120, seed=0,
+                 follow_length=False, verbosity=1.0, thinking_tokens=None, tokens_per_second=None,
+                 known_models=None):
+        self.files = _FakeFiles(upload_latency, upload_bytes_per_second, processing_seconds, video_seconds)
+        self.models = _FakeModels(generate_latency, upload_bytes_per_second, answer_words, prompt_tokens,
+                                  video_seconds, seed)
+        self.models.files = self.files
+        self.models.known_models = known_models
+        self.models.follow_length = follow_length
+        self.models.verbosity = verbosity
+        self.models.thinking_tokens = thinking_tokens or {}
+        self.models.tokens_per_second = tokens_per_second
+
+
+class _FakeFiles:
+    def __init__(self, upload_latency, upload_bytes_per_second, processing_seconds, video_seconds):
+        self.upload_latency = upload_latency
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.processing_seconds = processing_seconds
+        self.video_seconds = video_seconds
+        self.uploads = 0
+        self.gets = 0
+        self._ready_at = {}
+        self._lock = threading.Lock()
+
+    def _file(self, name):
+        state = "ACTIVE" if time.monotonic() >= self._ready_at[name] else "PROCESSING"
+        return SimpleNamespace(
+            name=name,
+            uri=f"https://fake.googleapis.com/v1beta/{name}",
+            mime_type="video/mp4",
+            state=SimpleNamespace(name=state),
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48),
+            video_metadata={"videoDuration": f"{self.video_seconds}s"},
+        )
+
+    def upload(self, file, config=None):
+        size = os.path.getsize(file) if isinstance(file, (str, os.PathLike)) else 0
+        time.sleep(self.upload_latency + (size / self.upload_bytes_per_second if self.upload_bytes_per_second else 0))
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self.uploads += 1
+            self._ready_at[name] = time.monotonic() + self.processing_seconds
+        return self._file(name)
+
+    def get(self, name):
+        with self._lock:
+            self.gets += 1
+            if name not in self._ready_at:
+                raise FakeUpstreamError(404)
+        return self._file(name)
+
+    def delete(self, name):
+        with self._lock:
+            self._ready_at.pop(name, None)
+
+
+class _FakeModels:
+    def __init__(self, generate_latency, upload_bytes_per_second, answer_words, prompt_tokens, video_seconds, seed):
+        self.generate_latency = generate_latency
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.answer_words = answer_words
+        self.prompt_tokens = prompt_tokens
+        self.video_seconds = video_seconds
+        self.follow_length = False
+        self.verbosity = 1.0
+        self.thinking_tokens = {}
+        self.tokens_per_second = None
+        self.files = None
+        self.known_models = None
+        self.calls = 0
+        self.inline_calls = 0
+        self._seen_videos = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _video(contents):
+        """(identity, inline byte count) of the video in a request, or (None, 0)."""
+        for content in contents if isinstance(contents, list) else [contents]:
+            for part in getattr(content, "parts", None) or [content]:
+                file_data = getattr(part, "file_data", None)
+                if file_data is not None:
+                    return file_data.file_uri, 0
+                inline_data = getattr(part, "inline_data", None)
+                if inline_data is not None:
+                    return hash(inline_data.data), len(inline_data.data)
+        return None, 0
+
+    @staticmethod
+    def _prompt_text(contents):
+        texts = []
+        for content in contents if isinstance(contents, list) else [contents]:
+            if isinstance(content, str):
+                texts.append(content)
+            for part in getattr(content, "parts", None) or []:
+                texts.append(getattr(part, "text", None) or "")
+        return "\n".join(texts)
+
+    def _answer(self, model, contents, config, number):
+        """(text, answer tokens, thinking tokens, finish reason) for a prose answer."""
+        words = self.answer_words
+        if self.follow_length:
+            match = re.search(r"within (\d+)-(\d+) words", self._prompt_text(contents))
+            if match:
+                words = int(int(match.group(2)) * self.verbosity)
+        thinking = self.thinking_tokens.get(model, 0)
+        budget = getattr(getattr(config, "thinking_config", None), "thinking_budget", None)
+        thoughts = thinking if budget is None else min(thinking, budget)
+        finish = "STOP"
+        max_tokens = getattr(config, "max_output_tokens", None)
+        if max_tokens is not None and int(words * 1.3) > max_tokens - thoughts:
+            words, finish = max(0, int((max_tokens - thoughts) / 1.3)), "MAX_TOKENS"
+        # Sentences of 12 words; a cut-off answer stops mid-sentence
+        text = " ".join("word." if (i + 1) % 12 == 0 else "word" for i in range(words))
+        if finish == "STOP" and words and not text.endswith("."):
+            text += "."
+        if self.follow_length and text:
+            text = f"Answer {number}: {text}"
+        return text, int(words * 1.3), thoughts, finish
+
+    def _check_request(self, model, video, inline_bytes):
+        if self.known_models is not None and model not in self.known_models:
+            raise FakeUpstreamError(404, f"NOT_FOUND. models/{model} is not found for API version v1beta")
+        if video is not None and not inline_bytes and self.files is not None:
+            name = "files/" + video.rsplit("/files/", 1)[-1]
+            with self.files._lock:
+                missing = name not in self.files._ready_at
+            if missing:
+                raise FakeUpstreamError(403, f"PERMISSION_DENIED. You do not have permission to access the File "
+                                             f"{name.split('/')[-1]} or it may not exist.")
+
+    def generate_content(self, model, contents, config=None):
+        video, inline_bytes = self._video(contents)
+        self._check_request(model, video, inline_bytes)
+        with self._lock:
+            self.calls += 1
+            self.inline_calls += bool(inline_bytes)
+            jitter = self._rng.random()
+            number = self.calls
+            cached = video in self._seen_videos
+            self._seen_videos.add(video)
+        transfer = inline_bytes / self.upload_bytes_per_second if self.upload_bytes_per_second else 0
+
+        thoughts, finish = 0, "STOP"
+        if getattr(config, "response_mime_type", None) == "application/json":
+            step = self.video_seconds / 5
+            text = json.dumps({
+                "duration_seconds": self.video_seconds,
+                "summary": "A presenter demonstrates a product on a desk.",
+                "scenes": [{"start": i * step, "end": (i + 1) * step,
+                            "description": f"Scene {i + 1} of the demonstration",
+                            "objects": ["presenter", "laptop"], "speech": ""} for i in range(5)],
+            })
+            candidate_tokens = int(len(text.split()) * 1.3)
+        else:
+            text, candidate_tokens, thoughts, finish = self._answer(model, contents, config, number)
+        output_seconds = (candidate_tokens + thoughts) / self.tokens_per_second if self.tokens_per_second else 0
+        time.sleep(self.generate_latency * (0.75 + 0.5 * jitter) + transfer + output_seconds)
+
+        prompt_tokens = self.prompt_tokens if video is not None else 500
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            cached_content_token_count=int(prompt_tokens * 0.9) if cached and video is not None else 0,
+            candidates_token_count=candidate_tokens,
+            thoughts_token_count=thoughts,
+            total_token_count=prompt_tokens + candidate_tokens + thoughts,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage,
+                               candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name=finish))])
+
+
+class FakeElevenLabs:
+    """
+    Stand-in for elevenlabs.client.ElevenLabs: text_to_speech.convert streams
+    MP3-sized chunks.
+
+    The audio is `bytes_per_char` bytes per input character at 128 kbps
+    (scaled by the bitrate in output_format, e.g. mp3_22050_32 is a quarter),
+    split into `chunks` pieces, with `first_chunk_latency` before the first
+    and `chunk_latency` before each of the rest (plus len(text) /
+    `chars_per_second` seconds spread over the chunks, when set).
+    """
+
+    def __init__(self, first_chunk_latency=0.3, chunk_latency=0.05, chunks=8, bytes_per_char=1000,
+                 chars_per_second=None):
+        self.text_to_speech = SimpleNamespace(convert=self._convert)
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_latency = chunk_latency
+        self.chunks = chunks
+        self.bytes_per_char = bytes_per_char
+        self.chars_per_second = chars_per_second
+        self.calls = 0
+        self.formats = {}
+
+    def _convert(self, text, voice_id=None, model_id=None, output_format=None, **kwargs):
+        self.calls += 1
+        self.formats[output_format] = self.formats.get(output_format, 0) + 1
+        kbps = int(output_format.rsplit("_", 1)[1]) if output_format else 128
+        total = len(text) * self.bytes_per_char * kbps // 128
+        header = b"OggS" if output_format and output_format.startswith("opus") else b"\xff\xfb"
+        size = max(len(header), total // self.chunks)
+        synthesis = len(text) / self.chars_per_second / self.chunks if self.chars_per_second else 0
+        for i in range(self.chunks):
+            time.sleep((self.first_chunk_latency if i == 0 else self.chunk_latency) + synthesis)
+            yield header + b"\0" * (size - len(header))
@@ -0,0 +1,86 @@
+"""
+File Expiry Check - when a failed question re-ingests its video.
+
+Asks backend/modal_app.py (on the fakes from bench.e2e_bench, Files API path)
+about a video whose Gemini file is trusted without files.get, then:
+
+- expired: the file is deleted on the fake, so generate fails with 403
+  PERMISSION_DENIED on the file; the question re-uploads once and answers
+- model 404: every model name is unknown to the fake (a typo or a retired
+  model), so generate fails with 404 NOT_FOUND on the model; the questions
+  fail without uploading the video again
+
+Exits non-zero when either expectation fails.
+
+Usage:
+    python -m bench.file_expiry_check --questions 3 --out bench_file_expiry.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import warnings
+
+from bench.e2e_bench import build_parser, wire
+
+QUIET = ["--rpc-latency", "0", "--upload-latency", "0", "--processing-seconds", "0", "--generate-latency", "0",
+         "--tts-first-chunk", "0", "--tts-chunk-latency", "0"]
+
+
+def run_scenario(name, questions):
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings(), \
+            contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        root = os.path.join(tmp, "volume")
+        backend = wire(build_parser().parse_args(QUIET), root)[1]
+        backend.INLINE_MAX_BYTES = 0  # always through the Files API
+        backend._request_digest = lambda video_filename: None  # keep every question on the video
+        gemini = backend._gemini_client(None)
+        with open(os.path.join(root, "expiry.mp4"), "wb") as f:
+            f.write(os.urandom(1024))
+
+        first = backend._internal_analyze_video.local("What is happening?", "expiry.mp4")
+        uploads = gemini.files.uploads
+        if name == "expired":
+            for file_name in list(gemini.files._ready_at):
+                gemini.files.delete(file_name)
+        else:
+            gemini.models.known_models = set()
+        answers = [backend._internal_analyze_video.local(f"Question {i}?", "expiry.mp4") for i in range(questions)]
+        backend._volume_writes.flush()
+    return {
+        "first_ok": not first.startswith(("❌", "⚠️")),
+        "answered": sum(not a.startswith(("❌", "⚠️")) for a in answers),
+        "questions": questions,
+        "reuploads": gemini.files.uploads - uploads,
+        "last_answer": answers[-1][:120],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=3, help="Questions after the file breaks")
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = {name: run_scenario(name, args.questions) for name in ("expired", "model_404")}
+    expired, model_404 = results["expired"], results["model_404"]
+    results["passed"] = (
+        expired["first_ok"] and expired["reuploads"] == 1 and expired["answered"] == args.questions
+        and model_404["first_ok"] and model_404["reuploads"] == 0 and model_404["answered"] == 0
+    )
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    print("✅ Only missing files are re-ingested" if results["passed"] else "❌ Re-ingest expectations not met")
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
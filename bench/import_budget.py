@@ -0,0 +1,102 @@
+"""
+Import Budget - container init time of the backend module.
+
+Imports backend/modal_app.py in fresh interpreters and builds one Gemini
+client (and one ElevenLabs client when the SDK is installed), i.e. what a
+container does before serving its first request. One extra run with
+`-X importtime` lists the slowest top-level imports.
+
+Memory snapshots pay this once per deploy instead of once per cold start,
+but it still bounds snapshot-less starts and the local entrypoints, so the
+check fails when the median exceeds --budget-ms.
+
+Usage:
+    python -m bench.import_budget --runs 5 --budget-ms 2500 --out bench_imports.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from bench.common import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHILD = """
+import json, time
+start = time.perf_counter()
+import modal_app
+imported = time.perf_counter()
+clients = {}
+for name, build in (("gemini", lambda: modal_app.genai.Client(api_key="import-budget")),
+                    ("elevenlabs", lambda: modal_app.ElevenLabs(api_key="import-budget"))):
+    try:
+        t = time.perf_counter()
+        build()
+        clients[name] = round((time.perf_counter() - t) * 1000, 1)
+    except AttributeError:
+        pass  # SDK not installed locally
+print(json.dumps({"import_ms": round((imported - start) * 1000, 1), "clients_ms": clients}))
+"""
+
+
+def run_child(extra_args=()):
+    result = subprocess.run([sys.executable, *extra_args, "-c", CHILD], cwd=os.path.join(ROOT, "backend"),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(importtime_log, top):
+    """Slowest modules imported by modal_app itself, from `-X importtime` output."""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # two spaces per nesting level
+        if depth == 1 or (depth == 0 and name.strip() != "modal_app"):
+            rows.append((int(cumulative), name.strip()))
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:top]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=2500, help="Max median import + client setup time")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    print(f"⏱️ Importing backend/modal_app.py in {args.runs} fresh interpreters...")
+    runs = [run_child()[0] for _ in range(args.runs)]
+    totals = [run["import_ms"] + sum(run["clients_ms"].values()) for run in runs]
+    _, importtime_log = run_child(["-X", "importtime"])
+
+    results = {
+        "runs": args.runs,
+        "import_p50_ms": round(percentile([run["import_ms"] for run in runs], 50), 1),
+        "clients_ms": runs[-1]["clients_ms"],
+        "init_p50_ms": round(percentile(totals, 50), 1),
+        "init_max_ms": round(max(totals), 1),
+        "budget_ms": args.budget_ms,
+        "slowest_imports": slowest_imports(importtime_log, args.top),
+    }
+    results["passed"] = results["init_p50_ms"] <= args.budget_ms
+
+    for key, value in results.items():
+        if key != "slowest_imports":
+            print(f"   {key:<16} {value}")
+    print("   slowest imports:")
+    for row in results["slowest_imports"]:
+        print(f"     {row['cumulative_ms']:>8.1f} ms  {row['module']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    print("✅ Within budget" if results["passed"] else f"❌ Init exceeds the {args.budget_ms:g} ms budget")
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
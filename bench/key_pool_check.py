@@ -0,0 +1,171 @@
+"""
+Key Pool Check - quota-aware scheduling against a fake provider with per-key limits.
+
+Sends the same burst of calls through backend/modal_app.py's _call_upstream
+with a KeyPool of one key and of several keys, against QuotaProvider, and
+checks that:
+
+- throughput scales with the number of keys and stays near the limits
+- a key whose real limit is lower than configured gets 429s and cools down
+  alone, while the other keys carry the load and every call succeeds
+- with the default circuit breaker, a hot key that keeps answering 429
+  (questions pinned to the key that uploaded their video) never opens the
+  circuit, so calls on the healthy keys keep succeeding
+
+Exits non-zero when any expectation fails.
+
+Usage:
+    python -m bench.key_pool_check --calls 300 --out bench_keys.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import modal_app  # noqa: E402
+
+from bench.fakes import QuotaProvider  # noqa: E402
+
+WINDOW_SECONDS = 1.0
+REQUESTS_PER_WINDOW = 20
+TOKENS_PER_CALL = 1000
+
+
+def burst(provider_name, pool, provider, calls, concurrency=16):
+    """Send `calls` calls through the pool; returns (successes, seconds)."""
+    modal_app._breakers[provider_name] = modal_app.CircuitBreaker(provider_name, failure_threshold=10 ** 6)
+
+    def one(_):
+        try:
+            modal_app._call_upstream(
+                provider_name, "generate", lambda key: provider.call(key, TOKENS_PER_CALL), 60,
+                max_attempts=6, pool=pool, tokens=TOKENS_PER_CALL
+            )
+            return True
+        except Exception:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        ok = sum(executor.map(one, range(calls)))
+    return ok, time.perf_counter() - start
+
+
+def make_pool(name, keys):
+    return modal_app.KeyPool(
+        name, keys, REQUESTS_PER_WINDOW, REQUESTS_PER_WINDOW * TOKENS_PER_CALL * 2,
+        window_seconds=WINDOW_SECONDS, usage_of=modal_app._gemini_usage_tokens
+    )
+
+
+def check_scaling(calls):
+    results = {}
+    for count in (1, 3):
+        keys = [f"key-{i}" for i in range(count)]
+        provider = QuotaProvider({key: (REQUESTS_PER_WINDOW, 10 ** 9) for key in keys}, WINDOW_SECONDS)
+        ok, seconds = burst(f"fake-keys-{count}", make_pool(f"fake-keys-{count}", keys), provider, calls)
+        results[f"{count}_key"] = {
+            "success_rate": round(ok / calls, 3),
+            "calls_per_s": round(ok / seconds, 1),
+            "provider_429s": sum(provider.throttled.values()),
+        }
+    ideal = REQUESTS_PER_WINDOW / WINDOW_SECONDS
+    results["passed"] = (
+        results["1_key"]["success_rate"] == 1 and results["3_key"]["success_rate"] == 1
+        and results["3_key"]["calls_per_s"] > 2.5 * results["1_key"]["calls_per_s"]
+        and results["1_key"]["calls_per_s"] > 0.8 * ideal
+    )
+    return results
+
+
+def check_throttled_key(calls):
+    keys = ["key-a", "key-b", "key-c"]
+    # key-b really allows a quarter of what the pool believes
+    limits = {"key-a": (REQUESTS_PER_WINDOW, 10 ** 9), "key-b": (REQUESTS_PER_WINDOW // 4, 10 ** 9),
+              "key-c": (REQUESTS_PER_WINDOW, 10 ** 9)}
+    provider = QuotaProvider(limits, WINDOW_SECONDS)
+    pool = make_pool("fake-keys-skewed", keys)
+    ok, seconds = burst("fake-keys-skewed", pool, provider, calls)
+    rows = {row["key"]: row for row in pool.snapshot()}
+    throttled = {key: rows[modal_app.KeyPool.key_id(key)]["throttled"] for key in keys}
+    return {
+        "success_rate": round(ok / calls, 3),
+        "calls_per_s": round(ok / seconds, 1),
+        "accepted": provider.accepted,
+        "throttled": throttled,
+        "passed": ok == calls and throttled["key-b"] > 0 and throttled["key-a"] == throttled["key-c"] == 0,
+    }
+
+
+def check_breaker_ignores_throttling(calls):
+    keys = ["key-hot", "key-a", "key-b", "key-c"]
+    # key-hot really allows a tenth of what the pool believes
+    limits = {key: (REQUESTS_PER_WINDOW, 10 ** 9) for key in keys}
+    limits["key-hot"] = (REQUESTS_PER_WINDOW // 10, 10 ** 9)
+    provider = QuotaProvider(limits, WINDOW_SECONDS)
+    name = "fake-keys-hot"
+    pool = make_pool(name, keys)
+    modal_app._breakers[name] = breaker = modal_app.CircuitBreaker(name)  # default threshold
+    hot_id = modal_app.KeyPool.key_id("key-hot")
+
+    def one(i):
+        pinned = i % 4 == 0
+        try:
+            modal_app._call_upstream(
+                name, "generate", lambda key: provider.call(key, TOKENS_PER_CALL), 60,
+                pool=pool, key_id=hot_id if pinned else None, tokens=TOKENS_PER_CALL
+            )
+            return pinned, None
+        except Exception as e:
+            return pinned, type(e).__name__
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        outcomes = list(executor.map(one, range(calls)))
+    errors = {}
+    for _, error in outcomes:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    unpinned = [error for pinned, error in outcomes if not pinned]
+    return {
+        "unpinned_success_rate": round(unpinned.count(None) / len(unpinned), 3),
+        "pinned_success_rate": round(sum(1 for p, e in outcomes if p and e is None) / (calls - len(unpinned)), 3),
+        "errors": errors,
+        "hot_key_429s": provider.throttled["key-hot"],
+        "circuit_opened": breaker._opened_at is not None or "CircuitOpenError" in errors,
+        "passed": (provider.throttled["key-hot"] >= modal_app.BREAKER_FAILURE_THRESHOLD
+                   and unpinned.count(None) == len(unpinned) and "CircuitOpenError" not in errors
+                   and breaker._opened_at is None),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    print(f"🔑 Checking key scheduling with {args.calls} calls per scenario...")
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {
+            "scaling": check_scaling(args.calls),
+            "throttled_key": check_throttled_key(args.calls),
+            "breaker_ignores_throttling": check_breaker_ignores_throttling(args.calls),
+        }
+    for name, result in results.items():
+        print(f"   {'✅' if result['passed'] else '❌'} {name}: {json.dumps(result)}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    sys.exit(0 if all(r["passed"] for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
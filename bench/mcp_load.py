@@ -0,0 +1,201 @@
+"""
+MCP Load Test - concurrent MCP clients against the server with fake backends.
+
+Serves backend/modal_app.py's MCP app (_build_mcp_app) with uvicorn on
+localhost. The backend functions behind the tools run in-process (.local())
+on the same fakes as bench.e2e_bench (Volume, Dicts, Gemini, ElevenLabs).
+Each simulated client connects with its own bearer token through the MCP
+streamable HTTP client and runs:
+
+- analyze_video_tool on a video shared by every client (coalesced)
+- analyze_video_batch_tool with --batch questions on its own video
+- speak_text_tool on the first answer
+
+The report has per-tool latency percentiles, progress notifications
+received, upstream call counts, and checks for an unknown token (401) and
+for a client over its hourly budget.
+
+Usage:
+    python -m bench.mcp_load --clients 16 --batch 3 --out bench_mcp.json
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+from bench import require
+from bench.common import percentile
+from bench.e2e_bench import QUESTIONS, SpanSink, build_parser, wire
+from bench.fakes import FakeFunction
+
+# FastMCP's package layout (and the Audio type) exists only in mcp 1.x
+require({"mcp.server.fastmcp.utilities.types": "mcp>=1.29,<2", "uvicorn": "uvicorn", "httpx": "httpx"})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_config=None,
+                                            log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+@contextlib.asynccontextmanager
+async def session(url, token):
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    async with streamablehttp_client(url, headers={"Authorization": f"Bearer {token}"}) as (read, write, _):
+        async with ClientSession(read, write) as client:
+            await client.initialize()
+            yield client
+
+
+async def timed_call(client, tool, arguments, timings):
+    notes = []
+
+    async def on_progress(progress, total, message):
+        notes.append(message)
+
+    start = time.perf_counter()
+    result = await client.call_tool(tool, arguments, progress_callback=on_progress)
+    timings.setdefault(tool, []).append((time.perf_counter() - start) * 1000)
+    return result, notes
+
+
+def text_of(result):
+    return "".join(getattr(item, "text", "") for item in result.content)
+
+
+async def run_client(url, i, args, timings, outcomes):
+    async with session(url, f"token-{i}") as client:
+        result, notes = await timed_call(client, "analyze_video_tool",
+                                         {"question": QUESTIONS[0], "video_filename": "shared.mp4"}, timings)
+        answer = text_of(result)
+        outcomes["progress_notes"] += len(notes)
+        outcomes["ok"] += not result.isError and not answer.startswith(("❌", "⚠️"))
+
+        questions = [QUESTIONS[(i + q) % len(QUESTIONS)] for q in range(args.batch)]
+        result, notes = await timed_call(client, "analyze_video_batch_tool",
+                                         {"questions": questions, "video_filename": f"video_{i}.mp4"}, timings)
+        batch = json.loads(text_of(result))
+        outcomes["progress_notes"] += len(notes)
+        outcomes["ok"] += len([a for a in batch.get("answers", []) if not a["answer"].startswith(("❌", "⚠️"))])
+
+        result, notes = await timed_call(client, "speak_text_tool", {"text_to_speak": answer}, timings)
+        outcomes["progress_notes"] += len(notes)
+        outcomes["ok"] += any(getattr(item, "type", None) == "audio" for item in result.content)
+
+
+async def check_auth_and_limits(url):
+    import httpx
+
+    async with httpx.AsyncClient() as http:
+        response = await http.post(url, headers={"Authorization": "Bearer wrong"}, json={})
+    async with session(url, "token-limited") as client:
+        result = await client.call_tool("analyze_video_batch_tool",
+                                        {"questions": QUESTIONS[:3], "video_filename": "shared.mp4"})
+    limited = json.loads(text_of(result))
+    return {"unknown_token_status": response.status_code, "over_budget": limited.get("error", "")[:80]}
+
+
+def run(args):
+    sink = SpanSink()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "volume")
+        space, backend, fakes = wire(args, root)
+        os.makedirs(root, exist_ok=True)
+        sample = os.path.join(tmp, "sample.mp4")
+        with open(sample, 'wb') as f:
+            f.write(os.urandom(int(args.video_mb * 1024 * 1024)))
+        for name in ["shared.mp4"] + [f"video_{i}.mp4" for i in range(args.clients)]:
+            shutil.copyfile(sample, os.path.join(root, name))
+
+        functions = {name: FakeFunction(getattr(backend, name).local, args.rpc_latency)
+                     for name in ("_internal_analyze_video", "_internal_create_cache", "_internal_speak_text")}
+        tokens = {f"token-{i}": f"client-{i}" for i in range(args.clients)}
+        tokens["token-limited"] = "limited"
+        limiter = backend.ClientRateLimiter(units_per_hour=10 ** 6)
+        limiter._used["limited"] = [time.time()] * (10 ** 6 - 1)  # one question left this hour
+        app = backend._build_mcp_app(functions, backend.request_progress, tokens, limiter)
+        logging.getLogger().setLevel(logging.WARNING)  # FastMCP logs every request at INFO
+
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/mcp"
+        timings = {}
+        outcomes = {"ok": 0, "progress_notes": 0}
+        with warnings.catch_warnings(), contextlib.redirect_stdout(sink):
+            warnings.simplefilter("ignore")
+            server = serve(app, port)
+
+            async def main():
+                start = time.perf_counter()
+                await asyncio.gather(*(run_client(url, i, args, timings, outcomes) for i in range(args.clients)))
+                wall = time.perf_counter() - start
+                return wall, await check_auth_and_limits(url)
+
+            wall, checks = asyncio.run(main())
+            server.should_exit = True
+
+    expected = args.clients * (args.batch + 2)
+    results = {
+        "clients": args.clients,
+        "batch": args.batch,
+        "tool_calls": args.clients * 3,
+        "ok_results": outcomes["ok"],
+        "expected_ok": expected,
+        "wall_seconds": round(wall, 2),
+        "progress_notifications": outcomes["progress_notes"],
+        **{f"{tool}_p{p}_ms": round(percentile(values, p), 1) for tool, values in timings.items() for p in (50, 95)},
+        "upstream_calls": {
+            "gemini_uploads": fakes["gemini"].files.uploads,
+            "gemini_generate": fakes["gemini"].models.calls,
+            "tts": fakes["tts"].calls,
+            "backend_analyze_calls": functions["_internal_analyze_video"].calls,
+        },
+        **checks,
+    }
+    results["passed"] = (outcomes["ok"] == expected and outcomes["progress_notes"] >= args.clients * 3
+                         and checks["unknown_token_status"] == 401 and "Rate limit" in checks["over_budget"]
+                         and functions["_internal_analyze_video"].calls < args.clients * (args.batch + 1))
+    return results
+
+
+def main(argv=None):
+    parser = build_parser(__doc__)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent MCP clients")
+    parser.add_argument("--batch", type=int, default=3, help="Questions per batch call")
+    args = parser.parse_args(argv)
+
+    print(f"🔌 {args.clients} MCP clients against the MCP server (fake backends)...")
+    results = run(args)
+    for key, value in results.items():
+        print(f"   {key:<38} {value}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
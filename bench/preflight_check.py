@@ -0,0 +1,197 @@
+"""
+Preflight Check - ffprobe metadata and upload decisions.
+
+Feeds recorded ffprobe outputs (a normal H.264 upload, a ProRes export, a
+3-hour low-bitrate recording, a long lecture, an audio-only file, an MP3
+with cover art and a truncated MP4) through both preflights:
+
+- hf_space/app.py: probe_media / preflight_video, then a full
+  process_interaction against a FakeVolume to check that rejected files are
+  never uploaded and never reach the backend
+- backend/modal_app.py: _parse_probe / _media_plan (reject, transcode,
+  low media resolution)
+
+and checks that both sides reject the same files. When ffmpeg is installed,
+real files generated with lavfi are probed as well.
+
+Usage:
+    python -m bench.preflight_check --out bench_preflight.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+from bench.e2e_bench import load_module
+from bench.fakes import FakeFunction, FakeVolume
+
+
+def stream(codec_type, codec_name, **extra):
+    return {"codec_type": codec_type, "codec_name": codec_name, **extra}
+
+
+def video_stream(codec, width=1920, height=1080, rate="30/1"):
+    return stream("video", codec, width=width, height=height, avg_frame_rate=rate, r_frame_rate=rate)
+
+
+def probe(duration, bit_rate, *streams, format_name="mov,mp4,m4a,3gp,3g2,mj2"):
+    return {"streams": list(streams),
+            "format": {"format_name": format_name, "duration": f"{duration:.6f}", "bit_rate": str(bit_rate)}}
+
+
+# name -> (ffprobe stdout, returncode, stderr, expected backend plan)
+CASES = {
+    "h264_1080p": (probe(95.2, 4_500_000, video_stream("h264"), stream("audio", "aac")), 0, "",
+                   {"error": False, "transcode": False, "low_resolution": False}),
+    "prores_export": (probe(42.0, 150_000_000, video_stream("prores", rate="24000/1001"), stream("audio", "pcm_s24le")),
+                      0, "", {"error": False, "transcode": True, "low_resolution": False}),
+    "lecture_50min": (probe(3000.0, 600_000, video_stream("h264", 1280, 720), stream("audio", "aac")), 0, "",
+                      {"error": False, "transcode": False, "low_resolution": True}),
+    "recording_3h": (probe(10800.0, 70_000, video_stream("h264", 640, 360, "15/1"), stream("audio", "aac")), 0, "",
+                     {"error": True}),
+    "audio_only": (probe(240.0, 128_000, stream("audio", "aac"), format_name="mov,mp4,m4a,3gp,3g2,mj2"), 0, "",
+                   {"error": True}),
+    "mp3_cover_art": (probe(180.0, 320_000, stream("audio", "mp3"),
+                            video_stream("mjpeg", 600, 600, "0/0") | {"disposition": {"attached_pic": 1}},
+                            format_name="mp3"), 0, "", {"error": True}),
+    "truncated_mp4": (None, 1, "[mov,mp4,m4a,3gp,3g2,mj2 @ 0x55] moov atom not found\nvideo.mp4: Invalid data",
+                      {"error": True}),
+}
+
+
+class RecordedFfprobe:
+    """subprocess.run replacement that returns a recorded ffprobe result."""
+
+    def __init__(self, stdout, returncode, stderr):
+        self.result = (json.dumps(stdout) if stdout is not None else "", returncode, stderr)
+
+    def __call__(self, cmd, **kwargs):
+        stdout, returncode, stderr = self.result
+        return subprocess.CompletedProcess(cmd, returncode, stdout=stdout, stderr=stderr)
+
+
+def check_recorded(space, backend):
+    results = {}
+    for name, (stdout, returncode, stderr, expected) in CASES.items():
+        fake = RecordedFfprobe(stdout, returncode, stderr)
+        space.subprocess.run = fake
+        media, space_error = space.preflight_video(f"/tmp/{name}.mp4", f"hash-{name}")
+        if stdout is None:
+            backend_media = {"error": stderr}
+        else:
+            backend_media = backend._parse_probe(stdout)
+        plan = backend._media_plan(backend_media)
+
+        same_fields = {k: v for k, v in media.items() if k != "content_hash"} == backend_media
+        plan_ok = all(bool(plan[key]) == value for key, value in expected.items())
+        results[name] = {
+            "media": backend_media,
+            "space_error": space_error,
+            "backend_plan": plan,
+            "passed": plan_ok and same_fields and bool(space_error) == bool(plan["error"]),
+        }
+    space.subprocess.run = subprocess.run
+    return results
+
+
+def check_no_upload_on_reject(space, backend, tmp):
+    """A rejected file never reaches the Volume or the backend, and fails fast."""
+    volume = FakeVolume(os.path.join(tmp, "volume"), rpc_latency=0.05)
+    analyze = FakeFunction(lambda *a, **k: "answer", 0.05)
+    space._modal_handles.update({"__volume__": volume, "_internal_analyze_video": analyze})
+    space.rate_limiter = space.RateLimiter(max_requests_per_hour=10 ** 9)
+
+    stdout, returncode, stderr, _ = CASES["truncated_mp4"]
+    space.subprocess.run = RecordedFfprobe(stdout, returncode, stderr)
+    path = os.path.join(tmp, "broken.mp4")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(20 * 1024 * 1024))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for history in space.process_interaction("What happens?", None, path, "bench", progress=lambda *a, **k: None):
+            pass
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    space.subprocess.run = subprocess.run
+    reply = history[-1]["content"]
+    return {
+        "reply": reply,
+        "reject_ms": round(elapsed_ms, 1),
+        "volume_uploads": len(os.listdir(volume.root)) if os.path.isdir(volume.root) else 0,
+        "backend_calls": analyze.calls,
+        "passed": reply.startswith("❌") and not analyze.calls and elapsed_ms < 1000,
+    }
+
+
+def check_real_files(space, backend, tmp):
+    """Probe real files made with ffmpeg's lavfi sources (skipped without ffmpeg)."""
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        return {"skipped": "ffmpeg/ffprobe not installed", "passed": True}
+    results = {}
+    files = {
+        "h264.mp4": ["-f", "lavfi", "-i", "testsrc=size=640x360:rate=25:duration=3",
+                     "-f", "lavfi", "-i", "sine=duration=3", "-c:v", "libx264", "-c:a", "aac", "-shortest"],
+        "audio.m4a": ["-f", "lavfi", "-i", "sine=duration=3", "-c:a", "aac"],
+    }
+    for name, args in files.items():
+        path = os.path.join(tmp, name)
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *args, path], check=True)
+        start = time.perf_counter()
+        media = backend._probe_media(path)
+        probe_ms = (time.perf_counter() - start) * 1000
+        results[name] = {"media": media, "plan": backend._media_plan(media), "probe_ms": round(probe_ms, 1),
+                         "space_matches": space.probe_media(path) == media}
+    broken = os.path.join(tmp, "broken.mp4")
+    with open(os.path.join(tmp, "h264.mp4"), 'rb') as src, open(broken, 'wb') as dst:
+        dst.write(src.read()[:2048])
+    results["truncated.mp4"] = {"plan": backend._media_plan(backend._probe_media(broken))}
+    results["passed"] = (results["h264.mp4"]["plan"]["error"] is None and results["audio.m4a"]["plan"]["error"]
+                         and results["truncated.mp4"]["plan"]["error"]
+                         and all(r["space_matches"] for r in (results["h264.mp4"], results["audio.m4a"])))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    print("🔍 Checking the media preflight...")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        backend = load_module("modal_app", "backend/modal_app.py")
+        space = load_module("space_app", "hf_space/app.py")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            "recorded": check_recorded(space, backend),
+            "reject_before_upload": check_no_upload_on_reject(space, backend, tmp),
+            "real_files": check_real_files(space, backend, tmp),
+        }
+
+    for name, result in results["recorded"].items():
+        plan = result["backend_plan"]
+        print(f"   {'✅' if result['passed'] else '❌'} {name:<14} error={bool(plan['error'])!s:<5} "
+              f"transcode={plan['transcode']!s:<5} low_resolution={plan['low_resolution']!s:<5} "
+              f"{(plan['error'] or '')[:60]}")
+    for name in ("reject_before_upload", "real_files"):
+        result = results[name]
+        print(f"   {'✅' if result['passed'] else '❌'} {name}: "
+              f"{json.dumps({k: v for k, v in result.items() if k != 'passed'})[:200]}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    passed = all(r["passed"] for r in results["recorded"].values()) and all(
+        results[name]["passed"] for name in ("reject_before_upload", "real_files"))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Resilience Check - the upstream call layer against a fault-injecting fake.
+
+Drives backend/modal_app.py's _call_upstream with FlakyUpstream and compares
+it with calling the fake directly:
+
+- tail latency: hedging after the recent p95 cuts the p99
+- transient errors: jittered retries turn 503s into successes
+- outage: the circuit breaker opens, fails fast, then closes after recovery
+- deadline: a hung call returns DeadlineExceeded on time
+
+Exits non-zero when any expectation fails.
+
+Usage:
+    python -m bench.resilience_check --calls 400 --out bench_resilience.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import modal_app  # noqa: E402
+
+from bench.common import percentile  # noqa: E402
+from bench.fakes import FlakyUpstream  # noqa: E402
+
+
+def drive(call, calls, concurrency=16):
+    """Run call() `calls` times; returns (latencies_ms, successes, errors by type)."""
+    def one(_):
+        start = time.perf_counter()
+        try:
+            call()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, type(e).__name__
+        return (time.perf_counter() - start) * 1000, ok, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(calls)))
+    errors = {}
+    for _, ok, error in results:
+        if not ok:
+            errors[error] = errors.get(error, 0) + 1
+    return [r[0] for r in results], sum(r[1] for r in results), errors
+
+
+def fresh_provider(name, **breaker_options):
+    modal_app._breakers[name] = modal_app.CircuitBreaker(name, **breaker_options)
+    return name
+
+
+def check_tail_latency(calls):
+    upstream = FlakyUpstream(latency=0.05, tail_latency=1.0, tail_rate=0.03, seed=1)
+    direct, _, _ = drive(upstream, calls)
+    provider = fresh_provider("fake-tail")
+    hedged, ok, _ = drive(lambda: modal_app._call_upstream(provider, "generate", upstream, 10, hedge=True), calls)
+    return {
+        "direct_p50_ms": round(percentile(direct, 50), 1),
+        "direct_p99_ms": round(percentile(direct, 99), 1),
+        "hedged_p50_ms": round(percentile(hedged, 50), 1),
+        "hedged_p99_ms": round(percentile(hedged, 99), 1),
+        "passed": ok == calls and percentile(hedged, 99) < percentile(direct, 99) / 2,
+    }
+
+
+def check_transient_errors(calls):
+    upstream = FlakyUpstream(latency=0.02, error_rate=0.2, seed=2)
+    _, direct_ok, _ = drive(upstream, calls)
+    provider = fresh_provider("fake-errors", failure_threshold=calls)
+    _, retried_ok, errors = drive(lambda: modal_app._call_upstream(provider, "generate", upstream, 10), calls)
+    return {
+        "direct_success_rate": round(direct_ok / calls, 3),
+        "retried_success_rate": round(retried_ok / calls, 3),
+        "errors": errors,
+        "passed": retried_ok / calls > 0.97,
+    }
+
+
+def check_outage(calls):
+    upstream = FlakyUpstream(latency=0.05, seed=3)
+    upstream.down = True
+    provider = fresh_provider("fake-outage", failure_threshold=5, reset_seconds=0.5)
+    latencies, _, errors = drive(
+        lambda: modal_app._call_upstream(provider, "generate", upstream, 10, max_attempts=1), calls, concurrency=1
+    )
+    calls_during_outage = upstream.calls
+    fast_fails = latencies[5:]
+
+    # Provider recovers; after the reset window a single probe closes the
+    # circuit (concurrent callers keep failing fast while it is in flight)
+    upstream.down = False
+    time.sleep(0.6)
+    modal_app._call_upstream(provider, "generate", upstream, 10)
+    _, recovered_ok, _ = drive(lambda: modal_app._call_upstream(provider, "generate", upstream, 10), 20)
+    return {
+        "upstream_calls_during_outage": calls_during_outage,
+        "errors": errors,
+        "fast_fail_p99_ms": round(percentile(fast_fails, 99), 2),
+        "recovered_success_rate": recovered_ok / 20,
+        "passed": (calls_during_outage == 5 and errors.get("CircuitOpenError") == calls - 5
+                   and percentile(fast_fails, 99) < 5 and recovered_ok == 20),
+    }
+
+
+def check_deadline():
+    upstream = FlakyUpstream(latency=0.01, tail_latency=5.0, tail_rate=1.0, seed=4)
+    provider = fresh_provider("fake-deadline", failure_threshold=100)
+    start = time.perf_counter()
+    try:
+        modal_app._call_upstream(provider, "generate", upstream, 0.3)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return {
+        "deadline_ms": 300,
+        "elapsed_ms": round(elapsed_ms, 1),
+        "error": error,
+        "passed": error == "DeadlineExceeded" and elapsed_ms < 400,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    print(f"🛡️ Checking the upstream call layer with {args.calls} calls per scenario...")
+    # Keep the per-call span lines out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {
+            "tail_latency": check_tail_latency(args.calls),
+            "transient_errors": check_transient_errors(args.calls),
+            "outage": check_outage(args.calls // 4),
+            "deadline": check_deadline(),
+        }
+    for name, result in results.items():
+        print(f"   {'✅' if result['passed'] else '❌'} {name}: {json.dumps(result)}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    sys.exit(0 if all(r["passed"] for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Routing Check - which Gemini tier _route_model picks for labelled questions.
+
+Runs backend/modal_app.py's router over short factual questions (expected on
+the fast tier) and reasoning-heavy ones (expected on the standard model), and
+estimates the latency change against sending everything to the standard model
+using per-tier latencies (defaults: fast 1.2s, standard 2.6s per answer).
+
+It then asks backend/modal_app.py (on the fakes from bench.e2e_bench) about a
+video with a digest: questions about the whole video's length are answered
+from the digest without a model call, while scoped ones ("How long is the
+bridge shown?") must reach the model.
+
+Exits non-zero when a complex question would be downgraded, when fewer than
+80% of the simple ones reach the fast tier, or when a digest question is
+routed the wrong way.
+
+Usage:
+    python -m bench.routing_check --fast-seconds 1.2 --standard-seconds 2.6
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import modal_app  # noqa: E402
+
+SIMPLE = [
+    "What color is the car?",
+    "Who is speaking at the start?",
+    "How many people are in the room?",
+    "Is there a dog in the video?",
+    "Where does the video take place?",
+    "What is written on the sign?",
+    "When does the music start?",
+    "Does anyone wear glasses?",
+    "Name the brand on the laptop.",
+    "How long is the video?",
+]
+COMPLEX = [
+    "Why does the presenter change the topic halfway through?",
+    "Explain how the machine works based on the demonstration.",
+    "Compare the first and second experiments.",
+    "What would happen if the last step were skipped?",
+    "How does the speaker's argument develop over the talk?",
+    "Analyze the interviewer's strategy in the final segment.",
+    "What is the relationship between the two characters, and how does it change?",
+    "Describe step by step what the chef does with the dough.",
+    "What are the main differences between the two products shown?",
+    "Who speaks first? What do they say? How does the audience react?",
+]
+# Answered from the digest of a 95 s video, without a model call
+LOCAL = {
+    "How long is the video?": "The video is about 1 minute and 35 seconds long.",
+    "What's the length of this video?": "The video is about 1 minute and 35 seconds long.",
+    "How many seconds is the video?": "The video is about 1 minute and 35 seconds long.",
+}
+# About part of the video: need the model even though they mention length
+SCOPED = [
+    "How long does the speaker talk about pricing?",
+    "How long is the bridge shown?",
+    "What's the length of the first scene?",
+    "How long is the video paused in the middle?",
+]
+
+
+def route(questions, duration):
+    return [modal_app._route_model(q, duration)[1] for q in questions]
+
+
+def check_digest_routing():
+    """Ask LOCAL and SCOPED questions about a digested video; returns a row per question."""
+    from bench.e2e_bench import build_parser, wire
+
+    args = build_parser().parse_args(["--rpc-latency", "0", "--upload-latency", "0", "--processing-seconds", "0",
+                                      "--generate-latency", "0", "--tts-first-chunk", "0", "--tts-chunk-latency", "0"])
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings(), \
+            contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        root = os.path.join(tmp, "volume")
+        backend = wire(args, root)[1]
+        gemini = backend._gemini_client(None)
+        os.makedirs(backend.DIGESTS_DIR, exist_ok=True)
+        with open(os.path.join(root, "routing.mp4"), "wb") as f:
+            f.write(os.urandom(1024))
+        with open(backend._digest_path("routing.mp4"), "w") as f:
+            json.dump({"duration_seconds": 95, "summary": "A presenter demonstrates a product.",
+                       "scenes": [{"start": 0, "end": 95, "description": "Demo", "objects": [], "speech": ""}]}, f)
+        for question in list(LOCAL) + SCOPED:
+            calls = gemini.models.calls
+            answer = backend._internal_analyze_video.local(question, "routing.mp4")
+            rows.append({"question": question, "model_calls": gemini.models.calls - calls, "answer": answer})
+        backend._volume_writes.flush()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=300, help="Video length in seconds")
+    parser.add_argument("--fast-seconds", type=float, default=1.2)
+    parser.add_argument("--standard-seconds", type=float, default=2.6)
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        simple, complex_ = route(SIMPLE, args.duration), route(COMPLEX, args.duration)
+    seconds = {"fast": args.fast_seconds, "standard": args.standard_seconds}
+
+    results = {
+        "simple_on_fast": sum(d["tier"] == "fast" for d in simple) / len(SIMPLE),
+        "complex_on_standard": sum(d["tier"] == "standard" for d in complex_) / len(COMPLEX),
+        "simple_mean_seconds": round(sum(seconds[d["tier"]] for d in simple) / len(SIMPLE), 2),
+        "complex_mean_seconds": round(sum(seconds[d["tier"]] for d in complex_) / len(COMPLEX), 2),
+        "baseline_mean_seconds": args.standard_seconds,
+        "downgraded": [q for q, d in zip(COMPLEX, complex_) if d["tier"] != "standard"],
+    }
+    digest_rows = check_digest_routing()
+    results["digest_misrouted"] = [
+        row["question"] for row in digest_rows
+        if (row["question"] in LOCAL) != (row["model_calls"] == 0)
+        or (row["question"] in LOCAL and row["answer"] != LOCAL[row["question"]])
+    ]
+    for question, decision in zip(SIMPLE + COMPLEX, simple + complex_):
+        print(f"   {decision['tier']:<9} {decision['score']:>3}  {question}  {decision['reasons']}")
+    for row in digest_rows:
+        print(f"   {'digest' if row['model_calls'] == 0 else 'model':<9} {row['model_calls']:>3}  {row['question']}")
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    sys.exit(0 if results["complex_on_standard"] == 1 and results["simple_on_fast"] >= 0.8
+             and not results["digest_misrouted"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Search Benchmark - BM25 video search at library scale.
+
+Builds a VideoSearchIndex over synthetic digests (Zipf-distributed vocabulary,
+realistic scene counts), then measures build time, index size on disk, cold
+load time, query latency percentiles and the cost of one incremental update.
+build_s includes generating the synthetic digests.
+
+Usage:
+    python -m bench.search_bench --videos 10000 --queries 500 --out bench_search.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from modal_app import VideoSearchIndex  # noqa: E402
+
+from bench.common import percentile  # noqa: E402
+
+
+def make_vocabulary(size, rng):
+    """Pronounceable fake words so tokenization behaves like real text."""
+    syllables = ["ka", "lo", "mi", "ter", "san", "du", "ve", "ro", "pa", "lin", "chi", "mor", "ex", "qua", "zen"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_digest(vocabulary, cum_weights, seed):
+    """Synthetic digest shaped like _internal_build_digest output (deterministic per seed)."""
+    rng = random.Random(seed)
+    
+    def sentence(n):
+        return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=n))
+    
+    duration = rng.uniform(30, 1800)
+    scene_count = rng.randint(5, 40)
+    step = duration / scene_count
+    return {
+        "duration_seconds": duration,
+        "summary": sentence(60),
+        "scenes": [
+            {
+                "start": round(i * step, 1),
+                "end": round((i + 1) * step, 1),
+                "description": sentence(rng.randint(10, 25)),
+                "objects": rng.choices(vocabulary, cum_weights=cum_weights, k=3),
+                "speech": sentence(rng.randint(0, 20)),
+            }
+            for i in range(scene_count)
+        ],
+    }
+
+
+def run(videos, queries, vocabulary_size, seed):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+    
+    # Digests are regenerated from their seed instead of kept in memory; the
+    # search reads the top results' digests back like search_videos does
+    def load_digest(video_filename):
+        return make_digest(vocabulary, cum_weights, video_filename)
+    
+    digests = (make_digest(vocabulary, cum_weights, f"video_{i:06d}.mp4") for i in range(videos))
+    index = VideoSearchIndex()
+    start = time.perf_counter()
+    for i, digest in enumerate(digests):
+        index.add(f"video_{i:06d}.mp4", digest)
+    build_s = time.perf_counter() - start
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search_index", "index.json")
+        start = time.perf_counter()
+        index.save(path)
+        save_s = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        
+        start = time.perf_counter()
+        index = VideoSearchIndex.load(path)
+        load_s = time.perf_counter() - start
+        
+        # One incremental update = add + full save (what the indexer does per batch)
+        start = time.perf_counter()
+        index.add("video_new.mp4", load_digest("video_new.mp4"))
+        index.save(path)
+        update_s = time.perf_counter() - start
+    
+    latencies = []
+    for _ in range(queries):
+        # Mix common and rare terms, like real searches
+        query = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=1) + rng.sample(vocabulary, k=2))
+        start = time.perf_counter()
+        index.search(query, top_k=10, load_digest=load_digest)
+        latencies.append((time.perf_counter() - start) * 1000)
+    
+    return {
+        "videos": videos,
+        "terms": len(index.postings),
+        "build_s": round(build_s, 2),
+        "save_s": round(save_s, 2),
+        "index_mb": round(size_mb, 1),
+        "load_s": round(load_s, 2),
+        "incremental_update_s": round(update_s, 2),
+        "query_p50_ms": round(percentile(latencies, 50), 2),
+        "query_p95_ms": round(percentile(latencies, 95), 2),
+        "query_p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+    
+    print(f"🔎 Benchmarking search over {args.videos} synthetic videos...")
+    results = run(args.videos, args.queries, args.vocabulary, args.seed)
+    for key, value in results.items():
+        print(f"   {key:<22} {value}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Singleflight Check - concurrent duplicate questions share one upstream call.
+
+Fires N identical questions at once at backend/modal_app.py's
+_internal_analyze_video (fakes from bench.e2e_bench, Files API path, one
+container) and checks that:
+
+- ok: Gemini sees one upload and one generate_content call, and every caller
+  gets the same answer
+- error: when generate_content fails, it is still called once and every
+  caller gets the same error
+- raw: SingleFlight itself runs the function once per in-flight key and
+  hands the leader's exception to every waiting caller
+
+Exits non-zero when any expectation fails.
+
+Usage:
+    python -m bench.singleflight_check --callers 16 --out bench_singleflight.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.e2e_bench import build_parser, wire
+
+QUESTION = "What is the presenter holding?"
+
+
+def duplicate_questions(callers, fail):
+    args = build_parser().parse_args(["--rpc-latency", "0", "--upload-latency", "0.2", "--processing-seconds", "0.2",
+                                      "--generate-latency", "0.5"])
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings(), \
+            contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        root = os.path.join(tmp, "volume")
+        backend = wire(args, root)[1]
+        backend.INLINE_MAX_BYTES = 0  # exercise the ingest coalescing as well
+        backend._request_digest = lambda video_filename: None  # only the questions call Gemini
+        gemini = backend._gemini_client(None)
+        with open(os.path.join(root, "flight.mp4"), "wb") as f:
+            f.write(os.urandom(1024))
+
+        generate_calls = []
+        generate = gemini.models.generate_content
+
+        def counted(*a, **kw):
+            generate_calls.append(time.monotonic())
+            if fail:
+                time.sleep(0.5)  # long enough for every duplicate to arrive
+                raise ValueError("400 INVALID_ARGUMENT. Request contains an invalid argument.")
+            return generate(*a, **kw)
+
+        gemini.models.generate_content = counted
+        barrier = threading.Barrier(callers)
+
+        def ask(_):
+            barrier.wait()
+            return backend._internal_analyze_video.local(QUESTION, "flight.mp4")
+
+        with ThreadPoolExecutor(max_workers=callers) as pool:
+            answers = list(pool.map(ask, range(callers)))
+        backend._volume_writes.flush()
+    return {
+        "callers": callers,
+        "uploads": gemini.files.uploads,
+        "generate_calls": len(generate_calls),
+        "distinct_answers": len(set(answers)),
+        "answer": answers[0][:80],
+        "passed": (gemini.files.uploads == 1 and len(generate_calls) == 1 and len(set(answers)) == 1
+                   and answers[0].startswith("❌") == fail),
+    }
+
+
+def raw_singleflight(callers):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+    import modal_app
+
+    flight = modal_app.SingleFlight()
+    runs = []
+    barrier = threading.Barrier(callers)
+
+    def leader_work():
+        runs.append(1)
+        time.sleep(0.3)
+        raise RuntimeError("upstream failed")
+
+    def call(_):
+        barrier.wait()
+        try:
+            flight.do("key", leader_work)
+        except RuntimeError as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        errors = list(pool.map(call, range(callers)))
+    # The key is free again once the leader finishes
+    after, shared = flight.do("key", lambda: "fresh")
+    return {
+        "runs": len(runs),
+        "callers_with_error": sum(e is not None for e in errors),
+        "same_exception": len({id(e) for e in errors}) == 1,
+        "next_call": after,
+        "passed": len(runs) == 1 and all(errors) and len({id(e) for e in errors}) == 1
+                  and after == "fresh" and not shared,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callers", type=int, default=16, help="Concurrent duplicate callers")
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    print(f"🔗 {args.callers} concurrent duplicates per scenario...")
+    results = {
+        "ok": duplicate_questions(args.callers, fail=False),
+        "error": duplicate_questions(args.callers, fail=True),
+        "raw": raw_singleflight(args.callers),
+    }
+    for name, result in results.items():
+        print(f"   {'✅' if result['passed'] else '❌'} {name}: {json.dumps(result, ensure_ascii=False)}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    sys.exit(0 if all(r["passed"] for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
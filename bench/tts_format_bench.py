@@ -0,0 +1,120 @@
+"""
+TTS Format Benchmark - audio format picked from the client's throughput.
+
+Runs hf_space/app.py's process_interaction against backend/modal_app.py on
+the fakes from bench.e2e_bench, once per simulated client downlink with the
+"Auto" audio quality, then once with an explicit Opus choice. For every
+answer it reports the chosen format, the audio size and the time until the
+embedded audio has downloaded, against the default 128 kbps MP3.
+
+It also checks that each (answer, format) pair is synthesized once: the
+second client that gets the same format is served from the speech cache.
+
+Usage:
+    python -m bench.tts_format_bench --downlinks 0.5,1,2,5,20 --out bench_tts_format.json
+"""
+
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+import warnings
+
+from bench.e2e_bench import QUESTIONS, SpanSink, build_parser, wire
+
+AUDIO_PATTERN = re.compile(r"data:(audio/[a-z]+);base64,([A-Za-z0-9+/=]+)")
+
+
+def ask(space, video, quality, downlink):
+    history = None
+    for history in space.process_interaction(QUESTIONS[0], None, video, "bench", audio_quality=quality,
+                                             downlink_mbps=downlink, progress=lambda *a, **k: None):
+        pass
+    content = history[-1]["content"]
+    match = AUDIO_PATTERN.search(content)
+    summary = next((line for line in content.splitlines() if line.startswith("🎧")), "")
+    return match, summary
+
+
+def run(args):
+    sink = SpanSink()
+    results = {"target_playback_s": None, "clients": []}
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings(), contextlib.redirect_stdout(sink):
+        warnings.simplefilter("ignore")
+        space, backend, fakes = wire(args, os.path.join(tmp, "volume"))
+        results["target_playback_s"] = space.AUDIO_PLAYBACK_TARGET_SECONDS
+        video = os.path.join(tmp, "video.mp4")
+        with open(video, 'wb') as f:
+            f.write(os.urandom(int(args.video_mb * 1024 * 1024)))
+
+        runs = [("Auto", downlink) for downlink in args.downlinks] + [("Data saver (Opus 32 kbps)", 1.0)]
+        for quality, downlink in runs:
+            calls_before = fakes["tts"].calls
+            match, summary = ask(space, video, quality, downlink)
+            audio_bytes = len(match.group(2)) * 3 // 4 if match else 0
+            tts_span = next(span for span in reversed(sink.spans)
+                            if span["component"] == "space" and span["stage"] == "tts")
+            output_format = tts_span["output_format"]
+            default_bytes = audio_bytes * 128 // space.AUDIO_FORMATS[output_format][1]
+            results["clients"].append({
+                "quality": quality,
+                "downlink_mbps": downlink,
+                "format": output_format,
+                "mime": match.group(1) if match else None,
+                "audio_kb": round(audio_bytes / 1024, 1),
+                "playback_s": round(space.playback_seconds(audio_bytes, downlink), 2),
+                "default_playback_s": round(space.playback_seconds(default_bytes, downlink), 2),
+                "synthesized": fakes["tts"].calls > calls_before,
+                "summary": summary,
+            })
+        backend._volume_writes.flush()
+        results["tts_calls_by_format"] = dict(fakes["tts"].formats)
+
+    clients = results["clients"]
+    auto = [c for c in clients if c["quality"] == "Auto"]
+    seen = set()
+    cache_ok = True
+    for client in clients:
+        # The answer text is the same every time, so only a new format needs synthesis
+        cache_ok &= client["synthesized"] == (client["format"] not in seen)
+        seen.add(client["format"])
+    results["passed"] = (
+        all(c["mime"] for c in clients)
+        and auto[-1]["format"] == "mp3_44100_128"
+        and all(c["playback_s"] <= results["target_playback_s"] or c["format"] == "mp3_22050_32" for c in auto)
+        and any(c["playback_s"] < c["default_playback_s"] for c in auto)
+        and clients[-1]["mime"] == "audio/ogg"
+        and cache_ok
+        and all(count == 1 for count in results["tts_calls_by_format"].values())
+    )
+    return results
+
+
+def main(argv=None):
+    parser = build_parser(__doc__)
+    parser.add_argument("--downlinks", type=lambda value: [float(v) for v in value.split(",")],
+                        default=[0.5, 1, 2, 5, 20], help="Client download throughputs (Mbps), slowest first")
+    args = parser.parse_args(argv)
+    args.downlinks = sorted(args.downlinks)
+
+    print(f"🎧 Picking audio formats for clients at {', '.join(f'{d:g}' for d in args.downlinks)} Mbps...")
+    results = run(args)
+    print(f"{'quality':<26} {'Mbps':>6} {'format':<14} {'KB':>7} {'play s':>7} {'128k s':>7} {'synth':>6}")
+    for c in results["clients"]:
+        print(f"{c['quality']:<26} {c['downlink_mbps']:>6g} {c['format']:<14} {c['audio_kb']:>7} "
+              f"{c['playback_s']:>7} {c['default_playback_s']:>7} {c['synthesized']!s:>6}")
+    print(f"   TTS calls by format: {results['tts_calls_by_format']}")
+    print(f"   e.g. {results['clients'][0]['summary']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+    print("✅ Formats follow throughput and are synthesized once each" if results["passed"]
+          else "❌ Audio format expectations not met")
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
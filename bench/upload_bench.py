@@ -0,0 +1,115 @@
+"""
+Upload Benchmark - modal CLI subprocesses vs the in-process SDK upload.
+
+Times the frontend's video upload both ways against a FakeVolume with the
+same per-call latency:
+
+- cli: one `python -m ...` process per upload that imports the modal CLI
+  and pays a connection handshake, like `os.system("modal volume put ...")`
+- sdk: frontend/app.py's upload_to_modal_volume (hf_space/volume_upload.py)
+  with the volume handle reused across calls
+
+The answer audio is returned by the TTS call itself, so there is no download
+to time.
+
+Usage:
+    python -m bench.upload_bench --rounds 10 --video-mb 20 --out bench_upload.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import percentile
+from bench.fakes import FakeVolume
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_frontend():
+    sys.path.insert(0, os.path.join(ROOT, "frontend"))  # volume_upload.py sits next to app.py
+    spec = importlib.util.spec_from_file_location("frontend_app", os.path.join(ROOT, "frontend", "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def cli_put(volume_root, local_path, remote_path, rpc_latency):
+    """Child process side: what a `modal volume put` invocation costs."""
+    import modal.cli.entry_point  # noqa: F401  (CLI startup cost)
+
+    vol = FakeVolume(volume_root, rpc_latency=rpc_latency)
+    time.sleep(rpc_latency)  # client handshake, paid by every CLI process
+    with vol.batch_upload(force=True) as batch:
+        batch.put_file(local_path, f"/{remote_path}")
+
+
+def time_cli(volume_root, local_path, remote_path, rpc_latency):
+    cmd = [sys.executable, "-m", "bench.upload_bench", "--cli-put", volume_root, local_path, remote_path,
+           "--rpc-latency", str(rpc_latency)]
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=ROOT, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(rounds, video_mb, rpc_latency):
+    frontend = load_frontend()
+    results = {"rounds": rounds, "video_mb": video_mb, "rpc_latency_ms": rpc_latency * 1000}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        volume_root = os.path.join(tmp, "volume")
+        video = os.path.join(tmp, "video.mp4")
+        with open(video, 'wb') as f:
+            f.write(os.urandom(video_mb * 1024 * 1024))
+        vol = FakeVolume(volume_root, rpc_latency=rpc_latency)
+
+        # One handshake for the whole process, then the handle is reused
+        time.sleep(rpc_latency)
+        frontend._modal_handles["__volume__"] = vol
+
+        timings = {"cli_upload": [], "sdk_upload": []}
+        for i in range(rounds):
+            timings["cli_upload"].append(time_cli(volume_root, video, f"cli_{i}.mp4", rpc_latency))
+
+            start = time.perf_counter()
+            ok, error = frontend.upload_to_modal_volume(video, f"sdk_{i}.mp4")
+            timings["sdk_upload"].append((time.perf_counter() - start) * 1000)
+            assert ok, error
+
+    for name, values in timings.items():
+        results[f"{name}_p50_ms"] = round(percentile(values, 50), 1)
+        results[f"{name}_p95_ms"] = round(percentile(values, 95), 1)
+    results["upload_speedup"] = round(results["cli_upload_p50_ms"] / results["sdk_upload_p50_ms"], 1)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--video-mb", type=int, default=20)
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="Seconds per volume round trip")
+    parser.add_argument("--out", help="Write results as JSON to this path")
+    parser.add_argument("--cli-put", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.cli_put:
+        cli_put(*args.cli_put, rpc_latency=args.rpc_latency)
+        return
+
+    print(f"📤 Benchmarking {args.rounds} uploads ({args.video_mb}MB)...")
+    results = run(args.rounds, args.video_mb, args.rpc_latency)
+    for key, value in results.items():
+        print(f"   {key:<22} {value}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import modal
 import os
 import time
 
+import volume_upload
+
 # --- 設定 ---
 # 這裡要跟你的 backend/modal_app.py 裡面的 App 名稱一樣
 APP_NAME = "mcp-video-agent"
@@ -12,7 +14,28 @@ VOLUME_NAME = "video-storage"
 # Structure: {video_path: unique_filename}
 uploaded_videos_cache = {}
 
-def process_interaction(user_message, history, video_file):
+# --- Modal SDK (same upload layer as hf_space/app.py, see volume_upload.py) ---
+# Handles are created once per process so every request reuses the same
+# client connection instead of spawning a `modal volume` CLI process.
+_modal_handles = {}
+
+def get_modal_function(function_name):
+    """Connect to Modal function"""
+    if function_name not in _modal_handles:
+        _modal_handles[function_name] = modal.Function.from_name(APP_NAME, function_name)
+    return _modal_handles[function_name]
+
+def get_modal_volume():
+    """Get Modal Volume for file operations"""
+    if "__volume__" not in _modal_handles:
+        _modal_handles["__volume__"] = modal.Volume.from_name(VOLUME_NAME)
+    return _modal_handles["__volume__"]
+
+def upload_to_modal_volume(local_path, remote_filename, progress=None):
+    """Upload file to Modal Volume using SDK batch_upload (progress(fraction) is optional)"""
+    return volume_upload.upload_to_modal_volume(get_modal_volume, local_path, remote_filename, progress)
+
+def process_interaction(user_message, history, video_file, progress=gr.Progress()):
     """
     Core Gradio logic:
     1. Check if video is uploaded -> upload to Modal
@@ -63,11 +86,13 @@ def process_interaction(user_message, history, video_file):
         print(f"📝 Using unique filename: {unique_filename}")
         
         # Upload to Modal volume
-        upload_cmd = f"modal volume put {VOLUME_NAME} '{local_path}' {unique_filename}"
-        exit_code = os.system(upload_cmd)
+        success, error_msg = upload_to_modal_volume(
+            local_path, unique_filename,
+            progress=lambda fraction: progress(fraction, desc="Uploading video")
+        )
         
-        if exit_code != 0:
-            yield history + [{"role": "assistant", "content": "❌ Video upload failed. Please check your network connection."}]
+        if not success:
+            yield history + [{"role": "assistant", "content": f"❌ Video upload failed: {error_msg}"}]
             return
         
         # Cache the uploaded video
@@ -76,11 +101,12 @@ def process_interaction(user_message, history, video_file):
 
     # 2. Connect to Modal functions
     try:
-        analyze_fn = modal.Function.from_name(APP_NAME, "_internal_analyze_video")
-        speak_fn = modal.Function.from_name(APP_NAME, "_internal_speak_text")
-        create_cache_fn = modal.Function.from_name(APP_NAME, "_internal_create_cache")
-        view_cache_fn = modal.Function.from_name(APP_NAME, "_internal_view_cache")
-        delete_cache_fn = modal.Function.from_name(APP_NAME, "_internal_delete_cache")
+        analyze_fn = get_modal_function("_internal_analyze_video")
+        speak_fn = get_modal_function("_internal_speak_text")
+        create_cache_fn = get_modal_function("_internal_create_cache")
+        view_cache_fn = get_modal_function("_internal_view_cache")
+        delete_cache_fn = get_modal_function("_internal_delete_cache")
+        usage_fn = get_modal_function("_internal_usage_report")
     except Exception as e:
         yield history + [{"role": "assistant", "content": f"❌ Backend connection failed: {str(e)}"}]
         return
@@ -166,6 +192,26 @@ def process_interaction(user_message, history, video_file):
         yield history
         return
 
+    if user_message.lower().strip() == "/usage":
+        # Token usage and implicit-cache hits for this video
+        history.append({"role": "user", "content": user_message})
+        history.append({"role": "assistant", "content": "📊 Loading token usage..."})
+        yield history
+        
+        try:
+            report = usage_fn.remote(unique_filename)
+            rows = report.get("videos", [])
+            if rows:
+                lines = [f"""- **{row['model']}**: {row['questions']} questions, cache hit {row['cache_hit_ratio']:.0%}, ~${row['est_cost_per_question_usd']:.4f}/question (saved ~{row['est_savings_ratio']:.0%})""" for row in rows]
+                history[-1] = {"role": "assistant", "content": "📊 **Token Usage**\n\n" + "\n".join(lines)}
+            else:
+                history[-1] = {"role": "assistant", "content": "📊 No questions recorded for this video yet."}
+        except Exception as e:
+            history[-1] = {"role": "assistant", "content": f"❌ Failed to load usage: {str(e)}"}
+        
+        yield history
+        return
+
     # Show "thinking" message
     history.append({"role": "user", "content": user_message})
     history.append({"role": "assistant", "content": "🤔 Gemini is analyzing the video..."})
@@ -187,51 +233,17 @@ def process_interaction(user_message, history, video_file):
         yield history
         
         try:
-            # Remote TTS generation - wait for it to complete
+            # Remote TTS generation - audio comes back in the call result, so
+            # concurrent sessions never share (or overwrite) an audio file
             print("🗣️ Generating TTS on Modal...")
-            tts_result = speak_fn.remote(text_response)
-            print(f"TTS result: {tts_result}")
-            
-            # Wait for Modal Volume to sync (important!)
-            print("⏳ Waiting for Modal Volume to sync...")
-            time.sleep(3)  # Give Modal Volume time to sync
+            audio_bytes = speak_fn.remote(text_response, return_bytes=True)
             
-            # Download audio with unique filename
-            local_audio_filename = f"audio_{unique_filename.replace('.mp4', '.mp3')}"
-            download_cmd = f"modal volume get {VOLUME_NAME} response.mp3 {local_audio_filename} --force"
-            print(f"📥 Downloading audio: {download_cmd}")
-            exit_code = os.system(download_cmd)
-            print(f"Download exit code: {exit_code}")
-            
-            # Wait for file to be fully written
-            time.sleep(1)
-            
-            # Retry logic if file is empty
-            max_retries = 3
-            for retry in range(max_retries):
-                if os.path.exists(local_audio_filename) and os.path.getsize(local_audio_filename) > 0:
-                    break
-                print(f"⏳ Retry {retry + 1}/{max_retries}: File not ready, waiting...")
-                time.sleep(2)
-                os.system(download_cmd)  # Try downloading again
-            
-            # Debug: Check file status
-            print(f"🔍 Checking file: {local_audio_filename}")
-            print(f"   Exists: {os.path.exists(local_audio_filename)}")
-            if os.path.exists(local_audio_filename):
-                print(f"   Size: {os.path.getsize(local_audio_filename)} bytes")
-            
-            # Check if file exists and has content
-            if os.path.exists(local_audio_filename) and os.path.getsize(local_audio_filename) > 0:
-                # Get absolute path for Gradio
-                abs_audio_path = os.path.abspath(local_audio_filename)
-                print(f"✅ Audio ready: {abs_audio_path} ({os.path.getsize(abs_audio_path)/1024:.1f}KB)")
+            if isinstance(audio_bytes, bytes) and len(audio_bytes) > 0:
+                print(f"✅ Audio ready ({len(audio_bytes)/1024:.1f}KB)")
                 
-                # Read audio file as base64 for reliable embedding
+                # Embed audio as base64 for reliable playback
                 import base64
-                with open(abs_audio_path, 'rb') as audio_file:
-                    audio_bytes = audio_file.read()
-                    audio_base64 = base64.b64encode(audio_bytes).decode()
+                audio_base64 = base64.b64encode(audio_bytes).decode()
                 
                 # Create response with embedded audio using HTML5 audio tag
                 # Using data URI ensures audio is part of the message and won't be overwritten
@@ -257,14 +269,10 @@ def process_interaction(user_message, history, video_file):
                 # No need to return separate audio path - it's embedded in the message
                 yield history
             else:
-                # If audio fails, show text response with debug info
-                debug_info = f"File exists: {os.path.exists(local_audio_filename)}"
-                if os.path.exists(local_audio_filename):
-                    debug_info += f", Size: {os.path.getsize(local_audio_filename)} bytes"
-                
+                # If audio fails, show text response with the TTS error
                 history[-1] = {
                     "role": "assistant", 
-                    "content": f"⚠️ Audio generation failed. ({debug_info})\n\nHere's the text response:\n\n<div style='background: black; color: lime; padding: 20px; border-radius: 10px; white-space: normal; word-wrap: break-word; overflow-wrap: break-word;'>{full_text_response}</div>"
+                    "content": f"⚠️ Audio generation failed. ({audio_bytes})\n\nHere's the text response:\n\n<div style='background: black; color: lime; padding: 20px; border-radius: 10px; white-space: normal; word-wrap: break-word; overflow-wrap: break-word;'>{full_text_response}</div>"
                 }
                 yield history
             
@@ -289,6 +297,7 @@ with gr.Blocks(title="MCP Video Agent") as demo:
 - `/upload` - Pre-upload video to Gemini (faster subsequent queries)
 - `/status` - Check upload status
 - `/clear` - Clear uploaded file
+- `/usage` - Token usage, implicit-cache hit ratio and cost per question
 
 **How it works:**
 1. Upload a video
@@ -0,0 +1 @@
+../hf_space/volume_upload.py
\ No newline at end of file
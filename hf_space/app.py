@@ -8,9 +8,48 @@ import gradio as gr
 import time
 import hashlib
 import base64
+import io
+import json
+import subprocess
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+# ==========================================
+# Tracing: Structured Per-Stage Latency Spans
+# ==========================================
+def new_request_id():
+    """Short ID shared by every span of one interaction (Space + backend)."""
+    return uuid.uuid4().hex[:12]
+
+@contextmanager
+def trace_span(request_id, stage, **attrs):
+    """
+    Time one stage of an interaction and print it as a JSON span.
+    
+    Same format as the backend spans, so `tools/latency_report.py` can
+    aggregate both logs into per-stage p50/p95/p99.
+    """
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        print(json.dumps({
+            "event": "span",
+            "component": "space",
+            "request_id": request_id,
+            "stage": stage,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "ts": time.time(),
+            **attrs
+        }), flush=True)
+
 # ==========================================
 # Security: Rate Limiting
 # ==========================================
@@ -54,12 +93,18 @@ rate_limiter = RateLimiter(max_requests_per_hour=MAX_REQUESTS_PER_HOUR)
 # Modal Connection
 # ==========================================
 import modal
+import volume_upload
+
+# Handles are created once per process so every request reuses the same
+# client connection instead of re-resolving the app and volume.
+_modal_handles = {}
 
 def get_modal_function(function_name):
     """Connect to Modal function"""
     try:
-        func = modal.Function.from_name("mcp-video-agent", function_name)
-        return func
+        if function_name not in _modal_handles:
+            _modal_handles[function_name] = modal.Function.from_name("mcp-video-agent", function_name)
+        return _modal_handles[function_name]
     except Exception as e:
         print(f"❌ Failed to connect to Modal: {e}")
         return None
@@ -67,50 +112,379 @@ def get_modal_function(function_name):
 def get_modal_volume():
     """Get Modal Volume for file operations"""
     try:
-        vol = modal.Volume.from_name("video-storage")
-        return vol
+        if "__volume__" not in _modal_handles:
+            _modal_handles["__volume__"] = modal.Volume.from_name("video-storage")
+        return _modal_handles["__volume__"]
     except Exception as e:
         print(f"❌ Failed to connect to Modal Volume: {e}")
         return None
 
-def upload_to_modal_volume(local_path, remote_filename):
-    """Upload file to Modal Volume using SDK batch_upload"""
+def upload_to_modal_volume(local_path, remote_filename, progress=None):
+    """Upload file to Modal Volume using SDK batch_upload (progress(fraction) is optional)"""
+    return volume_upload.upload_to_modal_volume(get_modal_volume, local_path, remote_filename, progress)
+
+# Chunked uploads: videos larger than one part go up as UPLOAD_PART_MB parts,
+# UPLOAD_PARALLELISM at a time, under uploads/<content hash>/; the backend checks
+# each part's SHA-256 and joins them. Parts already on the volume are not
+# re-sent, so a retry only uploads what is missing.
+UPLOAD_PART_MB = int(os.environ.get("UPLOAD_PART_MB", "8"))
+UPLOAD_PARALLELISM = int(os.environ.get("UPLOAD_PARALLELISM", "4"))
+UPLOAD_PART_ATTEMPTS = 3
+
+class UploadState:
+    """Progress of one upload, updated by the part workers and read by the chat loop."""
+    def __init__(self, total_bytes, parts=1):
+        self.total_bytes = max(total_bytes, 1)
+        self.parts = parts
+        self.sent_bytes = 0
+        self.done_bytes = 0
+        self.resumed_parts = 0
+        self.retries = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+    
+    def add(self, num_bytes, sent=True):
+        with self._lock:
+            self.done_bytes += num_bytes
+            if sent:
+                self.sent_bytes += num_bytes
+    
+    def count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+    
+    @property
+    def fraction(self):
+        return min(self.done_bytes / self.total_bytes, 1.0)
+    
+    @property
+    def mb_per_second(self):
+        elapsed = time.perf_counter() - self.started
+        return self.sent_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+
+def _uploaded_parts(vol, upload_id):
+    """Part sizes already on the volume from an earlier attempt ({} when none)."""
+    try:
+        entries = vol.listdir(f"/uploads/{upload_id}")
+    except Exception:
+        return {}
+    return {os.path.basename(entry.path): entry.size for entry in entries}
+
+def _upload_part(vol, local_path, upload_id, index, offset, size, state, existing):
+    """Upload one part (unless already there) and return its manifest entry."""
+    with open(local_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    part = {"index": index, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+    name = f"{index:05d}.part"
+    if existing.get(name) == len(data):
+        # Sizes match; the checksum is verified at assembly
+        state.count("resumed_parts")
+        state.add(len(data), sent=False)
+        return part
+    for attempt in range(UPLOAD_PART_ATTEMPTS):
+        try:
+            with vol.batch_upload(force=True) as batch:
+                batch.put_file(io.BytesIO(data), f"/uploads/{upload_id}/{name}")
+            state.add(len(data))
+            return part
+        except Exception as e:
+            if attempt == UPLOAD_PART_ATTEMPTS - 1:
+                raise
+            state.count("retries")
+            print(f"⚠️ Part {index} upload failed ({e}), retrying...")
+            time.sleep(0.5 * 2 ** attempt)
+
+def chunked_upload_to_modal_volume(local_path, remote_filename, upload_id, state):
+    """
+    Upload a file as parallel parts and have the backend assemble it.
+    
+    upload_id names the parts directory; using the content hash lets a
+    later attempt for the same bytes resume from the parts already uploaded.
+    """
     try:
         vol = get_modal_volume()
-        if vol is None:
-            return False, "Failed to connect to Modal Volume"
+        assemble_fn = get_modal_function("_internal_assemble_upload")
+        if vol is None or assemble_fn is None:
+            return False, "Failed to connect to Modal"
         
-        # Use batch_upload with put_file
-        with vol.batch_upload() as batch:
-            batch.put_file(local_path, f"/{remote_filename}")
+        part_bytes = UPLOAD_PART_MB * 1024 * 1024
+        total = os.path.getsize(local_path)
+        offsets = list(range(0, total, part_bytes))
+        existing = _uploaded_parts(vol, upload_id)
+        if existing:
+            print(f"♻️ Resuming upload {upload_id}: {len(existing)}/{len(offsets)} parts already uploaded")
         
-        print(f"✅ Uploaded to Modal Volume: {remote_filename}")
+        def upload(index, existing):
+            offset = offsets[index]
+            return _upload_part(vol, local_path, upload_id, index, offset, min(part_bytes, total - offset),
+                                state, existing)
+        
+        with ThreadPoolExecutor(max_workers=UPLOAD_PARALLELISM) as pool:
+            parts = list(pool.map(lambda i: upload(i, existing), range(len(offsets))))
+            result = assemble_fn.remote(upload_id, remote_filename, parts)
+            if result.get("status") == "incomplete":
+                # Lost or corrupted parts: send only those again
+                print(f"⚠️ Re-sending {len(result['missing'])} parts of {upload_id}")
+                state.count("retries", len(result["missing"]))
+                list(pool.map(lambda i: upload(i, {}), result["missing"]))
+                result = assemble_fn.remote(upload_id, remote_filename, parts)
+        
+        if result.get("status") != "assembled":
+            return False, result.get("error") or f"Upload incomplete: parts {result.get('missing')} missing"
+        print(f"✅ Uploaded to Modal Volume: {remote_filename} ({len(parts)} parts, "
+              f"{state.resumed_parts} resumed, {state.retries} retried)")
         return True, "Success"
     except Exception as e:
         print(f"❌ Upload error: {e}")
         return False, str(e)
 
-def download_from_modal_volume(remote_filename, local_path):
-    """Download file from Modal Volume using SDK read_file"""
+def upload_video(local_path, remote_filename, upload_id, state):
+    """Upload a video: in parts when it is larger than one part, else in one call."""
+    if os.path.getsize(local_path) > UPLOAD_PART_MB * 1024 * 1024:
+        return chunked_upload_to_modal_volume(local_path, remote_filename, upload_id, state)
+    
+    def progress(fraction):
+        state.add(int(fraction * state.total_bytes) - state.done_bytes)
+    return upload_to_modal_volume(local_path, remote_filename, progress=progress)
+
+def format_usage_summary(report):
+    """One-line cache-hit / cost summary from _internal_usage_report."""
+    rows = (report or {}).get("videos") or []
+    if not rows:
+        return ""
+    questions = sum(row["questions"] for row in rows)
+    prompt_tokens = sum(row["prompt_tokens"] for row in rows)
+    cached_tokens = sum(row["cached_tokens"] for row in rows)
+    cost = sum(row["est_cost_usd"] for row in rows)
+    hit_ratio = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+    return (f"💾 Implicit cache hit: {hit_ratio:.0%} of prompt tokens · "
+            f"~${cost / max(1, questions):.4f}/question ({questions} questions on this video)")
+
+def show_usage(video_file):
+    """Token usage of the current video, fetched when the user asks for it."""
+    if video_file is None:
+        return "Upload a video and ask a question first."
+    unique_filename = uploaded_videos_cache.get(f"{video_file}_{content_hash(video_file)[:8]}")
+    usage_fn = get_modal_function("_internal_usage_report")
+    if unique_filename is None or usage_fn is None:
+        return "Ask a question about this video first."
     try:
-        vol = get_modal_volume()
-        if vol is None:
-            return False
-        
-        # Clear file if exists
-        if os.path.exists(local_path):
-            os.remove(local_path)
-        
-        # Read file from volume (read_file returns an iterator of bytes)
-        with open(local_path, 'wb') as f:
-            for chunk in vol.read_file(f"/{remote_filename}"):
-                f.write(chunk)
-        
-        print(f"✅ Downloaded from Modal Volume: {remote_filename}")
-        return True
+        return format_usage_summary(usage_fn.remote(unique_filename)) or "No token usage recorded yet."
     except Exception as e:
-        print(f"❌ Download error: {e}")
-        return False
+        return f"⚠️ Usage report unavailable: {e}"
+
+# ==========================================
+# Media Preflight: ffprobe Before Upload
+# ==========================================
+# Same limits and fields as the backend preflight; videos it would reject are
+# rejected here before they are uploaded to the Volume
+MAX_VIDEO_MB = 100
+MAX_VIDEO_SECONDS = int(os.environ.get("MAX_VIDEO_SECONDS", "7200"))
+
+# Keyed by content hash, so re-uploads of the same bytes are not probed again
+media_cache = {}
+# (path, size, mtime) -> content hash, so follow-up questions don't re-read the file
+file_hashes = {}
+
+def content_hash(local_path):
+    """MD5 of the file contents, computed once per (path, size, mtime)."""
+    stat = os.stat(local_path)
+    key = (local_path, stat.st_size, stat.st_mtime_ns)
+    if key not in file_hashes:
+        digest = hashlib.md5()
+        with open(local_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(chunk)
+        file_hashes[key] = digest.hexdigest()
+    return file_hashes[key]
+
+def _parse_rate(value):
+    """Parse an ffprobe frame rate like "30000/1001" (None when absent or 0/0)."""
+    try:
+        num, _, den = str(value).partition("/")
+        rate = float(num) / float(den or 1)
+        return round(rate, 3) if rate > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def probe_media(local_path):
+    """
+    Duration, resolution, codecs, fps and bitrate via ffprobe.
+    
+    Returns {"error": ...} when the file cannot be read and None when ffprobe
+    is not installed (the backend probes instead).
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", local_path],
+            capture_output=True, text=True, timeout=15
+        )
+    except FileNotFoundError:
+        return None
+    except (OSError, subprocess.SubprocessError) as e:
+        return {"error": str(e)}
+    if result.returncode != 0:
+        return {"error": result.stderr.strip()[-300:] or f"ffprobe exited with {result.returncode}"}
+    try:
+        probe = json.loads(result.stdout or "{}")
+    except ValueError as e:
+        return {"error": f"Unreadable ffprobe output: {e}"}
+    
+    streams = probe.get("streams") or []
+    fmt = probe.get("format") or {}
+    video = next((st for st in streams if st.get("codec_type") == "video"
+                  and not (st.get("disposition") or {}).get("attached_pic")), None) or {}
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None) or {}
+    try:
+        duration = round(float(fmt.get("duration") or video.get("duration")), 3)
+    except (TypeError, ValueError):
+        duration = None
+    bitrate = fmt.get("bit_rate")
+    return {
+        "format": fmt.get("format_name"),
+        "duration_seconds": duration,
+        "bitrate": int(bitrate) if str(bitrate or "").isdigit() else None,
+        "video_codec": video.get("codec_name"),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "fps": _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+        "audio_codec": audio.get("codec_name"),
+    }
+
+def preflight_video(local_path, file_hash):
+    """
+    Probe a video once per content hash and check it against the limits.
+    
+    Returns:
+        tuple: (media or None, error message or None)
+    """
+    if file_hash not in media_cache:
+        media = probe_media(local_path)
+        if media is not None:
+            media["content_hash"] = file_hash
+        media_cache[file_hash] = media
+    media = media_cache[file_hash]
+    if media is None:
+        return None, None
+    duration = media.get("duration_seconds")
+    if media.get("error"):
+        return media, "This file could not be read as a video (corrupt or unsupported container)."
+    if not media.get("video_codec"):
+        return media, "This file has no video stream."
+    if duration and duration > MAX_VIDEO_SECONDS:
+        return media, (f"Video too long! Length: {duration / 60:.0f} minutes. "
+                       f"Please upload a video shorter than {MAX_VIDEO_SECONDS / 60:.0f} minutes.")
+    return media, None
+
+def describe_media(media):
+    """Short summary like "1920x1080 h264 30fps, 2:05" for the chat status."""
+    if not media or media.get("error"):
+        return ""
+    parts = []
+    if media.get("width") and media.get("height"):
+        parts.append(f"{media['width']}x{media['height']}")
+    if media.get("video_codec"):
+        parts.append(media["video_codec"])
+    if media.get("fps"):
+        parts.append(f"{media['fps']:g}fps")
+    summary = " ".join(parts)
+    if media.get("duration_seconds"):
+        minutes, seconds = divmod(int(media["duration_seconds"]), 60)
+        summary += f", {minutes}:{seconds:02d}"
+    return summary
+
+# ==========================================
+# Audio Format: Pick the Bitrate per Client
+# ==========================================
+# The answer's audio is embedded in the chat as a base64 data URI, so it plays
+# only after the whole message has downloaded. Formats match the backend's
+# TTS_FORMATS: ElevenLabs output_format -> (MIME type, kbps).
+AUDIO_FORMATS = {
+    "mp3_44100_128": ("audio/mpeg", 128),
+    "mp3_44100_64": ("audio/mpeg", 64),
+    "mp3_22050_32": ("audio/mpeg", 32),
+    "opus_48000_64": ("audio/ogg", 64),
+    "opus_48000_32": ("audio/ogg", 32),
+}
+DEFAULT_AUDIO_FORMAT = "mp3_44100_128"
+# Explicit choices in the UI; "Auto" picks an MP3 bitrate from the measured
+# throughput (Opus is opt-in because older Safari cannot play it)
+AUDIO_QUALITIES = {
+    "Auto": None,
+    "High (MP3 128 kbps)": "mp3_44100_128",
+    "Standard (MP3 64 kbps)": "mp3_44100_64",
+    "Data saver (MP3 32 kbps)": "mp3_22050_32",
+    "Data saver (Opus 32 kbps)": "opus_48000_32",
+}
+# Auto aims for the audio to start within this many seconds of the reply arriving
+AUDIO_PLAYBACK_TARGET_SECONDS = float(os.environ.get("AUDIO_PLAYBACK_TARGET_SECONDS", "1.0"))
+SPEECH_CHARS_PER_SECOND = 15  # ElevenLabs reads about 150 words per minute
+
+# Runs in the browser on page load: download throughput (Mbps) of the page's
+# own large assets from Resource Timing, else the Network Information estimate
+MEASURE_DOWNLINK_JS = """
+() => {
+    const big = performance.getEntriesByType("resource").filter(e => e.transferSize > 50000 && e.duration > 0);
+    if (big.length) {
+        const bits = big.reduce((total, e) => total + e.transferSize * 8, 0);
+        const ms = big.reduce((total, e) => total + e.duration, 0);
+        return Math.round(bits / ms / 10) / 100;
+    }
+    return navigator.connection ? navigator.connection.downlink : null;
+}
+"""
+
+def playback_seconds(audio_bytes, downlink_mbps):
+    """Seconds until audio embedded as base64 has downloaded at downlink_mbps."""
+    return audio_bytes * 4 / 3 * 8 / (downlink_mbps * 1_000_000)
+
+def choose_audio_format(quality, downlink_mbps, chars):
+    """
+    Pick the TTS output format for an answer of `chars` characters.
+    
+    An explicit quality wins. On Auto, the highest MP3 bitrate whose audio
+    downloads within AUDIO_PLAYBACK_TARGET_SECONDS at the client's measured
+    throughput (the lowest if none does); unknown throughput keeps the default.
+    """
+    explicit = AUDIO_QUALITIES.get(quality)
+    if explicit:
+        return explicit
+    if not downlink_mbps or downlink_mbps <= 0:
+        return DEFAULT_AUDIO_FORMAT
+    seconds = chars / SPEECH_CHARS_PER_SECOND
+    mp3 = sorted(((kbps, name) for name, (mime, kbps) in AUDIO_FORMATS.items() if mime == "audio/mpeg"), reverse=True)
+    for kbps, name in mp3:
+        if playback_seconds(kbps * 1000 / 8 * seconds, downlink_mbps) <= AUDIO_PLAYBACK_TARGET_SECONDS:
+            return name
+    return mp3[-1][1]
+
+def audio_savings(audio_bytes, output_format, downlink_mbps):
+    """
+    Bytes and time to playback saved against the default format.
+    
+    The default-format size is estimated from the bitrate ratio (both are
+    constant bitrate for speech). Returns a dict for the trace span and chat.
+    """
+    kbps = AUDIO_FORMATS[output_format][1]
+    baseline = audio_bytes * AUDIO_FORMATS[DEFAULT_AUDIO_FORMAT][1] / kbps
+    savings = {"format": output_format, "kbps": kbps, "kb": round(audio_bytes / 1024, 1),
+               "saved_kb": round((baseline - audio_bytes) / 1024, 1)}
+    if downlink_mbps and downlink_mbps > 0:
+        savings["downlink_mbps"] = downlink_mbps
+        savings["playback_s"] = round(playback_seconds(audio_bytes, downlink_mbps), 2)
+        savings["saved_s"] = round(playback_seconds(baseline - audio_bytes, downlink_mbps), 2)
+    return savings
+
+def format_audio_summary(savings):
+    """One-line audio size / savings summary for the chat."""
+    line = f"🎧 {savings['format'].split('_')[0].upper()} {savings['kbps']} kbps · {savings['kb']:g} KB"
+    if savings["saved_kb"] > 0:
+        line += f" ({savings['saved_kb']:g} KB smaller than {AUDIO_FORMATS[DEFAULT_AUDIO_FORMAT][1]} kbps"
+        if "saved_s" in savings:
+            line += f", plays ~{savings['saved_s']:g}s sooner at {savings['downlink_mbps']:g} Mbps"
+        line += ")"
+    return line
 
 # ==========================================
 # Gradio Interface Logic
@@ -119,15 +493,29 @@ def download_from_modal_volume(remote_filename, local_path):
 # Cache for uploaded videos
 uploaded_videos_cache = {}
 
-def process_interaction(user_message, history, video_file, username, request: gr.Request):
+# Text-only conversation per (session, video), sent to the backend as history
+conversations = defaultdict(list)
+MAX_CONVERSATION_TURNS = 40
+# How often the chat shows upload progress
+UPLOAD_STATUS_SECONDS = 0.5
+
+def process_interaction(user_message, history, video_file, username, clip_start=None, clip_end=None,
+                        audio_quality="Auto", downlink_mbps=None,
+                        request: gr.Request = None, progress=gr.Progress()):
     """
     Core chatbot logic with Modal backend and security.
+    
+    clip_start / clip_end (seconds) optionally restrict the question to a
+    time range, so only that span of the video is processed. audio_quality
+    and downlink_mbps (measured in the browser) pick the audio format.
     """
     if history is None:
         history = []
+    new_chat = len(history) == 0
     
     # Get user identifier for rate limiting
     user_id = username  # Use authenticated username
+    request_id = new_request_id()
     
     # ⭐ IMMEDIATELY show user message and "thinking" status
     history = history + [{"role": "user", "content": user_message}]
@@ -155,14 +543,24 @@ def process_interaction(user_message, history, video_file, username, request: gr
     
     # Check file size (100MB limit)
     file_size_mb = os.path.getsize(local_path) / (1024 * 1024)
-    if file_size_mb > 100:
-        history[-1] = {"role": "assistant", "content": f"❌ Video too large! Size: {file_size_mb:.1f}MB. Please upload a video smaller than 100MB."}
+    if file_size_mb > MAX_VIDEO_MB:
+        history[-1] = {"role": "assistant", "content": f"❌ Video too large! Size: {file_size_mb:.1f}MB. Please upload a video smaller than {MAX_VIDEO_MB}MB."}
         yield history
         return
     
     # Generate unique filename
-    with open(local_path, 'rb') as f:
-        file_hash = hashlib.md5(f.read()).hexdigest()[:8]
+    with trace_span(request_id, "hash", mb=round(file_size_mb, 1)):
+        full_hash = content_hash(local_path)
+    file_hash = full_hash[:8]
+    
+    # Reject corrupt, audio-only and overly long files before uploading them
+    with trace_span(request_id, "preflight") as attrs:
+        media, preflight_error = preflight_video(local_path, full_hash)
+        attrs.update(probed=media is not None, rejected=preflight_error is not None)
+    if preflight_error:
+        history[-1] = {"role": "assistant", "content": f"❌ {preflight_error}"}
+        yield history
+        return
     
     timestamp = int(time.time())
     unique_filename = f"video_{timestamp}_{file_hash}.mp4"
@@ -170,11 +568,29 @@ def process_interaction(user_message, history, video_file, username, request: gr
     
     # 2. Upload to Modal Volume if needed
     if cache_key not in uploaded_videos_cache:
-        history[-1] = {"role": "assistant", "content": f"📤 Uploading video ({file_size_mb:.1f}MB)... This may take a moment."}
+        details = describe_media(media)
+        status = f"📤 Uploading video ({file_size_mb:.1f}MB{', ' + details if details else ''})"
+        history[-1] = {"role": "assistant", "content": f"{status}... This may take a moment."}
         yield history
         
         try:
-            success, error_msg = upload_to_modal_volume(local_path, unique_filename)
+            part_bytes = UPLOAD_PART_MB * 1024 * 1024
+            state = UploadState(os.path.getsize(local_path), parts=-(-os.path.getsize(local_path) // part_bytes))
+            with trace_span(request_id, "volume_upload", mb=round(file_size_mb, 1), parts=state.parts) as attrs:
+                # Upload on a worker thread and stream its progress into the chat
+                with ThreadPoolExecutor(max_workers=1) as uploader:
+                    future = uploader.submit(upload_video, local_path, unique_filename, full_hash, state)
+                    while True:
+                        try:
+                            success, error_msg = future.result(timeout=UPLOAD_STATUS_SECONDS)
+                            break
+                        except FuturesTimeout:
+                            progress(state.fraction, desc="Uploading video")
+                            history[-1] = {"role": "assistant", "content": f"{status}... {state.fraction:.0%} "
+                                           f"({state.mb_per_second:.1f} MB/s)"}
+                            yield history
+                attrs.update(resumed_parts=state.resumed_parts, retries=state.retries,
+                             sent_mb=round(state.sent_bytes / (1024 * 1024), 1))
             
             if not success:
                 history[-1] = {"role": "assistant", "content": f"❌ Upload failed: {error_msg}"}
@@ -184,9 +600,6 @@ def process_interaction(user_message, history, video_file, username, request: gr
             uploaded_videos_cache[cache_key] = unique_filename
             print(f"✅ Video uploaded: {unique_filename}")
             
-            # Brief pause to ensure volume sync
-            time.sleep(1)
-            
         except Exception as e:
             history[-1] = {"role": "assistant", "content": f"❌ Upload error: {str(e)}"}
             yield history
@@ -196,6 +609,13 @@ def process_interaction(user_message, history, video_file, username, request: gr
         history[-1] = {"role": "assistant", "content": "♻️ Using cached video..."}
         yield history
     
+    # Conversation context for follow-up questions (reset when the chat is cleared)
+    session_id = getattr(request, "session_hash", None) or user_id
+    conversation_key = (session_id, unique_filename)
+    if new_chat:
+        conversations.pop(conversation_key, None)
+    conversation = conversations[conversation_key]
+    
     # 3. Analyze video via Modal
     history[-1] = {"role": "assistant", "content": "🤔 Analyzing video with Gemini..."}
     yield history
@@ -207,12 +627,31 @@ def process_interaction(user_message, history, video_file, username, request: gr
             yield history
             return
         
-        text_response = analyze_fn.remote(user_message, video_filename=unique_filename)
+        with trace_span(request_id, "analyze"):
+            text_response = analyze_fn.remote(
+                user_message,
+                video_filename=unique_filename,
+                request_id=request_id,
+                sent_at=time.time(),
+                history=list(conversation),
+                start_seconds=clip_start,
+                end_seconds=clip_end,
+                media=media
+            )
     except Exception as e:
         text_response = f"❌ Analysis error: {str(e)}"
     
     full_text_response = text_response
     
+    if "❌" not in text_response and "⚠️" not in text_response:
+        conversation.extend([
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": text_response},
+        ])
+        if len(conversation) > MAX_CONVERSATION_TURNS:
+            # Drop a multiple of 4 turns so the backend's summary blocks stay aligned
+            del conversation[:MAX_CONVERSATION_TURNS // 2]
+    
     # 4. Generate audio if successful
     if "❌" not in text_response and "⚠️" not in text_response:
         history[-1] = {"role": "assistant", "content": "🗣️ Generating audio response..."}
@@ -225,39 +664,31 @@ def process_interaction(user_message, history, video_file, username, request: gr
                 yield history
                 return
             
-            audio_filename = f"audio_{unique_filename.replace('.mp4', '.mp3')}"
-            speak_fn.remote(text_response, audio_filename=audio_filename)
-            
-            # Download audio using SDK
-            time.sleep(3)  # Wait for TTS to complete
-            local_audio = f"/tmp/{audio_filename}"
+            # Audio comes back in the call result, so concurrent sessions never share a file
+            output_format = choose_audio_format(audio_quality, downlink_mbps, len(text_response))
+            with trace_span(request_id, "tts", output_format=output_format) as attrs:
+                audio_bytes = speak_fn.remote(
+                    text_response,
+                    request_id=request_id,
+                    sent_at=time.time(),
+                    return_bytes=True,
+                    output_format=output_format
+                )
+                attrs["bytes"] = len(audio_bytes) if isinstance(audio_bytes, bytes) else 0
+                if attrs["bytes"]:
+                    savings = audio_savings(attrs["bytes"], output_format, downlink_mbps)
+                    attrs.update({key: savings[key] for key in ("saved_kb", "saved_s") if key in savings})
             
-            # Remove old file if exists
-            if os.path.exists(local_audio):
-                os.remove(local_audio)
-            
-            max_retries = 3
-            for retry in range(max_retries):
-                success = download_from_modal_volume(audio_filename, local_audio)
-                
-                if success and os.path.exists(local_audio) and os.path.getsize(local_audio) > 1000:
-                    break
-                
-                # Clean up partial file
-                if os.path.exists(local_audio):
-                    os.remove(local_audio)
-                    
-                time.sleep(2)
-            
-            if os.path.exists(local_audio) and os.path.getsize(local_audio) > 1000:
-                with open(local_audio, 'rb') as f:
-                    audio_bytes = f.read()
+            if isinstance(audio_bytes, bytes) and len(audio_bytes) > 1000:
+                with trace_span(request_id, "encode"):
                     audio_base64 = base64.b64encode(audio_bytes).decode()
                 
+                mime_type = AUDIO_FORMATS[output_format][0]
                 response_content = f"""🎙️ **Audio Response** ({remaining} requests remaining this hour)
+{format_audio_summary(savings)}
 
 <audio controls autoplay style="width: 100%; margin: 10px 0; background: #f0f0f0; border-radius: 5px;">
-    <source src="data:audio/mpeg;base64,{audio_base64}" type="audio/mpeg">
+    <source src="data:{mime_type};base64,{audio_base64}" type="{mime_type}">
 </audio>
 
 **📝 Full Text Response:**
@@ -344,6 +775,17 @@ with gr.Blocks(title="🎥 MCP Video Agent") as demo:
         with gr.Column(scale=1):
             video_input = gr.Video(label="📹 Upload Video (MP4)", sources=["upload"])
             gr.Markdown("**Supported:** MP4, max 100MB")
+            with gr.Accordion("⏱️ Ask about a time range (optional)", open=False):
+                with gr.Row():
+                    clip_start_input = gr.Number(label="Start (s)", value=None, minimum=0)
+                    clip_end_input = gr.Number(label="End (s)", value=None, minimum=0)
+                gr.Markdown("Only this part of the video is analyzed - faster and cheaper for long videos.")
+            audio_quality_input = gr.Radio(list(AUDIO_QUALITIES), value="Auto", label="🎧 Audio quality",
+                                           info="Auto picks a lower bitrate on slow connections so audio starts sooner.")
+            downlink_input = gr.Number(value=None, visible=False)
+            with gr.Accordion("📊 Token usage", open=False):
+                usage_output = gr.Markdown()
+                usage_btn = gr.Button("Refresh usage for this video", size="sm")
         
         with gr.Column(scale=2):
             chatbot = gr.Chatbot(label="💬 Conversation", height=500)
@@ -369,17 +811,22 @@ with gr.Blocks(title="🎥 MCP Video Agent") as demo:
         return request.username if hasattr(request, 'username') else "anonymous"
     
     demo.load(set_username, None, username_state)
+    demo.load(None, None, downlink_input, js=MEASURE_DOWNLINK_JS)
     
     # Event handlers
+    usage_btn.click(show_usage, inputs=[video_input], outputs=[usage_output])
+    
     submit_btn.click(
         process_interaction,
-        inputs=[msg, chatbot, video_input, username_state],
+        inputs=[msg, chatbot, video_input, username_state, clip_start_input, clip_end_input,
+                audio_quality_input, downlink_input],
         outputs=[chatbot]
     )
     
     msg.submit(
         process_interaction,
-        inputs=[msg, chatbot, video_input, username_state],
+        inputs=[msg, chatbot, video_input, username_state, clip_start_input, clip_end_input,
+                audio_quality_input, downlink_input],
         outputs=[chatbot]
     )
 
@@ -0,0 +1,58 @@
+"""
+Modal Volume upload shared by hf_space/app.py and frontend/app.py.
+
+frontend/volume_upload.py is a symlink to this file, so each app still
+deploys as a self-contained directory while the upload code lives here.
+"""
+
+import os
+
+
+class ProgressReader:
+    """
+    File wrapper that reports read progress to a callback.
+    
+    The SDK reads the file once to hash it and once to send it; hashing is
+    local and fast, so the reported position effectively tracks the upload.
+    v2 volumes read through a duplicated descriptor, so they only report
+    the start and the end.
+    """
+    def __init__(self, f, total, progress):
+        self._f = f
+        self._total = max(total, 1)
+        self._progress = progress
+    
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._progress(min(self._f.tell() / self._total, 1.0))
+        return data
+    
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def upload_to_modal_volume(get_volume, local_path, remote_filename, progress=None):
+    """
+    Upload file to the volume from get_volume() using SDK batch_upload.
+
+    progress(fraction) is optional. Returns (success, message).
+    """
+    try:
+        vol = get_volume()
+        if vol is None:
+            return False, "Failed to connect to Modal Volume"
+        
+        if progress:
+            progress(0.0)
+        with open(local_path, 'rb') as f:
+            source = ProgressReader(f, os.path.getsize(local_path), progress) if progress else f
+            with vol.batch_upload(force=True) as batch:
+                batch.put_file(source, f"/{remote_filename}")
+        if progress:
+            progress(1.0)
+        
+        print(f"✅ Uploaded to Modal Volume: {remote_filename}")
+        return True, "Success"
+    except Exception as e:
+        print(f"❌ Upload error: {e}")
+        return False, str(e)
@@ -0,0 +1,129 @@
+"""
+Latency Report - aggregate JSON span logs into per-stage percentiles.
+
+Both the HF Space (`process_interaction`) and the Modal backend print one JSON
+object per timed stage, tagged with the same request ID:
+
+    {"event": "span", "component": "backend", "request_id": "3f9c...",
+     "stage": "generate", "duration_ms": 2140.3, "ts": 1760000000.0}
+
+Usage:
+    modal app logs mcp-video-agent > backend.log
+    python tools/latency_report.py backend.log space.log
+    python tools/latency_report.py --json < combined.log
+    python tools/latency_report.py --request 3f9c0a1b2c3d backend.log space.log
+    python tools/latency_report.py --by model backend.log   # generate per Gemini tier
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+
+def parse_spans(lines):
+    """Yield span records from log lines (non-JSON lines and prefixes are skipped)."""
+    for line in lines:
+        start = line.find('{"event"')
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if record.get("event") == "span" and "duration_ms" in record:
+            yield record
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a non-empty list."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(spans, by=None):
+    """
+    Aggregate spans per (component, stage).
+    
+    Args:
+        spans: Parsed span records
+        by: Optional span attribute to split stages on, e.g. "model" turns
+            "generate" into "generate[gemini-2.5-flash]" and so on
+    
+    Returns:
+        list of dicts sorted by total time spent, largest first
+    """
+    by_stage = defaultdict(list)
+    for record in spans:
+        stage = record["stage"]
+        if by and record.get(by) is not None:
+            stage = f"{stage}[{record[by]}]"
+        by_stage[(record.get("component", "?"), stage)].append(record["duration_ms"])
+    
+    rows = []
+    for (component, stage), durations in by_stage.items():
+        rows.append({
+            "component": component,
+            "stage": stage,
+            "count": len(durations),
+            "p50_ms": round(percentile(durations, 50), 1),
+            "p95_ms": round(percentile(durations, 95), 1),
+            "p99_ms": round(percentile(durations, 99), 1),
+            "max_ms": round(max(durations), 1),
+            "total_ms": round(sum(durations), 1),
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows
+
+
+def format_table(rows):
+    """Render summary rows as a fixed-width text table."""
+    header = f"{'component':<10} {'stage':<34} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append(
+            f"{row['component']:<10} {row['stage']:<34} {row['count']:>6} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}"
+        )
+    if rows:
+        lines.append("")
+        lines.append(f"Dominant stage (total time): {rows[0]['component']}.{rows[0]['stage']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", help="Log files (default: stdin)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    parser.add_argument("--request", help="Only show the timeline of one request ID")
+    parser.add_argument("--by", metavar="ATTR", help="Split stages by a span attribute (e.g. model, tier)")
+    args = parser.parse_args(argv)
+    
+    spans = []
+    if args.logs:
+        for path in args.logs:
+            with open(path, "r", errors="replace") as f:
+                spans.extend(parse_spans(f))
+    else:
+        spans.extend(parse_spans(sys.stdin))
+    
+    if args.request:
+        timeline = sorted((s for s in spans if s.get("request_id") == args.request), key=lambda s: s["ts"])
+        for record in timeline:
+            print(f"{record['component']:<10} {record['stage']:<18} {record['duration_ms']:>9.1f} ms")
+        return
+    
+    rows = summarize(spans, by=args.by)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(format_table(rows))
+
+
+if __name__ == "__main__":
+    main()